@@ -1,16 +1,29 @@
-from typing import Optional, Union
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
 from starlette.requests import Request
 from fastapi.exceptions import RequestValidationError
-from starlette.responses import JSONResponse
-from fastapi.responses import RedirectResponse
-from fastapi import FastAPI
+from starlette.responses import JSONResponse, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi import FastAPI, Query
 from typing import List, Optional
 import pydantic
 from enum import Enum
 import os
 import pymongo
-from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from datetime import datetime, timedelta, timezone
 import logging
+import asyncio
+import orjson
+import base64
+import bson
+from cache import DataVersions, ResponseCache
+from canvas import CanvasState
+from heatmap import HeatmapCounts
+from rollups import BACKFILLS, HEATMAP_CHECKPOINTS, HEATMAP_HOURLY, REBUILD_BUILDING, REBUILD_BUILT, REBUILD_CLEARED, REBUILD_PENDING, ROLLUP_DEPENDENTS, ROLLUP_PIPELINES, ROLLUP_UPDATES, STATS_HOURLY, STATS_PIXELS, STATS_USERS, rebuild_pipeline, rebuild_request
+from metrics import DatabaseCommandTimer, REQUEST_SECONDS
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.routing import Match
+import time
 
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -25,12 +38,71 @@ app = FastAPI(
 )
 
 
-__DB = pymongo.MongoClient(os.environ["MONGODB_URI"])
+__DB = AsyncIOMotorClient(
+    os.environ["MONGODB_URI"],
+    maxPoolSize=int(os.environ.get("MONGODB_MAX_POOL_SIZE", 100)),
+    minPoolSize=int(os.environ.get("MONGODB_MIN_POOL_SIZE", 0)),
+    event_listeners=[DatabaseCommandTimer()])
 
 __DB_PIXINFO = __DB["plcgxrm"]["pixels-info"]
+__DB_PIXLATEST = __DB["plcgxrm"]["pixels-latest"]
+__DB_USERS = __DB["plcgxrm"]["users"]
 __DB_TLS = __DB["plcgxrm"]["timelapses"]
+__DB_VERSIONS = __DB["plcgxrm"]["versions"]
+__DB_CHECKPOINTS = __DB["plcgxrm"]["canvas-checkpoints"]
+__DB_STATS_USERS = __DB["plcgxrm"][STATS_USERS]
+__DB_STATS_HOURLY = __DB["plcgxrm"][STATS_HOURLY]
+__DB_STATS_PIXELS = __DB["plcgxrm"][STATS_PIXELS]
+__DB_HEATMAP_HOURLY = __DB["plcgxrm"][HEATMAP_HOURLY]
+__DB_HEATMAP_CHECKPOINTS = __DB["plcgxrm"][HEATMAP_CHECKPOINTS]
+__DB_BACKFILLS = __DB["plcgxrm"][BACKFILLS]
+__DB_BOARD = __DB["plcgxrm"]["board"]
 # __DB_CANVASIMAGES = __DB["plcgxrm"]["pixels-info"]
 
+_STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 1000))
+_NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# The documents were validated by the parser (or by the endpoint) when they were written, so reads only project
+# the fields of the response models and encode the documents as they are, without building the models again.
+_PIXEL_PROJECTION = {"_id": 0, "point": 1, "modified": 1, "colour": 1, "editorID": 1, "user": 1}
+_TIMELAPSE_PROJECTION = {"_id": 0, "name": 1, "date": 1, "interval_time": 1, "downloadURLs": 1, "snapshotURL": 1}
+_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 500))
+_PAGE_SIZE_MAX = int(os.environ.get("HISTORY_PAGE_SIZE_MAX", 5000))
+_EPOCH = datetime(1970, 1, 1)
+_REGION_MAX_AREA = int(os.environ.get("REGION_MAX_AREA", 250000))
+_REGION_MAX_RESULTS = int(os.environ.get("REGION_MAX_RESULTS", 200000))
+_STATS_TOP_SIZE = int(os.environ.get("STATS_TOP_SIZE", 100))
+_STATS_TOP_SIZE_MAX = int(os.environ.get("STATS_TOP_SIZE_MAX", 1000))
+_STATS_HOURLY_MAX_HOURS = int(os.environ.get("STATS_HOURLY_MAX_HOURS", 24 * 90))
+
+_VERSION_PIXELS = "pixels"
+# Bumped by the parser for the pixels it inserts late, and by the API when a rollup is rebuilt: the settled history changed.
+_VERSION_PIXELS_HISTORY = "pixels-history"
+_VERSION_BOARD = "board"
+_VERSION_TIMELAPSES = "timelapses"
+
+__RESPONSE_CACHE = ResponseCache(
+    maxEntries=int(os.environ.get("RESPONSE_CACHE_SIZE", 256)),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 60)))
+_CANVAS_CHECKPOINT_INTERVAL = timedelta(seconds=int(os.environ.get("CANVAS_CHECKPOINT_INTERVAL", 3600)))
+_CANVAS_CHECKPOINT_DELAY = timedelta(seconds=int(os.environ.get("CANVAS_CHECKPOINT_DELAY", 300)))
+_CANVAS_TIME_BUCKET = int(os.environ.get("CANVAS_TIME_BUCKET", 60))
+# Pixels carry the ObjectId of their insert, made on the clock of the parser, which is trusted to within this.
+_INSERT_CLOCK_SLACK = timedelta(seconds=60)
+
+__CANVAS_CACHE = ResponseCache(
+    maxEntries=int(os.environ.get("CANVAS_CACHE_SIZE", 32)),
+    ttl=float(os.environ.get("CANVAS_CACHE_TTL", 3600)))
+_HEATMAP_CHECKPOINT_INTERVAL = timedelta(hours=int(os.environ.get("HEATMAP_CHECKPOINT_HOURS", 24)))
+_HEATMAP_CHECKPOINT_DELAY = timedelta(seconds=int(os.environ.get("HEATMAP_CHECKPOINT_DELAY", 3600)))
+
+__HEATMAP_CACHE = ResponseCache(
+    maxEntries=int(os.environ.get("HEATMAP_CACHE_SIZE", 32)),
+    ttl=float(os.environ.get("HEATMAP_CACHE_TTL", 3600)))
+_ROLLUP_BUILD_MARGIN = timedelta(seconds=int(os.environ.get("ROLLUP_BUILD_MARGIN", 60)))
+_ROLLUP_BUILD_STALL = timedelta(seconds=int(os.environ.get("ROLLUP_BUILD_STALL", 600)))
+_ROLLUP_BUILD_BATCH_SIZE = int(os.environ.get("ROLLUP_BUILD_BATCH_SIZE", 1000))
+__DATA_VERSIONS = DataVersions(__DB_VERSIONS, refreshInterval=float(os.environ.get("DATA_VERSION_REFRESH_INTERVAL", 1)))
+
 
 class ErrorTypes(Enum):
     """
@@ -44,6 +116,9 @@ class ErrorTypes(Enum):
     WRONG_API_KEY = "WRONG_API_KEY"
     REQUEST_VALIDATION_ERROR = "REQUEST_VALIDATION_ERROR"
     UNACCEPTABLE_INTERVAL_TIME = "UNACCEPTABLE_INTERVAL_TIME"
+    PIXEL_NOT_FOUND = "PIXEL_NOT_FOUND"
+    USER_NOT_FOUND = "USER_NOT_FOUND"
+    TIMELAPSE_NOT_FOUND = "TIMELAPSE_NOT_FOUND"
 
 class ActionTypes(Enum):
     """
@@ -53,12 +128,22 @@ class ActionTypes(Enum):
     CHECK_STATUS = "CHECK_STATUS"
     GET_PIXELS_ALL = "GET_PIXELS_ALL"
     GET_CERTAIN_PIXEL = "GET_CERTAIN_PIXEL"
+    GET_CERTAIN_PIXEL_LATEST = "GET_CERTAIN_PIXEL_LATEST"
+    GET_PIXELS_REGION = "GET_PIXELS_REGION"
     GET_TIMELAPSE_ALL = "GET_TIMELAPSE_ALL"
     GET_LATEST_TIMELAPSE = "GET_LATEST_TIMELAPSE"
+    GET_LATEST_TIMELAPSES_BATCH = "GET_LATEST_TIMELAPSES_BATCH"
     GET_REDIRECT_LATEST_TIMELAPSE = "GET_REDIRECT_LATEST_TIMELAPSE"
     GET_ALL_USERS = "GET_ALL_USERS"
     GET_ALL_PIXELS_BY_USERNAME = "GET_ALL_PIXELS_BY_USERNAME"
     GET_ALL_PIXELS_BY_USERID = "GET_ALL_PIXELS_BY_USERID"
+    ADD_TIMELAPSE = "ADD_TIMELAPSE"
+    GET_CANVAS_AT = "GET_CANVAS_AT"
+    GET_STATS_TOP_USERS = "GET_STATS_TOP_USERS"
+    GET_STATS_USER = "GET_STATS_USER"
+    GET_STATS_HOURLY = "GET_STATS_HOURLY"
+    GET_STATS_TOP_PIXELS = "GET_STATS_TOP_PIXELS"
+    GET_CANVAS_HEATMAP = "GET_CANVAS_HEATMAP"
 
 class ErrorBaseModel(pydantic.BaseModel):
     """
@@ -79,6 +164,27 @@ class BaseResponseModel(pydantic.BaseModel):
     class Config:
         use_enum_values = True
 
+class CanvasFormats(Enum):
+    """
+    List (enum) of formats the canvas can be rendered in.
+    """
+    PNG = "png"
+    RAW = "raw"
+
+class RegionModes(Enum):
+    """
+    List (enum) of what a region query returns: the latest state of every pixel or their whole history.
+    """
+    LATEST = "latest"
+    HISTORY = "history"
+
+class RegionEncodings(Enum):
+    """
+    List (enum) of encodings of a region query response.
+    """
+    OBJECTS = "objects"
+    COLUMNAR = "columnar"
+
 class ErrorCustomBruhher(Exception):
     """
     Custom error exception for FastAPI HTTP-endpoints.
@@ -181,76 +287,692 @@ class CanvasTimelapseObjectModel(pydantic.BaseModel):
     snapshotURL: ArchiveImagesDownloadModel
 
 
-def get_all_pixels() -> List[PixelInformationModel]:
+def pixel_key(x: int, y: int) -> str:
+    """
+    Function to get the `_id` of a pixel in the collections keyed by coordinate.
+    """
+    return f"{x}:{y}"
+
+async def deduplicate_pixels_info() -> int:
+    """
+    Function to delete the copies of pixels stored more than once (same coordinates and `modified`), keeping the first one inserted.
+    Returns the amount of documents deleted.
+    """
+    deleted = 0
+    async for group in __DB_PIXINFO.aggregate([
+        {"$group": {"_id": {"x": "$point.x", "y": "$point.y", "modified": "$modified"}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True):
+        result = await __DB_PIXINFO.delete_many({"_id": {"$in": sorted(group["ids"])[1:]}})
+        deleted += result.deleted_count
+    return deleted
+
+async def ensure_database_indexes() -> None:
+    """
+    Function to create the indexes used by the endpoints' queries (no-op for the ones which already exist).
+    """
+    # The history pages are sorted by `modified` and `_id`, so a page after any cursor is a single index range scan.
+    await __DB_PIXINFO.create_index([("point.x", pymongo.ASCENDING), ("point.y", pymongo.ASCENDING), ("modified", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+    await __DB_PIXINFO.create_index([("user.username", pymongo.ASCENDING), ("modified", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+    await __DB_PIXINFO.create_index([("editorID", pymongo.ASCENDING), ("modified", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+    existingIndexes = await __DB_PIXINFO.index_information()
+    for name in ["point.x_1_point.y_1_modified_-1", "user.username_1_modified_-1", "editorID_1_modified_-1"]:
+        if name in existingIndexes:
+            await __DB_PIXINFO.drop_index(name)
+    # Every placement is stored once: the parser drops the pixels it fetched twice on the duplicate-key errors of this index,
+    # and only counts the pixels it inserted in the rollups.
+    if "point.x_1_point.y_1_modified_1" not in existingIndexes:
+        deleted = await deduplicate_pixels_info()
+        if deleted > 0:
+            # The rollups counted the copies, so they are rebuilt from the deduplicated history.
+            logging.warning(f"Deleted {deleted} duplicate pixels from {__DB_PIXINFO.name}, rebuilding the rollups.")
+            for name in ROLLUP_PIPELINES:
+                await request_rollup_rebuild(name, restart=True)
+    await __DB_PIXINFO.create_index([("point.x", pymongo.ASCENDING), ("point.y", pymongo.ASCENDING), ("modified", pymongo.ASCENDING)], unique=True)
+    await __DB_PIXINFO.create_index([("modified", pymongo.DESCENDING)])
+    await __DB_TLS.create_index([("interval_time", pymongo.ASCENDING), ("date", pymongo.DESCENDING)])
+    await __DB_USERS.create_index([("modified", pymongo.DESCENDING)])
+    await __DB_PIXLATEST.create_index([("point.x", pymongo.ASCENDING), ("point.y", pymongo.ASCENDING)])
+    # The leaderboards are the first `limit` entries of these indexes, whatever the size of the history.
+    await __DB_STATS_USERS.create_index([("placements", pymongo.DESCENDING), ("_id", pymongo.ASCENDING)])
+    await __DB_STATS_PIXELS.create_index([("edits", pymongo.DESCENDING), ("_id", pymongo.ASCENDING)])
+
+async def rebuild_pixels_latest() -> None:
+    """
+    Function to (re)build the latest state of every pixel from the whole history.
+    Documents the parser has already written with a newer `modified` are kept.
+    """
+    await __DB_PIXINFO.aggregate([
+        {"$sort": {"modified": -1}},
+        {"$group": {
+            "_id": {"$concat": [{"$toString": "$point.x"}, ":", {"$toString": "$point.y"}]},
+            "pixel": {"$first": "$$ROOT"},
+        }},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$pixel", {"_id": "$_id"}]}}},
+        {"$merge": {
+            "into": __DB_PIXLATEST.name,
+            "whenMatched": [{"$replaceWith": {"$cond": [{"$gt": ["$$new.modified", "$modified"]}, "$$new", "$$ROOT"]}}],
+            "whenNotMatched": "insert",
+        }},
+    ], allowDiskUse=True).to_list(None)
+
+async def rebuild_users() -> None:
+    """
+    Function to (re)build the snapshot of every user at their latest pixel from the whole history.
+    Documents the parser has already written with a newer `modified` are kept.
+    """
+    await __DB_PIXINFO.aggregate([
+        {"$match": {"user": {"$ne": None}}},
+        {"$sort": {"modified": -1}},
+        {"$group": {
+            "_id": "$user.id",
+            "modified": {"$first": "$modified"},
+            "user": {"$first": "$user"},
+        }},
+        {"$merge": {
+            "into": __DB_USERS.name,
+            "whenMatched": [{"$replaceWith": {"$cond": [{"$gt": ["$$new.modified", "$modified"]}, "$$new", "$$ROOT"]}}],
+            "whenNotMatched": "insert",
+        }},
+    ], allowDiskUse=True).to_list(None)
+
+async def request_rollup_rebuild(name: str, restart: bool = False) -> bool:
+    """
+    Function to request a rebuild of the rollup `name`, see `rollups.py`.
+    A rebuild already adding its counts goes on, unless `restart` is set.
+    Returns whether the rebuild was requested.
+    """
+    try:
+        await __DB_BACKFILLS.replace_one({"_id": name} if restart else {"_id": name, "state": {"$ne": REBUILD_BUILDING}}, rebuild_request(name, datetime.utcnow(), _ROLLUP_BUILD_MARGIN), upsert=True)
+    except pymongo.errors.DuplicateKeyError:
+        return False
+    logging.info(f"Requested a rebuild of {name} up to {datetime.utcnow() + _ROLLUP_BUILD_MARGIN}.")
+    return True
+
+async def clear_rollup(name: str) -> None:
+    """
+    Function to empty a rollup and the collections derived from it; the indexes are kept.
+    """
+    await __DB["plcgxrm"][name].delete_many({})
+    for dependent in ROLLUP_DEPENDENTS.get(name, []):
+        await __DB["plcgxrm"][dependent].delete_many({})
+
+async def add_rollup_batch(name: str, watermark: bson.ObjectId, operations: list[pymongo.UpdateOne]) -> bool:
+    """
+    Function to add a batch of rebuilt counts to the rollup, as long as its rebuild is still the one in progress.
+    Returns whether the batch was added.
+    """
+    heartbeat = await __DB_BACKFILLS.update_one({"_id": name, "state": REBUILD_BUILDING, "watermark": watermark}, {"$set": {"heartbeatAt": datetime.utcnow()}})
+    if heartbeat.matched_count == 0:
+        return False
+    await __DB["plcgxrm"][name].bulk_write(operations, ordered=False)
+    return True
+
+async def build_rollup(name: str, watermark: bson.ObjectId) -> bool:
+    """
+    Function to add the counts of the pixels below the watermark to the rollup `name`, with the updates of the parser.
+    Returns whether every count was added, which is not the case when another rebuild was requested meanwhile.
+    """
+    operations = []
+    async for document in __DB_PIXINFO.aggregate(rebuild_pipeline(name, watermark), allowDiskUse=True):
+        operations.append(pymongo.UpdateOne({"_id": document["_id"]}, ROLLUP_UPDATES[name](document), upsert=True))
+        if len(operations) >= _ROLLUP_BUILD_BATCH_SIZE:
+            if not await add_rollup_batch(name, watermark, operations):
+                return False
+            operations = []
+    return not operations or await add_rollup_batch(name, watermark, operations)
+
+async def advance_rollup_rebuild(name: str) -> None:
+    """
+    Function to move the rebuild of the rollup `name` to its next state once it is due, see `rollups.py`.
+    Every transition is conditional on the state and watermark it starts from, so a rebuild requested meanwhile takes over.
+    """
+    rebuild = await __DB_BACKFILLS.find_one({"_id": name})
+    if rebuild is None:
+        await request_rollup_rebuild(name)
+        return
+    now = datetime.utcnow()
+    watermark = rebuild["watermark"]
+    current = {"_id": name, "state": rebuild["state"], "watermark": watermark}
+    if rebuild["state"] == REBUILD_PENDING and now >= rebuild["clearAt"]:
+        if now >= watermark.generation_time.replace(tzinfo=None):
+            # The parser already counts past the watermark, so emptying the rollup would lose its counts.
+            logging.warning(f"The rebuild of {name} was not started before its watermark, requesting it again.")
+            await request_rollup_rebuild(name)
+            return
+        await clear_rollup(name)
+        await __DB_BACKFILLS.update_one(current, {"$set": {"state": REBUILD_CLEARED}})
+        await __DATA_VERSIONS.bump(_VERSION_PIXELS_HISTORY)
+    elif rebuild["state"] == REBUILD_CLEARED and now >= rebuild["buildAt"]:
+        started = await __DB_BACKFILLS.update_one(current, {"$set": {"state": REBUILD_BUILDING, "heartbeatAt": now}})
+        if started.modified_count == 0:
+            return
+        logging.info(f"Rebuilding {name} from the history below {watermark.generation_time}...")
+        startTimeRebuild = time.time()
+        if not await build_rollup(name, watermark):
+            logging.warning(f"The rebuild of {name} was superseded by another one.")
+            return
+        await __DB_BACKFILLS.update_one({**current, "state": REBUILD_BUILDING}, {"$set": {"state": REBUILD_BUILT, "builtAt": datetime.utcnow()}})
+        for dependent in ROLLUP_DEPENDENTS.get(name, []):
+            await __DB["plcgxrm"][dependent].delete_many({})
+        await __DATA_VERSIONS.bump(_VERSION_PIXELS_HISTORY)
+        logging.info(f"Rebuilt {name} in {round(time.time() - startTimeRebuild, 4)} seconds.")
+    elif rebuild["state"] == REBUILD_BUILDING and rebuild["heartbeatAt"] <= now - _ROLLUP_BUILD_STALL:
+        # The build stopped midway (e.g. the API restarted), and the counts it added are only part of the history.
+        logging.warning(f"The rebuild of {name} stopped midway, requesting it again.")
+        await __DB_BACKFILLS.replace_one({**current, "heartbeatAt": rebuild["heartbeatAt"]}, rebuild_request(name, now, _ROLLUP_BUILD_MARGIN))
+
+async def maintain_rollups(bootstrap: Awaitable) -> None:
+    """
+    Function to keep carrying out the rebuilds of the rollups, once the database is bootstrapped.
+    """
+    await bootstrap
+    while True:
+        for name in ROLLUP_PIPELINES:
+            try:
+                await advance_rollup_rebuild(name)
+            except pymongo.errors.PyMongoError as e:
+                logging.error(f"An error occured while rebuilding {name}: {e}")
+        await asyncio.sleep(min(_ROLLUP_BUILD_MARGIN.total_seconds() / 4, 5))
+
+async def backfill_once(collection: AsyncIOMotorCollection, backfill: Callable[[], Awaitable]) -> None:
+    """
+    Function to backfill a collection the parser keeps up to date from the history, unless its `backfills` marker says it was done already.
+    The backfills only replace older documents, so one interrupted before its marker is written is run again from the start.
+    """
+    if await __DB_BACKFILLS.find_one({"_id": collection.name, "state": REBUILD_BUILT}) is not None:
+        return
+    logging.info(f"Backfilling {collection.name} from the history...")
+    await backfill()
+    await __DB_BACKFILLS.replace_one({"_id": collection.name}, {"state": REBUILD_BUILT, "builtAt": datetime.utcnow()}, upsert=True)
+    logging.info(f"Backfilled {collection.name}.")
+
+async def bootstrap_database() -> None:
+    """
+    Function to prepare the database for the API: creates the indexes and backfills the materialized collections which were never backfilled.
+    """
+    try:
+        await ensure_database_indexes()
+        await backfill_once(__DB_PIXLATEST, rebuild_pixels_latest)
+        await backfill_once(__DB_USERS, rebuild_users)
+    except pymongo.errors.PyMongoError as e:
+        logging.error(f"An error occured while bootstrapping the database: {e}")
+
+async def get_all_pixels() -> List[dict]:
     """
     Function to get all pixels from the database.
     """
-    pixels = __DB_PIXINFO.find({})
-    return [PixelInformationModel(**pixel) for pixel in pixels]
+    return await __DB_PIXINFO.find({}, _PIXEL_PROJECTION).to_list(None)
 
-def get_pixel_by_coordinates(x: int, y: int) -> Optional[List[PixelInformationModel]]:
+async def stream_all_pixels() -> AsyncIterator[bytes]:
+    """
+    Function to stream all pixels from the database as NDJSON, one line per pixel and one chunk per cursor batch.
+    """
+    lines = []
+    async for pixel in __DB_PIXINFO.find({}, _PIXEL_PROJECTION, batch_size=_STREAM_BATCH_SIZE):
+        lines.append(orjson.dumps(pixel, option=orjson.OPT_APPEND_NEWLINE))
+        if len(lines) >= _STREAM_BATCH_SIZE:
+            yield b"".join(lines)
+            lines = []
+    if lines:
+        yield b"".join(lines)
+
+def encode_history_cursor(pixel: dict) -> str:
+    """
+    Function to encode the position of a pixel document in a history page as an opaque cursor.
+    """
+    milliseconds = (pixel["modified"] - _EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{milliseconds}:{pixel['_id']}".encode()).decode()
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, bson.ObjectId]:
+    """
+    Function to decode a cursor made by `encode_history_cursor`.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        milliseconds, objectID = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return _EPOCH + timedelta(milliseconds=int(milliseconds)), bson.ObjectId(objectID)
+    except (UnicodeError, ValueError, bson.errors.InvalidId) as e:
+        raise ValueError(f"Malformed cursor: {cursor}") from e
+
+async def get_history_page(query: dict, limit: int, after: Optional[str]) -> tuple[List[dict], Optional[str]]:
+    """
+    Function to get one page of pixels matching the query, newest first.
+    Pages are keyset-paginated on `modified` and `_id`; returns the pixels and the cursor of the next page (None on the last one).
+    Raises ValueError if the cursor is malformed.
+    """
+    if after is not None:
+        modified, objectID = decode_history_cursor(after)
+        query = {**query, "$or": [
+            {"modified": {"$lt": modified}},
+            {"modified": modified, "_id": {"$lt": objectID}},
+        ]}
+    pixels = await __DB_PIXINFO.find(query, {**_PIXEL_PROJECTION, "_id": 1}).sort([("modified", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]).limit(limit + 1).to_list(limit + 1)
+    nextCursor = encode_history_cursor(pixels[limit - 1]) if len(pixels) > limit else None
+    pixels = pixels[:limit]
+    for pixel in pixels:
+        del pixel["_id"]
+    return pixels, nextCursor
+
+async def get_pixel_by_coordinates(x: int, y: int, limit: int = _PAGE_SIZE, after: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """
+    Funciton to get one page of the history of a pixel by its coordinates.
+    """
+    return await get_history_page({"point.x": x, "point.y": y}, limit, after)
+
+async def get_latest_pixel_by_coordinates(x: int, y: int) -> Optional[dict]:
     """
-    Funciton to get a pixel info by its coordinates.
+    Function to get the current state of a pixel by its coordinates.
     """
-    pixel = __DB_PIXINFO.find({"point.x": x, "point.y": y})
-    pixel = list(pixel)
-    if pixel == 0:
-        return None
-    return [PixelInformationModel(**pixel) for pixel in pixel]
+    return await __DB_PIXLATEST.find_one({"_id": pixel_key(x, y)}, _PIXEL_PROJECTION)
 
+async def get_pixels_in_region(x0: int, y0: int, x1: int, y1: int, since: Optional[datetime], until: Optional[datetime], mode: RegionModes, projection: Optional[dict]) -> List[dict]:
+    """
+    Function to get the pixels of the rectangle between (x0, y0) and (x1, y1), both inclusive, placed in the time window.
+    In the latest mode every pixel is in its state as of `until` (or the current one), otherwise the whole history is returned oldest first.
+    Raises OverflowError if the query matches more than `REGION_MAX_RESULTS` pixels.
+    """
+    query = {"point.x": {"$gte": x0, "$lte": x1}, "point.y": {"$gte": y0, "$lte": y1}}
+    window = {}
+    if since is not None:
+        window["$gte"] = since
+    if until is not None:
+        window["$lte"] = until
+    if window:
+        query["modified"] = window
+    if mode == RegionModes.LATEST and until is None:
+        pixels = __DB_PIXLATEST.find(query, projection).limit(_REGION_MAX_RESULTS + 1)
+    elif mode == RegionModes.LATEST:
+        pixels = __DB_PIXINFO.aggregate([
+            {"$match": query},
+            {"$sort": {"modified": -1}},
+            {"$group": {"_id": {"x": "$point.x", "y": "$point.y"}, "pixel": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$pixel"}},
+            {"$limit": _REGION_MAX_RESULTS + 1},
+        ] + ([{"$project": projection}] if projection else []), allowDiskUse=True)
+    else:
+        pixels = __DB_PIXINFO.find(query, projection).sort("modified", pymongo.ASCENDING).limit(_REGION_MAX_RESULTS + 1)
+    pixels = await pixels.to_list(_REGION_MAX_RESULTS + 1)
+    if len(pixels) > _REGION_MAX_RESULTS:
+        raise OverflowError(f"The region matches more than {_REGION_MAX_RESULTS} pixels.")
+    return pixels
 
-def add_timelapse_to_db(timelapse: CanvasTimelapseObjectModel) -> None:
+def encode_pixels_columnar(pixels: List[dict]) -> dict:
+    """
+    Function to encode pixels column by column: coordinates and Unix timestamps in milliseconds as plain columns,
+    colours and editors as indices into the `colours` and `editors` dictionaries.
+    """
+    colours, editors = {}, {}
+    return {
+        "count": len(pixels),
+        "x": [pixel["point"]["x"] for pixel in pixels],
+        "y": [pixel["point"]["y"] for pixel in pixels],
+        "modified": [(pixel["modified"] - _EPOCH) // timedelta(milliseconds=1) for pixel in pixels],
+        "colour": [colours.setdefault(pixel["colour"], len(colours)) for pixel in pixels],
+        "editor": [editors.setdefault(pixel["editorID"], len(editors)) for pixel in pixels],
+        "colours": list(colours),
+        "editors": list(editors),
+    }
+
+
+async def add_timelapse_to_db(timelapse: CanvasTimelapseObjectModel) -> None:
     """
     Function to add a timelapse to the database.
     """
-    __DB_TLS.insert_one(timelapse.dict())
+    await __DB_TLS.insert_one(timelapse.dict())
+    await __DATA_VERSIONS.bump(_VERSION_TIMELAPSES)
 
-def get_db_all_timelapses() -> List[CanvasTimelapseObjectModel]:
+async def get_db_all_timelapses() -> List[dict]:
     """
     Function to get all timelapses from the database.
     """
-    timelapses = __DB_TLS.find({})
-    return [CanvasTimelapseObjectModel(**timelapse) for timelapse in timelapses]
+    return await __DB_TLS.find({}, _TIMELAPSE_PROJECTION).to_list(None)
 
-def get_db_all_timelapses_by_itervaltime(interval_time: int) -> List[CanvasTimelapseObjectModel]:
+async def get_db_all_timelapses_by_itervaltime(interval_time: int) -> List[dict]:
     """
     Function to get all timelapses from the database by interval time.
     """
-    timelapses = __DB_TLS.find({"interval_time": interval_time})
-    return [CanvasTimelapseObjectModel(**timelapse) for timelapse in timelapses]
+    return await __DB_TLS.find({"interval_time": interval_time}, _TIMELAPSE_PROJECTION).to_list(None)
+
+async def get_db_latest_timelapse(interval_time: int) -> Optional[dict]:
+    """
+    Function to get the latest timelapse from the database by interval time, or None if there is none yet.
+    """
+    timelapses = await __DB_TLS.find({"interval_time": interval_time}, _TIMELAPSE_PROJECTION).sort("date", -1).limit(1).to_list(1)
+    return timelapses[0] if timelapses else None
 
-def get_db_latest_timelapse(interval_time: int) -> CanvasTimelapseObjectModel:
+async def get_db_latest_timelapses(interval_times: List[int]) -> dict[str, Optional[dict]]:
     """
-    Function to get the latest timelapse from the database by interval time.
+    Function to get the latest timelapse of every given interval time from the database, looked up concurrently.
     """
-    timelapse = __DB_TLS.find({"interval_time": interval_time}).sort("date", -1).limit(1)[0]
-    return CanvasTimelapseObjectModel(**timelapse)
+    timelapses = await asyncio.gather(*(get_db_latest_timelapse(interval_time) for interval_time in interval_times))
+    return {str(interval_time): timelapse for interval_time, timelapse in zip(interval_times, timelapses)}
+
+async def require_latest_timelapse(interval_time: int) -> dict:
+    """
+    Function to get the latest timelapse by interval time, raising a 404 if there is none yet.
+    """
+    timelapse = await get_db_latest_timelapse(interval_time)
+    if timelapse is None:
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.GET_LATEST_TIMELAPSE,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.TIMELAPSE_NOT_FOUND,
+                    description="There is no timelapse with this interval time yet.",
+                )), 404)
+    return timelapse
 
 
-def get_db_all_users_by_latest_pixel() -> List[PixelInfoUserModel]:
+async def get_db_all_users_by_latest_pixel() -> List[dict]:
     """
     Function to get all users from the database, sorted by the latest pixel.
     """
-    users = [user["user"] for user in __DB_PIXINFO.find({}).sort("modified", -1)]
-    usedUserIDs = set()
-    for user in users:
-        if user is not None and user["id"] not in usedUserIDs:
-            usedUserIDs.add(user["id"])
-            yield PixelInfoUserModel(**user)
+    users = __DB_USERS.find({}, {"_id": 0, "user": 1}).sort("modified", -1)
+    return [user["user"] async for user in users]
+
+async def get_db_all_pixels_by_username(username: str, limit: int = _PAGE_SIZE, after: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """
+    Function to get one page of the pixels of a user by their username, newest first.
+    """
+    return await get_history_page({"user.username": username}, limit, after)
+
+async def get_db_all_pixels_by_userid(userid: str, limit: int = _PAGE_SIZE, after: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """
+    Function to get one page of the pixels of a user by their userID, newest first.
+    """
+    return await get_history_page({"editorID": userid}, limit, after)
+
+
+def format_stats_user(user: dict) -> dict:
+    """
+    Function to turn a `stats-users` document into its response object.
+    """
+    return {"editorID": user["_id"], "username": user.get("username"), "placements": user["placements"], "firstPlaced": user["firstPlaced"], "lastPlaced": user["lastPlaced"]}
+
+async def get_stats_top_users(limit: int) -> List[dict]:
+    """
+    Function to get the users with the most placements.
+    """
+    users = __DB_STATS_USERS.find({}).sort([("placements", -1), ("_id", 1)]).limit(limit)
+    return [format_stats_user(user) async for user in users]
+
+async def get_stats_user(userid: str) -> Optional[dict]:
+    """
+    Function to get the placement statistics of a user by their userID.
+    """
+    user = await __DB_STATS_USERS.find_one({"_id": userid})
+    return format_stats_user(user) if user is not None else None
+
+async def get_stats_hourly(since: datetime, until: datetime) -> List[dict]:
+    """
+    Function to get the placements and the amount of distinct editors of every hour from `since` up to (excluding) `until`, oldest first.
+    Hours without any placement are left out.
+    """
+    return await __DB_STATS_HOURLY.aggregate([
+        {"$match": {"_id": {"$gte": since, "$lt": until}}},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "hour": "$_id", "placements": 1, "editors": {"$size": "$editors"}}},
+    ]).to_list(None)
+
+async def get_stats_top_pixels(limit: int) -> List[dict]:
+    """
+    Function to get the most edited pixels.
+    """
+    pixels = __DB_STATS_PIXELS.find({}, {"_id": 0, "point": 1, "edits": 1, "lastModified": 1}).sort([("edits", -1), ("_id", 1)]).limit(limit)
+    return await pixels.to_list(None)
+
+
+async def load_canvas_checkpoint(timestamp: datetime) -> CanvasState:
+    """
+    Function to get the latest canvas checkpoint taken at or before the timestamp, or a blank canvas if there is none.
+    Checkpoints the parser marked stale (a pixel placed before them was inserted late) are skipped until they are rebuilt.
+    """
+    checkpoint = await __DB_CHECKPOINTS.find_one({"_id": {"$lte": timestamp}, "stale": {"$ne": True}}, sort=[("_id", pymongo.DESCENDING)])
+    if checkpoint is None:
+        return CanvasState(datetime.min)
+    return CanvasState.from_document(checkpoint)
+
+async def replay_canvas(state: CanvasState, timestamp: datetime) -> int:
+    """
+    Function to apply to the canvas every pixel placed after its timestamp and up to the given one, in place.
+    Returns the amount of pixels applied.
+    """
+    query = {"$lte": timestamp} if state.timestamp == datetime.min else {"$gt": state.timestamp, "$lte": timestamp}
+    pixels = __DB_PIXINFO.find({"modified": query}, {"_id": 0, "point": 1, "colour": 1}, batch_size=_STREAM_BATCH_SIZE).sort("modified", pymongo.ASCENDING)
+    applied, batch = 0, []
+    async for pixel in pixels:
+        batch.append(pixel)
+        if len(batch) >= _STREAM_BATCH_SIZE:
+            applied += state.apply_pixels(batch)
+            batch = []
+    applied += state.apply_pixels(batch)
+    state.timestamp = timestamp
+    return applied
+
+async def get_canvas_at(timestamp: datetime) -> CanvasState:
+    """
+    Function to rebuild the canvas at the timestamp, replaying the history from the nearest checkpoint.
+    """
+    state = await load_canvas_checkpoint(timestamp)
+    await replay_canvas(state, timestamp)
+    return state
+
+async def create_canvas_checkpoints() -> int:
+    """
+    Function to store a canvas checkpoint every `CANVAS_CHECKPOINT_INTERVAL` of history, up to `CANVAS_CHECKPOINT_DELAY` ago.
+    Every checkpoint is built from the previous one, so each pixel is only replayed once; intervals without pixels get no checkpoint.
+    The checkpoints from the first stale one on are deleted and built again.
+    Returns the amount of checkpoints created.
+    """
+    firstStale = await __DB_CHECKPOINTS.find_one({"stale": True}, {"_id": 1}, sort=[("_id", pymongo.ASCENDING)])
+    if firstStale is not None:
+        deleted = await __DB_CHECKPOINTS.delete_many({"_id": {"$gte": firstStale["_id"]}})
+        logging.info(f"Deleted {deleted.deleted_count} stale canvas checkpoints from {firstStale['_id']} on, rebuilding them.")
+    latest = await __DB_CHECKPOINTS.find_one({"stale": {"$ne": True}}, sort=[("_id", pymongo.DESCENDING)])
+    if latest is not None:
+        state = CanvasState.from_document(latest)
+        bound = state.timestamp + _CANVAS_CHECKPOINT_INTERVAL
+    else:
+        first = await __DB_PIXINFO.find_one({}, {"modified": 1}, sort=[("modified", pymongo.ASCENDING)])
+        if first is None:
+            return 0
+        state = CanvasState(datetime.min)
+        bound = datetime.min + (first["modified"] - datetime.min) // _CANVAS_CHECKPOINT_INTERVAL * _CANVAS_CHECKPOINT_INTERVAL + _CANVAS_CHECKPOINT_INTERVAL
+    # Any pixel inserted from now on, which the parser may have marked the checkpoints stale for before the one it is missing from was written.
+    insertedSince = bson.ObjectId.from_datetime(datetime.utcnow() - _INSERT_CLOCK_SLACK)
+    created = 0
+    while bound <= datetime.utcnow() - _CANVAS_CHECKPOINT_DELAY:
+        written = await replay_canvas(state, bound) > 0
+        if written:
+            await __DB_CHECKPOINTS.replace_one({"_id": bound}, state.to_document(), upsert=True)
+            created += 1
+        if await __DB_PIXINFO.find_one({"_id": {"$gte": insertedSince}, "modified": {"$lte": bound}}, {"_id": 1}) is not None:
+            # The canvas replayed so far may be missing a pixel inserted late; the next run starts over from the checkpoints before it.
+            if written:
+                await __DB_CHECKPOINTS.update_one({"_id": bound}, {"$set": {"stale": True}})
+            break
+        bound += _CANVAS_CHECKPOINT_INTERVAL
+    return created
+
+async def maintain_canvas_checkpoints() -> None:
+    """
+    Function to keep creating canvas checkpoints as the history grows.
+    """
+    while True:
+        try:
+            created = await create_canvas_checkpoints()
+            if created:
+                logging.info(f"Created {created} canvas checkpoints.")
+        except pymongo.errors.PyMongoError as e:
+            logging.error(f"An error occured while creating canvas checkpoints: {e}")
+        await asyncio.sleep(min(_CANVAS_CHECKPOINT_INTERVAL.total_seconds(), 60))
+
+async def get_board_size() -> tuple[int, int]:
+    """
+    Function to get the size of the board the parser last saw, or (0, 0) before it stored one.
+    """
+    size = await __DB_BOARD.find_one({"_id": "size"})
+    if size is None:
+        return 0, 0
+    return size["width"], size["height"]
+
+async def render_canvas_at(timestamp: datetime, format: CanvasFormats) -> tuple[bytes, str, dict]:
+    """
+    Function to render the canvas at the timestamp in the given format, at the size of the board.
+    Returns the body, its media type and the headers describing the canvas.
+    """
+    state = await get_canvas_at(timestamp)
+    state.resize(*await get_board_size())
+    headers = {
+        "X-Canvas-Timestamp": state.timestamp.isoformat(),
+        "X-Canvas-Width": str(state.width),
+        "X-Canvas-Height": str(state.height),
+    }
+    if format == CanvasFormats.PNG:
+        return await asyncio.to_thread(state.to_png), "image/png", headers
+    headers["X-Canvas-Palette"] = ",".join(state.palette)
+    return state.to_raw(), "application/octet-stream", headers
+
+async def load_heatmap_checkpoint(timestamp: datetime) -> HeatmapCounts:
+    """
+    Function to get the latest heatmap checkpoint counting the history up to the timestamp or less, or empty counts if there is none.
+    Checkpoints the parser marked stale (a pixel landed in an hour they count) are skipped until they are rebuilt.
+    """
+    checkpoint = await __DB_HEATMAP_CHECKPOINTS.find_one({"_id": {"$lte": timestamp}, "stale": {"$ne": True}}, sort=[("_id", pymongo.DESCENDING)])
+    if checkpoint is None:
+        return HeatmapCounts(datetime.min)
+    return HeatmapCounts.from_document(checkpoint)
+
+async def add_heatmap_hours(heatmap: HeatmapCounts, timestamp: datetime, versions: Optional[dict] = None) -> int:
+    """
+    Function to add to the heatmap the hourly counts from its timestamp up to (excluding) the given one, in place.
+    The `version` of every hour added is recorded in `versions`, if given.
+    Returns the amount of edits added.
+    """
+    added = 0
+    async for hour in __DB_HEATMAP_HOURLY.find({"_id": {"$gte": heatmap.timestamp, "$lt": timestamp}}):
+        added += heatmap.add_sparse(hour.get("counts", {}))
+        if versions is not None:
+            versions[hour["_id"]] = hour.get("version")
+    heatmap.timestamp = timestamp
+    return added
+
+async def get_heatmap(since: Optional[datetime], until: datetime) -> HeatmapCounts:
+    """
+    Function to count the edits of every pixel from `since` (the beginning if None) up to (excluding) `until`, both on the hour.
+    The counts up to a moment are its checkpoint plus the hours after it, and a window is the difference of the counts up to both of its ends,
+    so no more than two checkpoints and `HEATMAP_CHECKPOINT_HOURS` hours per end are read whatever the size of the history.
+    """
+    heatmap = await load_heatmap_checkpoint(until)
+    if since is not None and heatmap.timestamp <= since:
+        # Both ends are past the same checkpoint, so the hours of the window alone are cheaper.
+        heatmap = HeatmapCounts(since)
+        await add_heatmap_hours(heatmap, until)
+        return heatmap
+    await add_heatmap_hours(heatmap, until)
+    if since is not None:
+        before = await load_heatmap_checkpoint(since)
+        await add_heatmap_hours(before, since)
+        heatmap.subtract(before)
+    return heatmap
+
+async def create_heatmap_checkpoints() -> int:
+    """
+    Function to store a heatmap checkpoint every `HEATMAP_CHECKPOINT_HOURS` of history, up to `HEATMAP_CHECKPOINT_DELAY` ago.
+    A checkpoint counts the whole history before it and is built from the previous one, so every hourly document is only added once;
+    the delay leaves time to the pixels the parser fetches late to reach their hour before it is counted into a checkpoint.
+    The checkpoints from the first stale one on are deleted and built again, and none is built while `heatmap-hourly` is being rebuilt.
+    Returns the amount of checkpoints created.
+    """
+    if await __DB_BACKFILLS.find_one({"_id": HEATMAP_HOURLY, "state": REBUILD_BUILT}) is None:
+        return 0
+    firstStale = await __DB_HEATMAP_CHECKPOINTS.find_one({"stale": True}, {"_id": 1}, sort=[("_id", pymongo.ASCENDING)])
+    if firstStale is not None:
+        deleted = await __DB_HEATMAP_CHECKPOINTS.delete_many({"_id": {"$gte": firstStale["_id"]}})
+        logging.info(f"Deleted {deleted.deleted_count} stale heatmap checkpoints from {firstStale['_id']} on, rebuilding them.")
+    latest = await __DB_HEATMAP_CHECKPOINTS.find_one({"stale": {"$ne": True}}, sort=[("_id", pymongo.DESCENDING)])
+    if latest is not None:
+        heatmap = HeatmapCounts.from_document(latest)
+        bound = heatmap.timestamp + _HEATMAP_CHECKPOINT_INTERVAL
+    else:
+        first = await __DB_HEATMAP_HOURLY.find_one({}, {"_id": 1}, sort=[("_id", pymongo.ASCENDING)])
+        if first is None:
+            return 0
+        heatmap = HeatmapCounts(datetime.min)
+        bound = datetime.min + (first["_id"] - datetime.min) // _HEATMAP_CHECKPOINT_INTERVAL * _HEATMAP_CHECKPOINT_INTERVAL + _HEATMAP_CHECKPOINT_INTERVAL
+    created = 0
+    while bound <= datetime.utcnow() - _HEATMAP_CHECKPOINT_DELAY:
+        versions = {}
+        if await add_heatmap_hours(heatmap, bound, versions) > 0:
+            await __DB_HEATMAP_CHECKPOINTS.replace_one({"_id": bound}, heatmap.to_document(), upsert=True)
+            created += 1
+        # A pixel landing in an hour after it was read marks the checkpoints stale, but not the one written after it was marked:
+        # that one is marked here, and the ones the parser marked meanwhile are found, so the next run starts over from them.
+        changed = versions and await __DB_HEATMAP_HOURLY.count_documents({"$or": [{"_id": hour, "version": version} for hour, version in versions.items()]}) < len(versions)
+        if changed or await __DB_HEATMAP_CHECKPOINTS.find_one({"_id": {"$lte": bound}, "stale": True}, {"_id": 1}) is not None:
+            await __DB_HEATMAP_CHECKPOINTS.update_one({"_id": bound}, {"$set": {"stale": True}})
+            break
+        bound += _HEATMAP_CHECKPOINT_INTERVAL
+    return created
+
+async def maintain_heatmap_checkpoints() -> None:
+    """
+    Function to keep creating heatmap checkpoints as the history grows.
+    """
+    while True:
+        try:
+            created = await create_heatmap_checkpoints()
+            if created:
+                logging.info(f"Created {created} heatmap checkpoints.")
+        except pymongo.errors.PyMongoError as e:
+            logging.error(f"An error occured while creating heatmap checkpoints: {e}")
+        await asyncio.sleep(min(_HEATMAP_CHECKPOINT_INTERVAL.total_seconds(), 300))
+
+async def render_heatmap(since: Optional[datetime], until: datetime, format: CanvasFormats) -> tuple[bytes, str, dict]:
+    """
+    Function to render the heatmap of the window in the given format, at the size of the board.
+    Returns the body, its media type and the headers describing the heatmap.
+    """
+    heatmap = await get_heatmap(since, until)
+    heatmap.resize(*await get_board_size())
+    headers = {
+        "X-Heatmap-Since": since.isoformat() if since is not None else "",
+        "X-Heatmap-Until": until.isoformat(),
+        "X-Heatmap-Width": str(heatmap.width),
+        "X-Heatmap-Height": str(heatmap.height),
+        "X-Heatmap-Max": str(int(heatmap.counts.max()) if heatmap.counts.size else 0),
+    }
+    if format == CanvasFormats.PNG:
+        return await asyncio.to_thread(heatmap.to_png), "image/png", headers
+    return heatmap.to_raw(), "application/octet-stream", headers
+
+
+def encode_response(action: ActionTypes, result: dict) -> bytes:
+    """
+    Function to serialize a successful response in the shape of `BaseResponseModel` straight from database documents.
+    """
+    return orjson.dumps({"action": action.value, "result": result, "error": None})
 
-def get_db_all_pixels_by_username(username: str) -> List[PixelInformationModel]:
+def fast_response(action: ActionTypes, result: dict) -> Response:
     """
-    Function to get all pixels from the database, sorted by the latest pixel.
+    Function to build a successful response with `encode_response`, skipping FastAPI's validation against the response model.
     """
-    pixels = __DB_PIXINFO.find({"user.username": username})
-    return [PixelInformationModel(**pixel) for pixel in pixels]
+    return Response(content=encode_response(action, result), media_type="application/json")
+
 
-def get_db_all_pixels_by_userid(userid: str) -> List[PixelInformationModel]:
+async def cached_response(key: tuple, versions: tuple, action: ActionTypes, resultKey: str, fetch: Callable[[], Awaitable]) -> Response:
     """
-    Function to get all pixels from the database, sorted by the latest pixel.
+    Function to serve a response from the response cache, querying the database and serializing the response only on a miss.
+    Versions are the names of the data the response is built from; a bump of any of them invalidates the cached body.
     """
-    pixels = __DB_PIXINFO.find({"editorID": userid})
-    return [PixelInformationModel(**pixel) for pixel in pixels]
+    async def build() -> bytes:
+        return encode_response(action, {resultKey: await fetch()})
+
+    currentVersions = tuple([await __DATA_VERSIONS.get(name) for name in versions])
+    body = await __RESPONSE_CACHE.get_or_build(key, currentVersions, build)
+    return Response(content=body, media_type="application/json")
 
 
 def check_for_proper_authentication_header(request: Request) -> bool:
@@ -264,6 +986,33 @@ def check_for_proper_authentication_header(request: Request) -> bool:
     return True
 
 
+@app.on_event("startup")
+async def startup_bootstrap_database() -> None:
+    """
+    Prepares the database in the background, so the API is available while a backfill is running.
+    """
+    app.state.bootstrap = asyncio.create_task(bootstrap_database())
+    app.state.rollups = asyncio.create_task(maintain_rollups(app.state.bootstrap))
+    app.state.checkpoints = asyncio.create_task(maintain_canvas_checkpoints())
+    app.state.heatmapCheckpoints = asyncio.create_task(maintain_heatmap_checkpoints())
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """
+    Records the latency of every request under the path template of its route, so `/pixels/1/2` and `/pixels/3/4` share a series.
+    """
+    route = next((route.path for route in app.router.routes if route.matches(request.scope)[0] == Match.FULL), "unmatched")
+    startTimeRequest = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUEST_SECONDS.labels(request.method, route, str(status)).observe(time.perf_counter() - startTimeRequest)
+
+
 @app.exception_handler(ErrorCustomBruhher)
 def custom_error_bruhher(request: Request, exc: ErrorCustomBruhher) -> JSONResponse:
     """
@@ -288,7 +1037,7 @@ async def validation_exception_handler(*_) -> JSONResponse:
 
 
 @app.get("/", status_code=200, response_model=BaseResponseModel)
-def main_root(request: Request):
+async def main_root(request: Request):
     """
     Main endpoint for the root path.
     """
@@ -298,7 +1047,7 @@ def main_root(request: Request):
         error=None)
 
 @app.get("/status", status_code=200, response_model=BaseResponseModel)
-def check_internal_status(request: Request):
+async def check_internal_status(request: Request):
     """
     Endpoint for checking the status of the API.
     """
@@ -307,11 +1056,19 @@ def check_internal_status(request: Request):
         result={"status": {"connections": {"database": "OK", "api": "OK"}}},
         error=None)
 
+@app.get("/metrics", status_code=200, include_in_schema=False)
+async def get_metrics(request: Request):
+    """
+    Endpoint for the Prometheus metrics of the API: per-route request latency and database command time.
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 @app.get("/pixels/all", status_code=200, response_model=BaseResponseModel)
-def get_all_pixels_historic_information(request: Request):
+async def get_all_pixels_historic_information(request: Request, stream: bool = False):
     """
     Endpoint for getting all pixels historic information.
+    With `stream=true` (or `Accept: application/x-ndjson`) the pixels are streamed as NDJSON, one pixel per line.
     """
     if not check_for_proper_authentication_header(request):
         raise ErrorCustomBruhher(
@@ -322,43 +1079,100 @@ def get_all_pixels_historic_information(request: Request):
                     name=ErrorTypes.WRONG_API_KEY,
                     description="The provided API key is not correct.",
                 )), 401)
-    return BaseResponseModel(
-        action=ActionTypes.GET_PIXELS_ALL,
-        result={"pixels": get_all_pixels()},
-        error=None)
+    if stream or _NDJSON_MEDIA_TYPE in request.headers.get("Accept", ""):
+        return StreamingResponse(stream_all_pixels(), media_type=_NDJSON_MEDIA_TYPE)
+    return fast_response(ActionTypes.GET_PIXELS_ALL, {"pixels": await get_all_pixels()})
+
+async def paged_history_response(action: ActionTypes, notFoundError: ErrorTypes, notFoundDescription: str, after: Optional[str], fetch: Callable[[], Awaitable]) -> Response:
+    """
+    Function to build the response of a history page, with the cursor of the next page in `result.next`.
+    An empty first page is reported as not found; an empty page after a cursor is simply the end of the history.
+    """
+    try:
+        pixels, nextCursor = await fetch()
+    except ValueError:
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=action,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.INVALID_PARAMETER,
+                    description="The provided cursor is not valid. Use the `next` value of the previous page.",
+                )), 400)
+    if not pixels and after is None:
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=action,
+                result=None,
+                error=ErrorBaseModel(
+                    name=notFoundError,
+                    description=notFoundDescription,
+                )), 404)
+    return fast_response(action, {"pixels": pixels, "next": nextCursor})
+
+@app.get("/pixels/region", status_code=200, response_model=BaseResponseModel)
+async def get_pixels_region_information(request: Request, x0: int, y0: int, x1: int, y1: int, since: Optional[datetime] = None, until: Optional[datetime] = None, mode: RegionModes = RegionModes.LATEST, encoding: RegionEncodings = RegionEncodings.OBJECTS):
+    """
+    Endpoint for getting every pixel of the rectangle between (x0, y0) and (x1, y1), both inclusive, in one request.
+    `mode=latest` returns the state of every placed pixel (as of `until` if given), `mode=history` every placement in the `since`–`until` window.
+    `encoding=columnar` returns one array per field instead of one object per pixel, without the user information.
+    """
+    def invalid_parameter(description: str) -> ErrorCustomBruhher:
+        return ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.GET_PIXELS_REGION,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.INVALID_PARAMETER,
+                    description=description,
+                )), 400)
+
+    if x1 < x0 or y1 < y0:
+        raise invalid_parameter("The region is empty: x1 and y1 must not be less than x0 and y0.")
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > _REGION_MAX_AREA:
+        raise invalid_parameter(f"The region is too large. At most {_REGION_MAX_AREA} pixels can be requested at once.")
+    since, until = [value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None and value.tzinfo is not None else value for value in (since, until)]
+    projection = {"_id": 0, "point": 1, "modified": 1, "colour": 1, "editorID": 1} if encoding == RegionEncodings.COLUMNAR else _PIXEL_PROJECTION
+    try:
+        pixels = await get_pixels_in_region(x0, y0, x1, y1, since, until, mode, projection)
+    except OverflowError:
+        raise invalid_parameter(f"The region matches more than {_REGION_MAX_RESULTS} pixels. Request a smaller region or time window.")
+    if encoding == RegionEncodings.COLUMNAR:
+        result = {"pixels": encode_pixels_columnar(pixels)}
+    else:
+        result = {"pixels": pixels}
+    return fast_response(ActionTypes.GET_PIXELS_REGION, result)
 
 @app.get("/pixels/{x}/{y}", status_code=200, response_model=BaseResponseModel)
-def get_pixel_historic_information(request: Request, x: int, y: int):
+async def get_pixel_historic_information(request: Request, x: int, y: int, limit: int = Query(_PAGE_SIZE, ge=1, le=_PAGE_SIZE_MAX), after: Optional[str] = None):
     """
-    Endpoint for getting historic information of a given pixel.
+    Endpoint for getting historic information of a given pixel, newest first.
+    The history is paginated: pass the `next` cursor of a page as `after` to get the following one.
     """
-    return BaseResponseModel(
-        action=ActionTypes.GET_CERTAIN_PIXEL,
-        result={"pixels": get_pixel_by_coordinates(x, y)},
-        error=None)
+    return await paged_history_response(
+        ActionTypes.GET_CERTAIN_PIXEL, ErrorTypes.PIXEL_NOT_FOUND, "Nobody has placed this pixel yet.",
+        after, lambda: get_pixel_by_coordinates(x, y, limit, after))
+
+@app.get("/pixels/{x}/{y}/latest", status_code=200, response_model=BaseResponseModel)
+async def get_pixel_latest_information(request: Request, x: int, y: int):
+    """
+    Endpoint for getting the current state of a given pixel.
+    """
+    return fast_response(ActionTypes.GET_CERTAIN_PIXEL_LATEST, {"pixel": await get_latest_pixel_by_coordinates(x, y)})
 
 
 @app.get("/timelapses/all", status_code=200, response_model=BaseResponseModel)
-def get_all_timelapses(request: Request, interval_time: Optional[int] = None):
+async def get_all_timelapses(request: Request, interval_time: Optional[int] = None):
     """
     Endpoint for getting all timelapses.
     """
     match interval_time:
         case None:
-            return BaseResponseModel(
-                action=ActionTypes.GET_TIMELAPSE_ALL,
-                result={"timelapses": get_db_all_timelapses()},
-                error=None)
+            return await cached_response(("/timelapses/all", None), (_VERSION_TIMELAPSES,), ActionTypes.GET_TIMELAPSE_ALL, "timelapses", get_db_all_timelapses)
         case 15:
-            return BaseResponseModel(
-                action=ActionTypes.GET_TIMELAPSE_ALL,
-                result={"timelapses": get_db_all_timelapses_by_itervaltime(15)},
-                error=None)
+            return await cached_response(("/timelapses/all", 15), (_VERSION_TIMELAPSES,), ActionTypes.GET_TIMELAPSE_ALL, "timelapses", lambda: get_db_all_timelapses_by_itervaltime(15))
         case 60:
-            return BaseResponseModel(
-                action=ActionTypes.GET_TIMELAPSE_ALL,
-                result={"timelapses": get_db_all_timelapses_by_itervaltime(60)},
-                error=None)
+            return await cached_response(("/timelapses/all", 60), (_VERSION_TIMELAPSES,), ActionTypes.GET_TIMELAPSE_ALL, "timelapses", lambda: get_db_all_timelapses_by_itervaltime(60))
     raise ErrorCustomBruhher(
         BaseResponseModel(
             action=ActionTypes.GET_TIMELAPSE_ALL,
@@ -368,8 +1182,37 @@ def get_all_timelapses(request: Request, interval_time: Optional[int] = None):
                 description="The provided interval time is not acceptable. Only 60 and 15 are accepted.",
             )), 400)
 
+@app.post("/timelapses", status_code=201, response_model=BaseResponseModel)
+async def add_timelapse(request: Request, timelapse: CanvasTimelapseObjectModel):
+    """
+    Endpoint for registering a new timelapse, used by the timelapse builder.
+    """
+    if not check_for_proper_authentication_header(request):
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.ADD_TIMELAPSE,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.WRONG_API_KEY,
+                    description="The provided API key is not correct.",
+                )), 401)
+    if not timelapse.interval_time in [60, 15]:
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.ADD_TIMELAPSE,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.UNACCEPTABLE_INTERVAL_TIME,
+                    description="The provided interval time is not acceptable. Only 60 and 15 are accepted.",
+                )), 400)
+    await add_timelapse_to_db(timelapse)
+    return BaseResponseModel(
+        action=ActionTypes.ADD_TIMELAPSE,
+        result={"timelapse": timelapse},
+        error=None)
+
 @app.get("/timelapses/latest", status_code=200, response_model=BaseResponseModel)
-def get_latest_timelapses(request: Request, interval_time: int = 60, redirectToH264: bool = False):
+async def get_latest_timelapses(request: Request, interval_time: int = 60, redirectToH264: bool = False):
     """
     Endpoint for getting latest timelapse.
     """
@@ -383,39 +1226,161 @@ def get_latest_timelapses(request: Request, interval_time: int = 60, redirectToH
                     description="The provided interval time is not acceptable. Only 60 and 15 are accepted.",
                 )), 400)
     if redirectToH264:
-        timelapse = get_db_latest_timelapse(interval_time)
-        return RedirectResponse(url=timelapse.downloadURLs.h264, status_code=303)
-    return BaseResponseModel(
-        action=ActionTypes.GET_LATEST_TIMELAPSE,
-        result={"timelapse": get_db_latest_timelapse(interval_time)},
-        error=None)
+        timelapse = await require_latest_timelapse(interval_time)
+        return RedirectResponse(url=timelapse["downloadURLs"]["h264"], status_code=303)
+    return await cached_response(("/timelapses/latest", interval_time), (_VERSION_TIMELAPSES,), ActionTypes.GET_LATEST_TIMELAPSE, "timelapse", lambda: require_latest_timelapse(interval_time))
+
+@app.get("/timelapses/latest/batch", status_code=200, response_model=BaseResponseModel)
+async def get_latest_timelapses_batch(request: Request, interval_time: List[int] = Query([60, 15])):
+    """
+    Endpoint for getting the latest timelapse of several interval times in one request.
+    """
+    if not set(interval_time) <= {60, 15}:
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.GET_LATEST_TIMELAPSES_BATCH,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.UNACCEPTABLE_INTERVAL_TIME,
+                    description="The provided interval time is not acceptable. Only 60 and 15 are accepted.",
+                )), 400)
+    interval_times = sorted(set(interval_time), reverse=True)
+    return await cached_response(("/timelapses/latest/batch", tuple(interval_times)), (_VERSION_TIMELAPSES,), ActionTypes.GET_LATEST_TIMELAPSES_BATCH, "timelapses", lambda: get_db_latest_timelapses(interval_times))
+
+@app.get("/canvas/at", status_code=200)
+async def get_canvas_at_timestamp(request: Request, timestamp: datetime, format: str = CanvasFormats.PNG.value):
+    """
+    Endpoint for getting the canvas as it was at a given moment, as a PNG image or as raw palette indices (`format=raw`).
+    The timestamp is rounded down to `CANVAS_TIME_BUCKET` seconds, and renders are cached per bucket.
+    The raw format is one byte per pixel row by row (two little-endian bytes if the palette has more than 255 colours);
+    index 0 is a pixel nobody has placed and index `i` is the `i`-th colour of the `X-Canvas-Palette` header.
+    """
+    try:
+        canvasFormat = CanvasFormats(format)
+    except ValueError:
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.GET_CANVAS_AT,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.INVALID_PARAMETER,
+                    description="The provided format is not acceptable. Only png and raw are accepted.",
+                )), 400)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    bucket = datetime.min + (timestamp - datetime.min) // timedelta(seconds=_CANVAS_TIME_BUCKET) * timedelta(seconds=_CANVAS_TIME_BUCKET)
+    # Pixels of the last few minutes may still be arriving, so renders of settled history are only invalidated by the pixels inserted late.
+    settled = bucket <= datetime.utcnow() - _CANVAS_CHECKPOINT_DELAY
+    versions = (await __DATA_VERSIONS.get(_VERSION_PIXELS_HISTORY if settled else _VERSION_PIXELS), await __DATA_VERSIONS.get(_VERSION_BOARD))
+    body, mediaType, headers = await __CANVAS_CACHE.get_or_build(("/canvas/at", bucket, canvasFormat), versions, lambda: render_canvas_at(bucket, canvasFormat))
+    return Response(content=body, media_type=mediaType, headers=headers)
+
+@app.get("/canvas/heatmap", status_code=200)
+async def get_canvas_heatmap(request: Request, since: Optional[datetime] = None, until: Optional[datetime] = None, format: str = CanvasFormats.PNG.value):
+    """
+    Endpoint for getting how many times every pixel was edited, from `since` (the beginning of the history by default) up to `until` (now by default),
+    as a PNG image on a logarithmic colour ramp or as raw counts (`format=raw`, four little-endian bytes per pixel row by row).
+    Both ends are rounded down to the hour, and renders are cached per window.
+    """
+    def invalid_parameter(description: str) -> ErrorCustomBruhher:
+        return ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.GET_CANVAS_HEATMAP,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.INVALID_PARAMETER,
+                    description=description,
+                )), 400)
+
+    try:
+        heatmapFormat = CanvasFormats(format)
+    except ValueError:
+        raise invalid_parameter("The provided format is not acceptable. Only png and raw are accepted.")
+    since, until = [value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None and value.tzinfo is not None else value for value in (since, until)]
+    until = (until or datetime.utcnow() + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    since = since.replace(minute=0, second=0, microsecond=0) if since is not None else None
+    if since is not None and since >= until:
+        raise invalid_parameter("since must be at least an hour before until.")
+    # The hours of the last `HEATMAP_CHECKPOINT_DELAY` may still be counting late pixels, so renders of settled history are only invalidated by the pixels inserted late.
+    settled = until <= datetime.utcnow() - _HEATMAP_CHECKPOINT_DELAY
+    versions = (await __DATA_VERSIONS.get(_VERSION_PIXELS_HISTORY if settled else _VERSION_PIXELS), await __DATA_VERSIONS.get(_VERSION_BOARD))
+    body, mediaType, headers = await __HEATMAP_CACHE.get_or_build(("/canvas/heatmap", since, until, heatmapFormat), versions, lambda: render_heatmap(since, until, heatmapFormat))
+    return Response(content=body, media_type=mediaType, headers=headers)
+
+@app.get("/stats/users/top", status_code=200, response_model=BaseResponseModel)
+async def get_stats_top_users_leaderboard(request: Request, limit: int = Query(_STATS_TOP_SIZE, ge=1, le=_STATS_TOP_SIZE_MAX)):
+    """
+    Endpoint for getting the leaderboard of the users with the most placements.
+    """
+    return await cached_response(("/stats/users/top", limit), (_VERSION_PIXELS,), ActionTypes.GET_STATS_TOP_USERS, "users", lambda: get_stats_top_users(limit))
+
+@app.get("/stats/users/id/{userID}", status_code=200, response_model=BaseResponseModel)
+async def get_stats_of_user(request: Request, userID: str):
+    """
+    Endpoint for getting the placement statistics of a user by their userID.
+    """
+    user = await get_stats_user(userID)
+    if user is None:
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.GET_STATS_USER,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.USER_NOT_FOUND,
+                    description="There is no user with this userID.",
+                )), 404)
+    return fast_response(ActionTypes.GET_STATS_USER, {"user": user})
+
+@app.get("/stats/hourly", status_code=200, response_model=BaseResponseModel)
+async def get_stats_hourly_placements(request: Request, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """
+    Endpoint for getting the placements and the amount of distinct editors per hour, oldest first; hours without placements are left out.
+    `since` and `until` are rounded down to the hour, and default to the last 24 hours; the hour of `until` is not included.
+    """
+    since, until = [value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None and value.tzinfo is not None else value for value in (since, until)]
+    until = (until or datetime.utcnow() + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    since = (since or until - timedelta(hours=24)).replace(minute=0, second=0, microsecond=0)
+    if since >= until or until - since > timedelta(hours=_STATS_HOURLY_MAX_HOURS):
+        raise ErrorCustomBruhher(
+            BaseResponseModel(
+                action=ActionTypes.GET_STATS_HOURLY,
+                result=None,
+                error=ErrorBaseModel(
+                    name=ErrorTypes.INVALID_PARAMETER,
+                    description=f"since must be before until, and at most {_STATS_HOURLY_MAX_HOURS} hours can be requested at once.",
+                )), 400)
+    return await cached_response(("/stats/hourly", since, until), (_VERSION_PIXELS,), ActionTypes.GET_STATS_HOURLY, "hours", lambda: get_stats_hourly(since, until))
+
+@app.get("/stats/pixels/top", status_code=200, response_model=BaseResponseModel)
+async def get_stats_top_pixels_leaderboard(request: Request, limit: int = Query(_STATS_TOP_SIZE, ge=1, le=_STATS_TOP_SIZE_MAX)):
+    """
+    Endpoint for getting the most contested pixels, the ones edited the most times.
+    """
+    return await cached_response(("/stats/pixels/top", limit), (_VERSION_PIXELS,), ActionTypes.GET_STATS_TOP_PIXELS, "pixels", lambda: get_stats_top_pixels(limit))
 
 @app.get("/users/all", status_code=200, response_model=BaseResponseModel)
-def get_all_users(request: Request):
+async def get_all_users(request: Request):
     """
     Endpoint to get all users with their latest information.
     """
-    return BaseResponseModel(
-        action=ActionTypes.GET_ALL_USERS,
-        result={"users": list(get_db_all_users_by_latest_pixel())},
-        error=None)
+    return await cached_response(("/users/all",), (_VERSION_PIXELS,), ActionTypes.GET_ALL_USERS, "users", get_db_all_users_by_latest_pixel)
 
 @app.get("/users/name/{username}", status_code=200, response_model=BaseResponseModel)
-def get_all_pixels_by_username(request: Request, username: str):
+async def get_all_pixels_by_username(request: Request, username: str, limit: int = Query(_PAGE_SIZE, ge=1, le=_PAGE_SIZE_MAX), after: Optional[str] = None):
     """
-    Endpoint to get all pixels of a user by their username.
+    Endpoint to get the pixels of a user by their username, newest first.
+    The pixels are paginated: pass the `next` cursor of a page as `after` to get the following one.
     """
-    return BaseResponseModel(
-        action=ActionTypes.GET_ALL_PIXELS_BY_USERNAME,
-        result={"pixels": get_db_all_pixels_by_username(username)},
-        error=None)
+    return await paged_history_response(
+        ActionTypes.GET_ALL_PIXELS_BY_USERNAME, ErrorTypes.USER_NOT_FOUND, "There is no user with this username.",
+        after, lambda: get_db_all_pixels_by_username(username, limit, after))
 
 @app.get("/users/id/{userID}", status_code=200, response_model=BaseResponseModel)
-def get_all_pixels_by_userid(request: Request, userID: str):
+async def get_all_pixels_by_userid(request: Request, userID: str, limit: int = Query(_PAGE_SIZE, ge=1, le=_PAGE_SIZE_MAX), after: Optional[str] = None):
     """
-    Endpoint to get all pixels of a user by their userID.
+    Endpoint to get the pixels of a user by their userID, newest first.
+    The pixels are paginated: pass the `next` cursor of a page as `after` to get the following one.
     """
-    return BaseResponseModel(
-        action=ActionTypes.GET_ALL_PIXELS_BY_USERID,
-        result={"pixels": get_db_all_pixels_by_userid(userID)},
-        error=None)
+    return await paged_history_response(
+        ActionTypes.GET_ALL_PIXELS_BY_USERID, ErrorTypes.USER_NOT_FOUND, "There is no user with this userID.",
+        after, lambda: get_db_all_pixels_by_userid(userID, limit, after))
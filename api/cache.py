@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typing import Any, Awaitable, Callable, Hashable, Optional
+import pymongo
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of serialized responses.
+    Entries expire after `ttl` seconds and are only served while the data versions they were built from are still current.
+    """
+    def __init__(self, maxEntries: int = 256, ttl: float = 60) -> None:
+        """
+        Initialize the cache.
+        maxEntries is the amount of responses kept before the least recently used one is evicted; ttl is the lifetime of an entry in seconds.
+        """
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, tuple, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, versions: tuple) -> Optional[Any]:
+        """
+        Returns the cached body for the key, or None if it is missing, expired or built from older data.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expiresAt, entryVersions, body = entry
+            if expiresAt < time.monotonic() or entryVersions != versions:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def set(self, key: Hashable, versions: tuple, body: Any) -> None:
+        """
+        Stores the body for the key, evicting the least recently used entries over the limit.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, versions, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+
+    async def get_or_build(self, key: Hashable, versions: tuple, build: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached body for the key, building and storing it on a miss.
+        """
+        body = self.get(key, versions)
+        if body is None:
+            body = await build()
+            self.set(key, versions, body)
+        return body
+
+
+class DataVersions:
+    """
+    Counters of the `versions` collection, bumped on every write to the data they are named after.
+    Reads are memoized for `refreshInterval` seconds, so a burst of cache hits costs at most one database round trip.
+    """
+    def __init__(self, collection: AsyncIOMotorCollection, refreshInterval: float = 1) -> None:
+        """
+        Initialize the version tracker.
+        collection is the collection holding one `{_id: name, version: int}` document per counter; refreshInterval is in seconds.
+        """
+        self.collection = collection
+        self.refreshInterval = refreshInterval
+        self._versions: dict[str, tuple[float, int]] = {}
+
+    async def get(self, name: str) -> int:
+        """
+        Returns the current version of the named data.
+        """
+        cached = self._versions.get(name)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        document = await self.collection.find_one({"_id": name})
+        version = document["version"] if document is not None else 0
+        self._versions[name] = (time.monotonic() + self.refreshInterval, version)
+        return version
+
+    async def bump(self, name: str) -> int:
+        """
+        Increments the version of the named data and returns the new one.
+        """
+        document = await self.collection.find_one_and_update({"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+        self._versions[name] = (time.monotonic() + self.refreshInterval, document["version"])
+        return document["version"]
@@ -0,0 +1,119 @@
+from datetime import datetime
+from palette import MAX_COLOURS, TRANSPARENT, encodeIndexedPNG, parseColour
+from PIL import Image
+from typing import Iterable, Optional
+import io
+import numpy
+import zlib
+
+class CanvasState:
+    """
+    State of the canvas at a given moment as an array of palette indices.
+    Index 0 is a pixel nobody has placed yet; index `i` is the colour `palette[i - 1]`.
+    Indices are kept one byte per pixel, and widened to two only if the palette ever outgrows a byte.
+    The canvas grows when a pixel outside of it is applied, so it never has to know the board size in advance.
+    """
+    def __init__(self, timestamp: datetime, width: int = 0, height: int = 0, palette: Optional[list[str]] = None, indices: Optional[numpy.ndarray] = None) -> None:
+        """
+        Initialize the state.
+        timestamp is the moment the state is valid for; palette and indices restore a stored state, otherwise the canvas is blank.
+        """
+        self.timestamp = timestamp
+        self.palette = list(palette or [])
+        self._paletteIndex = {colour: i + 1 for i, colour in enumerate(self.palette)}
+        self.indices = indices if indices is not None else numpy.zeros((height, width), dtype=numpy.uint8)
+
+    @property
+    def width(self) -> int:
+        return self.indices.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.indices.shape[0]
+
+    def colour_index(self, colour: str) -> int:
+        """
+        Returns the palette index of the colour, adding it to the palette the first time it is seen.
+        """
+        index = self._paletteIndex.get(colour)
+        if index is None:
+            self.palette.append(colour)
+            index = self._paletteIndex[colour] = len(self.palette)
+            if index >= MAX_COLOURS and self.indices.dtype == numpy.uint8:
+                self.indices = self.indices.astype(numpy.uint16)
+        return index
+
+    def resize(self, width: int, height: int) -> None:
+        """
+        Grows the canvas to at least `width`x`height`, keeping the placed pixels.
+        """
+        if width <= self.width and height <= self.height:
+            return
+        indices = numpy.zeros((max(height, self.height), max(width, self.width)), dtype=self.indices.dtype)
+        indices[:self.height, :self.width] = self.indices
+        self.indices = indices
+
+    def apply_pixels(self, pixels: Iterable[dict]) -> int:
+        """
+        Applies `pixels-info` documents in chronological order and returns how many were applied.
+        The timestamp of the state is left to the caller, which knows up to which moment the documents were read.
+        """
+        xs, ys, values = [], [], []
+        for pixel in pixels:
+            xs.append(pixel["point"]["x"])
+            ys.append(pixel["point"]["y"])
+            values.append(self.colour_index(pixel["colour"]))
+        if not values:
+            return 0
+        self.resize(max(xs) + 1, max(ys) + 1)
+        # Later assignments win on repeated coordinates, so the newest colour of a pixel ends up on the canvas.
+        self.indices[ys, xs] = values
+        return len(values)
+
+    def copy(self) -> "CanvasState":
+        return CanvasState(self.timestamp, palette=self.palette, indices=self.indices.copy())
+
+    def to_rgba(self) -> numpy.ndarray:
+        """
+        Returns the canvas as an RGBA array; pixels nobody has placed are transparent.
+        """
+        lookup = numpy.array([TRANSPARENT] + [parseColour(colour) for colour in self.palette], dtype=numpy.uint8)
+        return lookup[self.indices]
+
+    def to_png(self) -> bytes:
+        """
+        Returns the canvas encoded as a PNG image, in palette mode unless the palette outgrew a byte.
+        """
+        if self.indices.dtype == numpy.uint8:
+            return encodeIndexedPNG(self.indices, [TRANSPARENT] + [parseColour(colour) for colour in self.palette])
+        output = io.BytesIO()
+        Image.fromarray(self.to_rgba(), "RGBA").save(output, format="PNG")
+        return output.getvalue()
+
+    def to_raw(self) -> bytes:
+        """
+        Returns the palette indices row by row, one byte each if the palette fits in a byte and two (little-endian) otherwise.
+        """
+        return self.indices.astype(self.indices.dtype.newbyteorder("<")).tobytes()
+
+    def to_document(self) -> dict:
+        """
+        Returns the state as a `canvas-checkpoints` document.
+        """
+        return {
+            "_id": self.timestamp,
+            "width": self.width,
+            "height": self.height,
+            "palette": self.palette,
+            "dtype": self.indices.dtype.newbyteorder("<").str,
+            "indices": zlib.compress(self.to_raw()),
+        }
+
+    @classmethod
+    def from_document(cls, document: dict) -> "CanvasState":
+        """
+        Restores a state stored with `to_document`; checkpoints written before the `dtype` field always hold two bytes per pixel.
+        """
+        indices = numpy.frombuffer(zlib.decompress(document["indices"]), dtype=document.get("dtype", "<u2")).reshape(document["height"], document["width"])
+        indices = indices.astype(numpy.uint8 if len(document["palette"]) < MAX_COLOURS else numpy.uint16)
+        return cls(document["_id"], palette=document["palette"], indices=indices)
@@ -0,0 +1,113 @@
+from datetime import datetime
+from palette import TRANSPARENT, encodeIndexedPNG
+from typing import Optional
+import numpy
+import zlib
+
+# Stops of the colour ramp of the rendered heatmap, from the least to the most edited pixels.
+_RAMP_STOPS = numpy.array([(0, 0, 4), (87, 16, 110), (188, 55, 84), (249, 142, 9), (252, 255, 164)], dtype=numpy.float64)
+_RAMP_SIZE = 255
+
+
+def ramp_colours() -> list[tuple[int, int, int, int]]:
+    """
+    Returns the palette of the rendered heatmap: transparent for pixels nobody edited, then `_RAMP_SIZE` opaque colours.
+    """
+    positions = numpy.linspace(0, len(_RAMP_STOPS) - 1, _RAMP_SIZE)
+    channels = [numpy.interp(positions, numpy.arange(len(_RAMP_STOPS)), _RAMP_STOPS[:, channel]) for channel in range(3)]
+    return [TRANSPARENT] + [(int(red), int(green), int(blue), 0xFF) for red, green, blue in zip(*channels)]
+
+_RAMP_COLOURS = ramp_colours()
+
+
+class HeatmapCounts:
+    """
+    Amount of edits of every pixel over a span of history, as an array of counters.
+    The counts grow when a pixel outside of them is counted, so they never have to know the board size in advance.
+    """
+    def __init__(self, timestamp: datetime, width: int = 0, height: int = 0, counts: Optional[numpy.ndarray] = None) -> None:
+        """
+        Initialize the counts.
+        timestamp is the (exclusive) end of the history counted; counts restore stored counts, otherwise nothing is counted yet.
+        """
+        self.timestamp = timestamp
+        self.counts = counts if counts is not None else numpy.zeros((height, width), dtype=numpy.uint32)
+
+    @property
+    def width(self) -> int:
+        return self.counts.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.counts.shape[0]
+
+    def resize(self, width: int, height: int) -> None:
+        """
+        Grows the counts to at least `width`x`height`, keeping the counted edits.
+        """
+        if width <= self.width and height <= self.height:
+            return
+        counts = numpy.zeros((max(height, self.height), max(width, self.width)), dtype=numpy.uint32)
+        counts[:self.height, :self.width] = self.counts
+        self.counts = counts
+
+    def add_sparse(self, counts: dict[str, int]) -> int:
+        """
+        Adds the counts of a `heatmap-hourly` document, keyed by `x:y`, and returns the amount of edits added.
+        """
+        if not counts:
+            return 0
+        points = numpy.array([key.split(":") for key in counts], dtype=numpy.int64)
+        values = numpy.fromiter(counts.values(), dtype=numpy.uint32, count=len(counts))
+        self.resize(int(points[:, 0].max()) + 1, int(points[:, 1].max()) + 1)
+        self.counts[points[:, 1], points[:, 0]] += values
+        return int(values.sum())
+
+    def subtract(self, other: "HeatmapCounts") -> None:
+        """
+        Removes the edits counted by `other`, which must count a prefix of the same history.
+        Counts are clamped at 0, so a prefix counting more than this (e.g. built from an older rollup) cannot wrap around.
+        """
+        self.resize(other.width, other.height)
+        window = self.counts[:other.height, :other.width]
+        window[...] = numpy.maximum(window.astype(numpy.int64) - other.counts, 0)
+
+    def copy(self) -> "HeatmapCounts":
+        return HeatmapCounts(self.timestamp, counts=self.counts.copy())
+
+    def to_png(self) -> bytes:
+        """
+        Returns the counts rendered as a PNG image on a logarithmic colour ramp; pixels nobody edited are transparent.
+        """
+        maximum = int(self.counts.max()) if self.counts.size else 0
+        indices = numpy.zeros(self.counts.shape, dtype=numpy.uint8)
+        if maximum > 0:
+            edited = self.counts > 0
+            scaled = numpy.log1p(self.counts[edited]) / numpy.log1p(maximum)
+            indices[edited] = 1 + numpy.minimum((scaled * _RAMP_SIZE).astype(numpy.int64), _RAMP_SIZE - 1)
+        return encodeIndexedPNG(indices, _RAMP_COLOURS)
+
+    def to_raw(self) -> bytes:
+        """
+        Returns the counts row by row, four little-endian bytes each.
+        """
+        return self.counts.astype("<u4").tobytes()
+
+    def to_document(self) -> dict:
+        """
+        Returns the counts as a `heatmap-checkpoints` document.
+        """
+        return {
+            "_id": self.timestamp,
+            "width": self.width,
+            "height": self.height,
+            "counts": zlib.compress(self.to_raw()),
+        }
+
+    @classmethod
+    def from_document(cls, document: dict) -> "HeatmapCounts":
+        """
+        Restores counts stored with `to_document`.
+        """
+        counts = numpy.frombuffer(zlib.decompress(document["counts"]), dtype="<u4").reshape(document["height"], document["width"]).astype(numpy.uint32)
+        return cls(document["_id"], counts=counts)
@@ -0,0 +1,30 @@
+from prometheus_client import Counter, Histogram
+import pymongo.monitoring
+
+REQUEST_SECONDS = Histogram("api_request_seconds", "Time to handle a request, by route.", ["method", "route", "status"])
+DB_COMMAND_SECONDS = Histogram("api_db_command_seconds", "Time of a database command, as measured by the driver.", ["collection", "command"])
+DB_COMMAND_FAILURES = Counter("api_db_command_failures_total", "Database commands which failed.", ["collection", "command"])
+
+
+class DatabaseCommandTimer(pymongo.monitoring.CommandListener):
+    """
+    Command listener recording the duration of every database command.
+    Commands on a cursor (`getMore`, `killCursors`) are attributed to the collection of the cursor.
+    """
+    def __init__(self) -> None:
+        self._collections: dict[int, str] = {}
+
+    def started(self, event: pymongo.monitoring.CommandStartedEvent) -> None:
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event: pymongo.monitoring.CommandSucceededEvent) -> None:
+        collection = self._collections.pop(event.request_id, "")
+        DB_COMMAND_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event: pymongo.monitoring.CommandFailedEvent) -> None:
+        collection = self._collections.pop(event.request_id, "")
+        DB_COMMAND_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        DB_COMMAND_FAILURES.labels(collection, event.command_name).inc()
@@ -0,0 +1,205 @@
+"""
+Statistics rollups of the pixels history.
+
+The parser keeps these rollup collections up to date as it inserts pixels (see `parsePixels/derived.py`):
+- `stats-users`: one document per editor with its amount of placements, first and last placement and latest username;
+- `stats-hourly`: one document per hour of `modified` with its amount of placements and the editors who placed in it;
+- `stats-pixels`: one document per coordinate with its amount of edits and last edit;
+- `heatmap-hourly`: one document per hour of `modified` with the amount of edits of every pixel edited in it, keyed by `x:y`,
+  and a `version` incremented by every update.
+The pipelines below rebuild them from the `pixels-info` history. As the parser keeps counting during a rebuild, the history is split
+at a watermark, an ObjectId some time ahead: the rebuild counts the pixels with an `_id` below it, and the parser only counts the ones above it.
+The API drives every rebuild through the states of its `backfills` document (`{"_id": <rollup>, "state", "watermark", ...}`):
+- `pending`: the parser picks the watermark up; before the watermark is reached, the API empties the rollup and moves to `cleared`;
+- `cleared`: once the pixels below the watermark are all inserted, the API moves to `building` and adds their counts to the rollup;
+- `built`: the rollup counts every pixel, the rebuild is done.
+A rollup without a `backfills` document is rebuilt the same way, and so is one whose build stopped midway.
+Rebuilding `heatmap-hourly` also empties the cumulative `heatmap-checkpoints` the API keeps of it, which the API then builds again.
+
+This script requests a rebuild (e.g. after the parser ran without the rollups), which the running API carries out.
+
+Usage: python3 rollups.py --mongodb-uri mongodb://... [--collections stats-users stats-hourly stats-pixels heatmap-hourly] [--margin 60]
+"""
+from datetime import datetime, timedelta
+import argparse
+import bson
+import logging
+import os
+import pymongo
+
+STATS_USERS = "stats-users"
+STATS_HOURLY = "stats-hourly"
+STATS_PIXELS = "stats-pixels"
+HEATMAP_HOURLY = "heatmap-hourly"
+HEATMAP_CHECKPOINTS = "heatmap-checkpoints"
+BACKFILLS = "backfills"
+
+REBUILD_PENDING = "pending"
+REBUILD_CLEARED = "cleared"
+REBUILD_BUILDING = "building"
+REBUILD_BUILT = "built"
+
+def hour_of_modified() -> dict:
+    """
+    Function to get the expression truncating `modified` to the start of its hour.
+    """
+    return {"$dateFromParts": {
+        "year": {"$year": "$modified"},
+        "month": {"$month": "$modified"},
+        "day": {"$dayOfMonth": "$modified"},
+        "hour": {"$hour": "$modified"},
+    }}
+
+def pixel_key_of_point() -> dict:
+    """
+    Function to get the expression of the `x:y` key of the pixel.
+    """
+    return {"$concat": [{"$toString": "$point.x"}, ":", {"$toString": "$point.y"}]}
+
+def stats_users_pipeline() -> list[dict]:
+    """
+    Function to get the pipeline grouping `pixels-info` into `stats-users` documents.
+    """
+    return [
+        {"$sort": {"modified": 1}},
+        {"$group": {
+            "_id": "$editorID",
+            "placements": {"$sum": 1},
+            "firstPlaced": {"$min": "$modified"},
+            "lastPlaced": {"$max": "$modified"},
+            "username": {"$last": "$user.username"},
+        }},
+    ]
+
+def stats_hourly_pipeline() -> list[dict]:
+    """
+    Function to get the pipeline grouping `pixels-info` into `stats-hourly` documents.
+    """
+    return [
+        {"$group": {
+            "_id": hour_of_modified(),
+            "placements": {"$sum": 1},
+            "editors": {"$addToSet": "$editorID"},
+        }},
+    ]
+
+def stats_pixels_pipeline() -> list[dict]:
+    """
+    Function to get the pipeline grouping `pixels-info` into `stats-pixels` documents.
+    """
+    return [
+        {"$group": {
+            "_id": pixel_key_of_point(),
+            "point": {"$first": "$point"},
+            "edits": {"$sum": 1},
+            "lastModified": {"$max": "$modified"},
+        }},
+    ]
+
+def heatmap_hourly_pipeline() -> list[dict]:
+    """
+    Function to get the pipeline grouping `pixels-info` into `heatmap-hourly` documents.
+    """
+    return [
+        {"$group": {"_id": {"hour": hour_of_modified(), "pixel": pixel_key_of_point()}, "edits": {"$sum": 1}}},
+        {"$group": {"_id": "$_id.hour", "counts": {"$push": {"k": "$_id.pixel", "v": "$edits"}}}},
+        {"$project": {"counts": {"$arrayToObject": "$counts"}}},
+    ]
+
+ROLLUP_PIPELINES = {
+    STATS_USERS: stats_users_pipeline,
+    STATS_HOURLY: stats_hourly_pipeline,
+    STATS_PIXELS: stats_pixels_pipeline,
+    HEATMAP_HOURLY: heatmap_hourly_pipeline,
+}
+
+# Collections computed from a rollup, which no longer match it once it is rebuilt.
+ROLLUP_DEPENDENTS = {
+    HEATMAP_HOURLY: [HEATMAP_CHECKPOINTS],
+}
+
+def stats_users_update(document: dict) -> dict:
+    """
+    Function to get the update adding a rebuilt `stats-users` document to the one the parser may have started.
+    """
+    update = {
+        "$inc": {"placements": document["placements"]},
+        "$min": {"firstPlaced": document["firstPlaced"]},
+        "$max": {"lastPlaced": document["lastPlaced"]},
+    }
+    if document.get("username") is not None:
+        # The parser only writes usernames newer than the watermark.
+        update["$setOnInsert"] = {"username": document["username"]}
+    return update
+
+def stats_hourly_update(document: dict) -> dict:
+    """
+    Function to get the update adding a rebuilt `stats-hourly` document to the one the parser may have started.
+    """
+    return {"$inc": {"placements": document["placements"]}, "$addToSet": {"editors": {"$each": sorted(document["editors"])}}}
+
+def stats_pixels_update(document: dict) -> dict:
+    """
+    Function to get the update adding a rebuilt `stats-pixels` document to the one the parser may have started.
+    """
+    return {"$inc": {"edits": document["edits"]}, "$max": {"lastModified": document["lastModified"]}, "$setOnInsert": {"point": document["point"]}}
+
+def heatmap_hourly_update(document: dict) -> dict:
+    """
+    Function to get the update adding a rebuilt `heatmap-hourly` document to the one the parser may have started.
+    """
+    return {"$inc": {**{f"counts.{key}": count for key, count in document["counts"].items()}, "version": 1}}
+
+# The updates are the ones of the parser, so a rollup adds up the counts of the rebuild and of the parser whatever their order.
+ROLLUP_UPDATES = {
+    STATS_USERS: stats_users_update,
+    STATS_HOURLY: stats_hourly_update,
+    STATS_PIXELS: stats_pixels_update,
+    HEATMAP_HOURLY: heatmap_hourly_update,
+}
+
+def rebuild_pipeline(name: str, watermark: bson.ObjectId) -> list[dict]:
+    """
+    Function to get the pipeline grouping the pixels below the watermark into documents of the rollup `name`.
+    """
+    return [{"$match": {"_id": {"$lt": watermark}}}] + ROLLUP_PIPELINES[name]()
+
+def rebuild_request(name: str, now: datetime, margin: timedelta) -> dict:
+    """
+    Function to get the `backfills` document requesting a rebuild of the rollup `name`, with its watermark `margin` ahead of `now`.
+    The rollup is emptied halfway to the watermark, once the parser has picked it up, and built `margin` after it,
+    once the pixels below it are inserted; the clocks of the API and the parser must agree to well within half the margin.
+    """
+    return {
+        "_id": name,
+        "state": REBUILD_PENDING,
+        "watermark": bson.ObjectId.from_datetime(now + margin),
+        "requestedAt": now,
+        "clearAt": now + margin / 2,
+        "buildAt": now + margin * 2,
+    }
+
+def main():
+    """
+    Main function.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-uri", default=os.environ.get("MONGODB_URI"))
+    parser.add_argument("--collections", nargs="+", choices=list(ROLLUP_PIPELINES), default=list(ROLLUP_PIPELINES))
+    parser.add_argument("--margin", type=float, default=float(os.environ.get("ROLLUP_BUILD_MARGIN", 60)), help="seconds between the request and the watermark")
+    args = parser.parse_args()
+    if not args.mongodb_uri:
+        parser.error("--mongodb-uri (or MONGODB_URI) is required")
+    database = pymongo.MongoClient(args.mongodb_uri)["plcgxrm"]
+    for name in args.collections:
+        try:
+            # A rebuild already adding its counts goes on; requesting another one afterwards starts over.
+            database[BACKFILLS].replace_one({"_id": name, "state": {"$ne": REBUILD_BUILDING}}, rebuild_request(name, datetime.utcnow(), timedelta(seconds=args.margin)), upsert=True)
+        except pymongo.errors.DuplicateKeyError:
+            logging.warning(f"{name} is being rebuilt already, not requesting another rebuild.")
+            continue
+        logging.info(f"Requested a rebuild of {name}, the API carries it out.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Load test of the API: hammers slow endpoints in the background while measuring the latency of cheap ones.
+Run it once against the sync build and once against the async build of `api/app.py` to compare how much slow scans starve cheap calls.
+
+Usage: python3 benchmarks/api_load.py --base-url http://127.0.0.1:8000 [--slow /users/all] [--fast /status] [--slow-concurrency 32] [--duration 20]
+"""
+from typing import Optional
+import aiohttp
+import argparse
+import asyncio
+import statistics
+import time
+
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    Returns the `fraction` percentile of the values (nearest-rank).
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def hammer(session: aiohttp.ClientSession, url: str, deadline: float, latencies: list[float], errors: list[int], headers: Optional[dict] = None) -> None:
+    """
+    Requests `url` in a loop until `deadline`, recording every latency in seconds.
+    """
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors.append(response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors.append(0)
+        latencies.append(time.perf_counter() - start)
+
+def report(path: str, latencies: list[float], errors: list[int], duration: float) -> None:
+    """
+    Prints one line of latency statistics for an endpoint.
+    """
+    print(f"{path:<28} {len(latencies):>8} {len(latencies) / duration:>9.1f} {percentile(latencies, 0.5) * 1000:>9.1f} {percentile(latencies, 0.99) * 1000:>9.1f} {(statistics.fmean(latencies) if latencies else float('nan')) * 1000:>9.1f} {len(errors):>7}")
+
+async def run(args: argparse.Namespace) -> None:
+    """
+    Runs the slow and fast request loops concurrently and prints the results.
+    """
+    headers = {"Authorization": args.api_key} if args.api_key else None
+    deadline = time.monotonic() + args.duration
+    results = {path: ([], []) for path in args.slow + args.fast}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=args.timeout)) as session:
+        tasks = []
+        for path in args.slow:
+            tasks += [hammer(session, args.base_url + path, deadline, *results[path], headers) for _ in range(args.slow_concurrency)]
+        for path in args.fast:
+            tasks += [hammer(session, args.base_url + path, deadline, *results[path], headers) for _ in range(args.fast_concurrency)]
+        await asyncio.gather(*tasks)
+    print(f"{'endpoint':<28} {'requests':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'errors':>7}")
+    for path, (latencies, errors) in results.items():
+        report(path, latencies, errors, args.duration)
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--slow", nargs="+", default=["/users/all"])
+    parser.add_argument("--fast", nargs="+", default=["/status"])
+    parser.add_argument("--slow-concurrency", type=int, default=32)
+    parser.add_argument("--fast-concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--api-key", default=None, help="value of the Authorization header, for /pixels/all")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
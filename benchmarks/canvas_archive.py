@@ -0,0 +1,94 @@
+"""
+Benchmark of the delta-encoded canvas archive of the canvas downloader against a plain folder of PNG snapshots.
+Reports the storage size of both, with the archive holding either RGBA frames or palette indices as the downloader does,
+and the time to get back a random frame.
+
+Usage: python3 benchmarks/canvas_archive.py [--size 500] [--frames 480] [--changes 40] [--keyframe-interval 240]
+"""
+from PIL import Image
+from pathlib import Path
+import argparse
+import numpy
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "canvasDownloader"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "shared"))
+
+from archive import CanvasArchiveReader, CanvasArchiveWriter
+
+def generateFrames(size: int, frames: int, changes: int, seed: int = 0):
+    """
+    Yields `frames` RGBA boards of `size`x`size` in a 16-colour palette, each one with `changes` pixels repainted.
+    """
+    generator = numpy.random.default_rng(seed)
+    palette = generator.integers(0, 256, size=(16, 4), dtype=numpy.uint8)
+    palette[:, 3] = 255
+    frame = palette[generator.integers(0, len(palette), size=(size, size))]
+    for _ in range(frames):
+        frame = frame.copy()
+        frame.reshape(-1, 4)[generator.integers(0, size * size, size=changes)] = palette[generator.integers(0, len(palette), size=changes)]
+        yield frame
+
+def folderSize(path: Path) -> int:
+    """
+    Returns the total size of the files in the folder in bytes.
+    """
+    return sum(file.stat().st_size for file in path.iterdir() if file.is_file())
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=500)
+    parser.add_argument("--frames", type=int, default=480)
+    parser.add_argument("--changes", type=int, default=40)
+    parser.add_argument("--keyframe-interval", type=int, default=240)
+    parser.add_argument("--reads", type=int, default=20)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temporaryFolder:
+        pngFolder, archiveFolder, indexedFolder = Path(temporaryFolder) / "png", Path(temporaryFolder) / "archive", Path(temporaryFolder) / "indexed"
+        pngFolder.mkdir()
+        writer = CanvasArchiveWriter(archiveFolder, keyframeInterval=args.keyframe_interval)
+        indexedWriter = CanvasArchiveWriter(indexedFolder, keyframeInterval=args.keyframe_interval)
+        pngWriteTime = archiveWriteTime = indexedWriteTime = 0.0
+        for timestamp, frame in enumerate(generateFrames(args.size, args.frames, args.changes)):
+            start = time.perf_counter()
+            Image.fromarray(frame, "RGBA").save(pngFolder / f"place_geoxor_moe-{timestamp}.png", format="PNG")
+            pngWriteTime += time.perf_counter() - start
+            start = time.perf_counter()
+            writer.append(timestamp, frame)
+            archiveWriteTime += time.perf_counter() - start
+            start = time.perf_counter()
+            indexedWriter.appendImage(timestamp, Image.fromarray(frame, "RGBA"))
+            indexedWriteTime += time.perf_counter() - start
+        writer.close()
+        indexedWriter.close()
+        positions = numpy.random.default_rng(1).integers(0, args.frames, size=args.reads)
+        start = time.perf_counter()
+        for position in positions:
+            with Image.open(pngFolder / f"place_geoxor_moe-{position}.png") as image:
+                numpy.asarray(image)
+        pngReadTime = (time.perf_counter() - start) / args.reads
+        with CanvasArchiveReader(archiveFolder) as reader:
+            start = time.perf_counter()
+            for position in positions:
+                reader.frame(int(position))
+            archiveReadTime = (time.perf_counter() - start) / args.reads
+        with CanvasArchiveReader(indexedFolder) as reader:
+            start = time.perf_counter()
+            for position in positions:
+                reader.frameRGBA(int(position))
+            indexedReadTime = (time.perf_counter() - start) / args.reads
+        pngSize, archiveSize, indexedSize = folderSize(pngFolder), folderSize(archiveFolder), folderSize(indexedFolder)
+    print(f"{args.frames} frames of {args.size}x{args.size}, {args.changes} changed pixels per frame, keyframe every {args.keyframe_interval} frames")
+    print(f"{'format':<10} {'size (MiB)':>11} {'write/frame (ms)':>17} {'read/frame (ms)':>16}")
+    print(f"{'png':<10} {pngSize / 2 ** 20:>11.2f} {pngWriteTime / args.frames * 1000:>17.2f} {pngReadTime * 1000:>16.2f}")
+    print(f"{'archive':<10} {archiveSize / 2 ** 20:>11.2f} {archiveWriteTime / args.frames * 1000:>17.2f} {archiveReadTime * 1000:>16.2f}")
+    print(f"{'indexed':<10} {indexedSize / 2 ** 20:>11.2f} {indexedWriteTime / args.frames * 1000:>17.2f} {indexedReadTime * 1000:>16.2f}")
+    print(f"archive is {pngSize / archiveSize:.1f}x smaller, {pngSize / indexedSize:.1f}x with palette indices")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Generator of a synthetic pixels-info history, to load a throwaway MongoDB with a production-sized dataset.
+Placements follow a skewed distribution: a few prolific users and a few hot spots of the board get most of them.
+
+Only a MongoDB on this machine is accepted unless `--allow-remote` is given, so a production database cannot be filled or dropped by mistake.
+
+Usage: python3 benchmarks/dataset.py --mongodb-uri mongodb://127.0.0.1:27017 [--pixels 1000000] [--size 500] [--users 5000] [--days 7] [--drop]
+"""
+from datetime import datetime, timedelta
+from typing import Iterator
+from urllib.parse import urlparse
+import argparse
+import pymongo
+import random
+import time
+
+from fake_upstream import fakeUser
+
+_BASE_DATE = datetime(2022, 4, 1)
+_DATABASE_NAME = "plcgxrm"
+_LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+_COLLECTIONS = ["pixels-info", "pixels-latest", "users", "versions", "canvas-checkpoints", "timelapses", "stats-users", "stats-hourly", "stats-pixels", "heatmap-hourly", "heatmap-checkpoints", "backfills", "board"]
+
+def generatePixels(count: int, size: int = 500, users: int = 5000, days: float = 7, seed: int = 0) -> Iterator[dict]:
+    """
+    Yields `count` pixels-info documents in chronological order, spread over `days` days from 2022-04-01.
+    """
+    generator = random.Random(seed)
+    palette = [f"#{generator.randint(0, 0xFFFFFF):06X}" for _ in range(32)]
+    hotSpots = [(generator.randrange(size), generator.randrange(size)) for _ in range(8)]
+    step = timedelta(days=days) / max(count, 1)
+    userDocuments = {}
+    for i in range(count):
+        if generator.random() < 0.3:
+            centreX, centreY = generator.choice(hotSpots)
+            x = min(size - 1, max(0, int(generator.gauss(centreX, size / 50))))
+            y = min(size - 1, max(0, int(generator.gauss(centreY, size / 50))))
+        else:
+            x, y = generator.randrange(size), generator.randrange(size)
+        userID = min(users, int(generator.paretovariate(1.2)))
+        if userID not in userDocuments:
+            userDocuments[userID] = fakeUser(userID)
+            userDocuments[userID]["creationDate"] = _BASE_DATE
+            userDocuments[userID]["statistics"]["lastPlace"] = _BASE_DATE
+        yield {
+            "point": {"x": x, "y": y},
+            "modified": (_BASE_DATE + step * i).replace(microsecond=0),
+            "colour": generator.choice(palette),
+            "editorID": f"user-{userID}",
+            "user": userDocuments[userID],
+        }
+
+def loadDataset(mongodbURI: str, count: int, size: int, users: int, days: float, drop: bool = False, batchSize: int = 10000) -> int:
+    """
+    Inserts the synthetic history into the pixels-info collection of the database the services use and returns the amount inserted.
+    With `drop` every collection of the services is dropped first, so the API rebuilds its derived collections from the new history.
+    """
+    database = pymongo.MongoClient(mongodbURI)[_DATABASE_NAME]
+    if drop:
+        for name in _COLLECTIONS:
+            database.drop_collection(name)
+    batch, inserted = [], 0
+    for document in generatePixels(count, size, users, days):
+        batch.append(document)
+        if len(batch) >= batchSize:
+            inserted += insertBatch(database["pixels-info"], batch)
+            batch = []
+    if batch:
+        inserted += insertBatch(database["pixels-info"], batch)
+    return inserted
+
+def insertBatch(collection: pymongo.collection.Collection, batch: list[dict]) -> int:
+    """
+    Inserts the batch and returns the amount inserted; placements already stored (same coordinates and `modified`) are skipped by the unique index.
+    """
+    try:
+        return len(collection.insert_many(batch, ordered=False).inserted_ids)
+    except pymongo.errors.BulkWriteError as e:
+        return e.details["nInserted"]
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-uri", required=True, help="a throwaway MongoDB, never the production one")
+    parser.add_argument("--allow-remote", action="store_true", help="allow a MongoDB which is not on this machine")
+    parser.add_argument("--pixels", type=int, default=1000000)
+    parser.add_argument("--size", type=int, default=500)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--drop", action="store_true", help="drop the collections of the services first")
+    args = parser.parse_args()
+    if urlparse(args.mongodb_uri).hostname not in _LOCAL_HOSTS and not args.allow_remote:
+        parser.error("the script fills (and with --drop drops) the collections of the services, so it only runs against a local MongoDB unless --allow-remote is given")
+    start = time.perf_counter()
+    inserted = loadDataset(args.mongodb_uri, args.pixels, args.size, args.users, args.days, args.drop)
+    print(f"Inserted {inserted} pixels in {time.perf_counter() - start:.1f} seconds.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the canvas diff used by the pixels parser.
+Compares the previous per-pixel `getpixel` loop with the NumPy-backed diff on synthetic boards of several sizes,
+both on RGBA arrays and on the palette indices the parser diffs now.
+
+Usage: python3 benchmarks/diff_engine.py [--sizes 250 500 1000] [--change-rate 0.001] [--repeat 3]
+"""
+from PIL import Image
+from pathlib import Path
+from typing import List
+import argparse
+import numpy
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "parsePixels"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "shared"))
+
+from diffing import imageToArray, findChangedPixels
+from palette import Palette
+
+def legacyFindChangedPixels(previous: Image.Image, current: Image.Image) -> List[tuple[int, int]]:
+    """
+    The diff as it was implemented in `parsePixels/run.py` before the NumPy engine.
+    """
+    changedPixels = []
+    for x in range(0, current.width):
+        for y in range(0, current.height):
+            if current.getpixel((x, y)) != previous.getpixel((x, y)):
+                changedPixels.append((x, y))
+    return changedPixels
+
+def generateBoards(size: int, changeRate: float, seed: int = 0) -> tuple[Image.Image, Image.Image]:
+    """
+    Generates two RGBA boards of `size`x`size`, where the second one has roughly `changeRate` of its pixels repainted.
+    """
+    generator = numpy.random.default_rng(seed)
+    palette = generator.integers(0, 256, size=(16, 4), dtype=numpy.uint8)
+    palette[:, 3] = 255
+    previous = palette[generator.integers(0, len(palette), size=(size, size))]
+    current = previous.copy()
+    changed = generator.random((size, size)) < changeRate
+    current[changed] = palette[generator.integers(0, len(palette), size=int(changed.sum()))]
+    return Image.fromarray(previous, "RGBA"), Image.fromarray(current, "RGBA")
+
+def timeIt(function, repeat: int) -> float:
+    """
+    Returns the best wall-clock time of `repeat` runs of `function`.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 250, 500, 1000])
+    parser.add_argument("--change-rate", type=float, default=0.001)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(f"{'size':>10} {'changed':>9} {'legacy (s)':>12} {'numpy (s)':>12} {'indexed (s)':>12} {'speedup':>9}")
+    for size in args.sizes:
+        previous, current = generateBoards(size, args.change_rate)
+        expected = legacyFindChangedPixels(previous, current)
+        assert findChangedPixels(imageToArray(previous), imageToArray(current)) == expected
+        legacyTime = timeIt(lambda: legacyFindChangedPixels(previous, current), args.repeat)
+        numpyTime = timeIt(lambda: findChangedPixels(imageToArray(previous), imageToArray(current)), args.repeat)
+        palette = Palette()
+        assert findChangedPixels(palette.indexImage(previous), palette.indexImage(current)) == expected
+        indexedTime = timeIt(lambda: findChangedPixels(palette.indexImage(previous), palette.indexImage(current)), args.repeat)
+        print(f"{f'{size}x{size}':>10} {len(expected):>9} {legacyTime:>12.4f} {numpyTime:>12.4f} {indexedTime:>12.4f} {legacyTime / min(numpyTime, indexedTime):>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Offline end-to-end benchmark of the pixels parser and the API, against the fake upstream and a throwaway local MongoDB
+(e.g. `docker run --rm -p 27017:27017 mongo:5`); every collection of the services in it is dropped.
+
+- `parser` runs `parsePixels/run.py` against a fake upstream repainting the board at `--change-rate` pixels per second
+  and reports the pixels stored per second and the tick lag (placement upstream to insert into pixels-info).
+- `api` loads a synthetic history, starts `api/app.py` with uvicorn and reports p50/p99 latency per endpoint.
+- `all` runs both.
+
+With `--output` the results are saved as JSON; with `--baseline` they are compared against a previous output,
+and the script exits with status 1 if any of them regressed by more than `--tolerance`.
+
+Usage: python3 benchmarks/end_to_end.py --mongodb-uri mongodb://127.0.0.1:27017 [parser|api|all] [--duration 60] [--output results.json] [--baseline results.json]
+"""
+from aiohttp import web
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+import aiohttp
+import argparse
+import asyncio
+import json
+import os
+import pymongo
+import socket
+import subprocess
+import sys
+import time
+
+from api_load import hammer, percentile, report
+from dataset import _LOCAL_HOSTS, loadDataset
+from fake_upstream import FakeUpstreamConfig, createApp
+
+_ROOT = Path(__file__).resolve().parent.parent
+_DATABASE_NAME = "plcgxrm"
+_PARSER_COLLECTIONS = ["pixels-info", "pixels-latest", "users", "versions", "stats-users", "stats-hourly", "stats-pixels", "heatmap-hourly", "backfills", "board"]
+_API_KEY = "benchmark"
+_API_ENDPOINTS = [
+    "/status",
+    "/pixels/{x}/{y}?limit=100",
+    "/pixels/{x}/{y}/latest",
+    "/pixels/region?x0=0&y0=0&x1=63&y1=63",
+    "/pixels/region?x0=0&y0=0&x1=63&y1=63&encoding=columnar",
+    "/users/all",
+    "/users/name/placer1?limit=100",
+    "/canvas/at?timestamp=2022-04-04T12:00:00",
+    "/canvas/heatmap?since=2022-04-02T00:00:00&until=2022-04-05T00:00:00",
+    "/stats/users/top",
+    "/stats/hourly?since=2022-04-01T00:00:00&until=2022-04-08T00:00:00",
+    "/stats/pixels/top",
+]
+
+def freePort() -> int:
+    """
+    Returns a local TCP port nobody listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def startService(arguments: list[str], folder: Path, environment: dict, logPath: Optional[Path]) -> subprocess.Popen:
+    """
+    Starts one of the services as a subprocess, with its output discarded or written to `logPath`.
+    The shared modules are put on its path, as the Dockerfiles copy them next to the service.
+    """
+    output = open(logPath, "w") if logPath is not None else subprocess.DEVNULL
+    pythonPath = os.pathsep.join(filter(None, [str(_ROOT / "shared"), os.environ.get("PYTHONPATH")]))
+    return subprocess.Popen([sys.executable] + arguments, cwd=folder, env={**os.environ, **environment, "PYTHONPATH": pythonPath}, stdout=output, stderr=subprocess.STDOUT)
+
+def stopService(process: subprocess.Popen) -> None:
+    """
+    Stops a service started with `startService`.
+    """
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+async def benchmarkParser(args: argparse.Namespace) -> dict:
+    """
+    Runs the parser against the fake upstream for `--duration` seconds and returns its throughput and tick lag.
+    """
+    database = pymongo.MongoClient(args.mongodb_uri)[_DATABASE_NAME]
+    for name in _PARSER_COLLECTIONS:
+        database.drop_collection(name)
+    app = createApp(FakeUpstreamConfig(latency=args.latency, throttleRate=args.throttle_rate, maxConcurrent=args.max_concurrent, size=args.size, changeRate=args.change_rate, boardThrottleRate=args.board_throttle_rate))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    endpointURL = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    parser = startService(["run.py"], _ROOT / "parsePixels", {"MONGODB_URI": args.mongodb_uri, "PLACE_ENDPOINT_URL": endpointURL}, args.parser_log)
+    try:
+        await asyncio.sleep(args.duration)
+    finally:
+        stopService(parser)
+        await runner.cleanup()
+    statistics = app["statistics"]
+    lags = [(pixel["_id"].generation_time.replace(tzinfo=None) - pixel["modified"]).total_seconds() for pixel in database["pixels-info"].find({}, {"modified": 1})]
+    results = {
+        "changes": statistics.changes,
+        "stored": len(lags),
+        "pixels_per_second": len(lags) / args.duration,
+        "tick_lag_p50": percentile(lags, 0.5),
+        "tick_lag_p99": percentile(lags, 0.99),
+        "pos_info_throttled": statistics.throttled,
+        "board_throttled": statistics.boardThrottled,
+        "board_not_modified": statistics.boardNotModified,
+    }
+    print(f"parser: {args.duration:.0f} s, board of {args.size}x{args.size} repainted at {args.change_rate} pixels/s")
+    print(f"{'changes':>8} {'stored':>8} {'pixels/s':>9} {'lag p50 s':>10} {'lag p99 s':>10} {'503 pos-info':>13} {'503 board':>10} {'304 board':>10}")
+    print(f"{results['changes']:>8} {results['stored']:>8} {results['pixels_per_second']:>9.1f} {results['tick_lag_p50']:>10.1f} {results['tick_lag_p99']:>10.1f} {results['pos_info_throttled']:>13} {results['board_throttled']:>10} {results['board_not_modified']:>10}")
+    return results
+
+async def waitForAPI(baseURL: str, database: pymongo.database.Database, timeout: float) -> None:
+    """
+    Waits for the API to answer and for its bootstrap to fill the derived collections.
+    """
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{baseURL}/status") as response:
+                    if response.status == 200 and all(database[name].estimated_document_count() > 0 for name in ["pixels-latest", "users", "stats-users", "stats-hourly", "stats-pixels", "heatmap-hourly"]):
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(1)
+    raise TimeoutError(f"The API was not ready after {timeout} seconds.")
+
+async def benchmarkAPI(args: argparse.Namespace) -> dict:
+    """
+    Loads the synthetic history, starts the API and hammers every endpoint in turn; returns p50/p99 latency per endpoint.
+    """
+    database = pymongo.MongoClient(args.mongodb_uri)[_DATABASE_NAME]
+    if args.pixels > 0:
+        start = time.perf_counter()
+        loaded = loadDataset(args.mongodb_uri, args.pixels, args.size, args.users, args.days, drop=True)
+        print(f"api: loaded {loaded} pixels in {time.perf_counter() - start:.1f} s")
+    point = database["pixels-info"].find_one({}, {"point": 1})["point"]
+    port = freePort()
+    baseURL = f"http://127.0.0.1:{port}"
+    api = startService(["-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port)], _ROOT / "api", {"MONGODB_URI": args.mongodb_uri, "MASTER_KEY": _API_KEY}, args.api_log)
+    results = {}
+    try:
+        await waitForAPI(baseURL, database, args.warmup_timeout)
+        print(f"{'endpoint':<28} {'requests':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'errors':>7}")
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=aiohttp.ClientTimeout(total=60)) as session:
+            for endpoint in args.endpoints:
+                path = endpoint.format(x=point["x"], y=point["y"])
+                latencies, errors = [], []
+                deadline = time.monotonic() + args.endpoint_duration
+                await asyncio.gather(*(hammer(session, baseURL + path, deadline, latencies, errors) for _ in range(args.concurrency)))
+                report(endpoint[:28], latencies, errors, args.endpoint_duration)
+                results[endpoint] = {"p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99), "errors": len(errors)}
+    finally:
+        stopService(api)
+    return results
+
+def compareWithBaseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a description of every result worse than its baseline by more than `tolerance` (a fraction).
+    Throughput is expected to stay up, latencies and lags to stay down.
+    """
+    regressions = []
+    parser, baselineParser = results.get("parser"), baseline.get("parser")
+    if parser and baselineParser:
+        if parser["pixels_per_second"] < baselineParser["pixels_per_second"] * (1 - tolerance):
+            regressions.append(f"parser pixels/s: {parser['pixels_per_second']:.1f} vs {baselineParser['pixels_per_second']:.1f}")
+        for key in ["tick_lag_p50", "tick_lag_p99"]:
+            if parser[key] > baselineParser[key] * (1 + tolerance):
+                regressions.append(f"parser {key}: {parser[key]:.1f} s vs {baselineParser[key]:.1f} s")
+    for endpoint, latency in results.get("api", {}).items():
+        baselineLatency = baseline.get("api", {}).get(endpoint)
+        if baselineLatency is None:
+            continue
+        for key in ["p50", "p99"]:
+            if latency[key] > baselineLatency[key] * (1 + tolerance):
+                regressions.append(f"{endpoint} {key}: {latency[key] * 1000:.1f} ms vs {baselineLatency[key] * 1000:.1f} ms")
+    return regressions
+
+async def run(args: argparse.Namespace) -> dict:
+    """
+    Runs the selected benchmarks and returns their results.
+    """
+    results = {}
+    if args.target in ("parser", "all"):
+        results["parser"] = await benchmarkParser(args)
+    if args.target in ("api", "all"):
+        results["api"] = await benchmarkAPI(args)
+    return results
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", nargs="?", choices=["parser", "api", "all"], default="all")
+    parser.add_argument("--mongodb-uri", required=True, help="a throwaway local MongoDB, its collections are dropped")
+    parser.add_argument("--allow-remote", action="store_true", help="allow a MongoDB which is not on this machine")
+    parser.add_argument("--duration", type=float, default=60, help="seconds the parser runs for")
+    parser.add_argument("--size", type=int, default=500)
+    parser.add_argument("--change-rate", type=float, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--throttle-rate", type=float, default=0.01)
+    parser.add_argument("--board-throttle-rate", type=float, default=0.05)
+    parser.add_argument("--max-concurrent", type=int, default=64)
+    parser.add_argument("--pixels", type=int, default=200000, help="size of the synthetic history for the API; 0 keeps the current data")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--endpoints", nargs="+", default=_API_ENDPOINTS)
+    parser.add_argument("--endpoint-duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup-timeout", type=float, default=600)
+    parser.add_argument("--parser-log", type=Path, default=None)
+    parser.add_argument("--api-log", type=Path, default=None)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    if urlparse(args.mongodb_uri).hostname not in _LOCAL_HOSTS and not args.allow_remote:
+        parser.error("the benchmark drops collections, so it only runs against a local MongoDB unless --allow-remote is given")
+    results = asyncio.run(run(args))
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=4))
+    if args.baseline is not None:
+        regressions = compareWithBaseline(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Local stand-in for place.geoxor.moe, so the parser and the canvas downloader can be exercised without touching the real site.
+Serves `/api/board-image` from a synthetic board repainted at a configurable rate, and `/api/pos-info` with the information
+of the latest placement of the pixel, with a configurable latency, a concurrency limit and random 503 injection on both.
+The board image carries an ETag and answers conditional requests with 304 unless `--no-conditional` is given.
+
+Usage: python3 benchmarks/fake_upstream.py [--port 8080] [--size 500] [--change-rate 20] [--latency 0.05] [--throttle-rate 0.01] [--board-throttle-rate 0.05] [--max-concurrent 64]
+"""
+from aiohttp import web
+from datetime import datetime, timedelta
+from io import BytesIO
+from PIL import Image
+from typing import Optional
+import argparse
+import asyncio
+import numpy
+import random
+import time
+
+_BASE_DATE = datetime(2022, 4, 1)
+
+class FakeUpstreamConfig:
+    """
+    Behaviour of the fake upstream.
+    """
+    def __init__(self, latency: float = 0.05, throttleRate: float = 0.0, maxConcurrent: int = 64, seed: int = 0, size: int = 500, changeRate: float = 0.0, boardThrottleRate: float = 0.0, conditional: bool = True) -> None:
+        """
+        Initialize the configuration.
+        changeRate is the amount of pixels repainted per second on the `size`x`size` board; throttle rates are the probabilities of a 503.
+        """
+        self.latency = latency
+        self.throttleRate = throttleRate
+        self.maxConcurrent = maxConcurrent
+        self.random = random.Random(seed)
+        self.size = size
+        self.changeRate = changeRate
+        self.boardThrottleRate = boardThrottleRate
+        self.conditional = conditional
+
+class FakeUpstreamStatistics:
+    """
+    Counters of what the fake upstream has served.
+    """
+    def __init__(self) -> None:
+        self.requests = 0
+        self.served = 0
+        self.throttled = 0
+        self.inFlight = 0
+        self.peakInFlight = 0
+        self.boardRequests = 0
+        self.boardThrottled = 0
+        self.boardNotModified = 0
+        self.changes = 0
+
+class FakeBoard:
+    """
+    Synthetic board in a 16-colour palette, repainted at `changeRate` pixels per second of wall-clock time.
+    Every placement is remembered, so pos-info answers match what the board image shows; `modified` is the real UTC time of the placement.
+    """
+    def __init__(self, size: int, changeRate: float, generator: random.Random) -> None:
+        self.size = size
+        self.changeRate = changeRate
+        self.generator = generator
+        self.palette = [f"#{generator.randint(0, 0xFFFFFF):06X}" for _ in range(16)]
+        self._paletteRGBA = numpy.array([[int(colour[i:i + 2], 16) for i in (1, 3, 5)] + [255] for colour in self.palette], dtype=numpy.uint8)
+        self.indices = numpy.zeros((size, size), dtype=numpy.uint8)
+        self.placements: dict[tuple[int, int], tuple[datetime, int, int]] = {}
+        self._lastAdvance = time.monotonic()
+        self._pendingChanges = 0.0
+        self._image: Optional[bytes] = None
+        self.version = 0
+
+    def advance(self) -> int:
+        """
+        Applies the placements due since the last call and returns how many were made.
+        """
+        now = time.monotonic()
+        self._pendingChanges += (now - self._lastAdvance) * self.changeRate
+        self._lastAdvance = now
+        changes = int(self._pendingChanges)
+        self._pendingChanges -= changes
+        placedAt = datetime.utcnow().replace(microsecond=0)
+        for _ in range(changes):
+            x, y = self.generator.randrange(self.size), self.generator.randrange(self.size)
+            colour = self.generator.randrange(1, len(self.palette))
+            self.indices[y, x] = colour
+            self.placements[(x, y)] = (placedAt, colour, self.generator.randint(1, 500))
+        if changes:
+            self._image = None
+            self.version += 1
+        return changes
+
+    def image(self) -> bytes:
+        """
+        Returns the board encoded as a PNG image, re-encoding it only after a change.
+        """
+        if self._image is None:
+            output = BytesIO()
+            Image.fromarray(self._paletteRGBA[self.indices], "RGBA").save(output, format="PNG", compress_level=1)
+            self._image = output.getvalue()
+        return self._image
+
+    def pixelInformation(self, x: int, y: int) -> Optional[dict]:
+        """
+        Returns the `/api/pos-info` response for the latest placement at (x, y), or None if nobody has placed it.
+        """
+        placement = self.placements.get((x, y))
+        if placement is None:
+            return None
+        placedAt, colour, userID = placement
+        return {
+            "pixel": {
+                "point": {"x": x, "y": y},
+                "modified": placedAt.isoformat(),
+                "colour": self.palette[colour],
+                "editorID": f"user-{userID}",
+                "user": fakeUser(userID),
+            }
+        }
+
+def fakeUser(userID: int) -> dict:
+    """
+    Returns a synthetic user object in the shape of the upstream API.
+    """
+    return {
+        "id": f"user-{userID}",
+        "username": f"placer{userID}",
+        "isOauth": False,
+        "creationDate": _BASE_DATE.isoformat(),
+        "admin": False,
+        "moderator": False,
+        "statistics": {"totalPlaces": userID * 3, "lastPlace": _BASE_DATE.isoformat(), "placesThisWeek": userID, "leaderboardRank": userID},
+        "banned": False,
+        "deactivated": False,
+        "markedForDeletion": False,
+        "badges": [{"text": "Placer", "style": "default", "isRanking": False, "lowPriority": True, "isLowRanking": False}],
+        "latestPixel": None,
+    }
+
+def fakePixelInformation(x: int, y: int, generator: random.Random) -> dict:
+    """
+    Returns a synthetic `/api/pos-info` response for the pixel at (x, y).
+    """
+    userID = generator.randint(1, 500)
+    return {
+        "pixel": {
+            "point": {"x": x, "y": y},
+            "modified": (_BASE_DATE + timedelta(seconds=generator.randint(0, 30 * 24 * 3600))).isoformat(),
+            "colour": f"#{generator.randint(0, 0xFFFFFF):06X}",
+            "editorID": f"user-{userID}",
+            "user": fakeUser(userID),
+        }
+    }
+
+def createApp(config: FakeUpstreamConfig) -> web.Application:
+    """
+    Creates the aiohttp application of the fake upstream; statistics are available as `app["statistics"]`.
+    With a `changeRate` the board is served too (as `app["board"]`), otherwise pos-info answers with random pixels.
+    """
+    statistics = FakeUpstreamStatistics()
+    board = FakeBoard(config.size, config.changeRate, config.random) if config.changeRate > 0 else None
+
+    async def boardImage(request: web.Request) -> web.Response:
+        statistics.boardRequests += 1
+        if config.random.random() < config.boardThrottleRate:
+            statistics.boardThrottled += 1
+            return web.Response(status=503, text="Service Unavailable")
+        statistics.changes += board.advance()
+        etag = f'"{board.version}"'
+        if config.conditional and request.headers.get("If-None-Match") == etag:
+            statistics.boardNotModified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=board.image(), content_type="image/png", headers={"ETag": etag} if config.conditional else None)
+
+    async def posInfo(request: web.Request) -> web.Response:
+        statistics.requests += 1
+        if statistics.inFlight >= config.maxConcurrent or config.random.random() < config.throttleRate:
+            statistics.throttled += 1
+            return web.Response(status=503, text="Service Unavailable")
+        statistics.inFlight += 1
+        statistics.peakInFlight = max(statistics.peakInFlight, statistics.inFlight)
+        try:
+            await asyncio.sleep(config.latency)
+            x, y = int(request.query["x"]), int(request.query["y"])
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="Bad Request")
+        finally:
+            statistics.inFlight -= 1
+        statistics.served += 1
+        if board is not None:
+            return web.json_response(board.pixelInformation(x, y) or {"pixel": None})
+        return web.json_response(fakePixelInformation(x, y, config.random))
+
+    app = web.Application()
+    app["statistics"] = statistics
+    app["board"] = board
+    app.router.add_get("/api/pos-info", posInfo)
+    if board is not None:
+        app.router.add_get("/api/board-image", boardImage)
+    return app
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrent", type=int, default=64)
+    parser.add_argument("--size", type=int, default=500)
+    parser.add_argument("--change-rate", type=float, default=20, help="pixels repainted per second; 0 serves random pos-info without a board")
+    parser.add_argument("--board-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--no-conditional", action="store_true", help="serve the board without an ETag, so clients can only compare its bytes")
+    args = parser.parse_args()
+    web.run_app(createApp(FakeUpstreamConfig(args.latency, args.throttle_rate, args.max_concurrent, size=args.size, changeRate=args.change_rate, boardThrottleRate=args.board_throttle_rate, conditional=not args.no_conditional)), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
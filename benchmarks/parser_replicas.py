@@ -0,0 +1,137 @@
+"""
+Runs several replicas of `parsePixels/run.py` sharing the canvas through tile leases, against the fake upstream and a throwaway
+local MongoDB (e.g. `docker run --rm -p 27017:27017 mongo:5`); every collection of the parser in it is dropped.
+
+Every replica gets its own `REPLICA_ID` and the same `TILE_SIZE`. With `--kill-after` the first replica is killed (SIGKILL, so its
+leases are not released) that many seconds in, and the others have to take its tiles over once its leases expire.
+At the end the script reports the tiles each replica held, the pos-info requests served against the pixels stored,
+and how many of the latest placements upstream are in pixels-info; it exits with status 1 if the coverage is below `--min-coverage`.
+
+Usage: python3 benchmarks/parser_replicas.py --mongodb-uri mongodb://127.0.0.1:27017 [--replicas 3] [--tile-size 100] [--duration 90] [--kill-after 30]
+"""
+from aiohttp import web
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlparse
+import argparse
+import asyncio
+import pymongo
+import sys
+
+from end_to_end import _DATABASE_NAME, _LOCAL_HOSTS, _PARSER_COLLECTIONS, _ROOT, startService, stopService
+from fake_upstream import FakeUpstreamConfig, createApp
+
+_LEASES_COLLECTION = "parser-leases"
+
+def leaseOwners(database: pymongo.database.Database) -> Counter:
+    """
+    Returns the amount of tiles every live replica holds.
+    """
+    now = datetime.utcnow()
+    return Counter(lease["owner"] for lease in database[_LEASES_COLLECTION].find({"kind": "tile", "owner": {"$ne": None}, "expiresAt": {"$gt": now}}, {"owner": 1}))
+
+def latestPlacementsCoverage(database: pymongo.database.Database, placements: dict, until: datetime) -> tuple[int, int]:
+    """
+    Returns how many of the latest placements upstream made before `until` are in pixels-info, and how many there are.
+    """
+    expected = {(x, y, placedAt) for (x, y), (placedAt, _, _) in placements.items() if placedAt <= until}
+    stored = {(pixel["point"]["x"], pixel["point"]["y"], pixel["modified"]) for pixel in database["pixels-info"].find({}, {"point": 1, "modified": 1})}
+    return len(expected & stored), len(expected)
+
+async def run(args: argparse.Namespace) -> dict:
+    """
+    Runs the replicas against the fake upstream for `--duration` seconds and returns what they stored.
+    """
+    database = pymongo.MongoClient(args.mongodb_uri)[_DATABASE_NAME]
+    for name in _PARSER_COLLECTIONS + [_LEASES_COLLECTION]:
+        database.drop_collection(name)
+    app = createApp(FakeUpstreamConfig(latency=args.latency, throttleRate=args.throttle_rate, maxConcurrent=args.max_concurrent, size=args.size, changeRate=args.change_rate))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    endpointURL = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    environment = {
+        "MONGODB_URI": args.mongodb_uri,
+        "PLACE_ENDPOINT_URL": endpointURL,
+        "TILE_SIZE": str(args.tile_size),
+        "LEASE_SECONDS": str(args.lease_seconds),
+        "LEASE_HEARTBEAT_INTERVAL": str(args.heartbeat_interval),
+    }
+    replicas = [
+        startService(["run.py"], _ROOT / "parsePixels", {**environment, "REPLICA_ID": f"replica-{index}"}, args.log_folder / f"replica-{index}.log" if args.log_folder is not None else None)
+        for index in range(args.replicas)
+    ]
+    owners = {}
+    try:
+        if args.kill_after is not None and args.kill_after < args.duration:
+            await asyncio.sleep(args.kill_after)
+            print(f"tiles held before the kill: {dict(sorted(leaseOwners(database).items()))}")
+            replicas[0].kill()
+            replicas[0].wait()
+            print(f"killed replica-0 after {args.kill_after:.0f} s")
+            await asyncio.sleep(args.duration - args.kill_after)
+        else:
+            await asyncio.sleep(args.duration)
+        owners = dict(sorted(leaseOwners(database).items()))
+        # Placements made after this may still be waiting for their board tick when the replicas stop.
+        settledUntil = datetime.utcnow() - timedelta(seconds=args.settle)
+        await asyncio.sleep(args.settle)
+    finally:
+        for replica in replicas:
+            if replica.poll() is None:
+                stopService(replica)
+        await runner.cleanup()
+    statistics = app["statistics"]
+    covered, expected = latestPlacementsCoverage(database, app["board"].placements, settledUntil)
+    tiles = -(-args.size // args.tile_size) ** 2
+    results = {
+        "changes": statistics.changes,
+        "pos_info_served": statistics.served,
+        "stored": database["pixels-info"].count_documents({}),
+        "tiles": tiles,
+        "tiles_held": owners,
+        "covered": covered,
+        "expected": expected,
+        "coverage": covered / expected if expected else 1.0,
+    }
+    print(f"{args.replicas} replicas, {tiles} tiles of {args.tile_size}x{args.tile_size}, {args.duration:.0f} s, board of {args.size}x{args.size} repainted at {args.change_rate} pixels/s")
+    print(f"tiles held at the end: {owners}")
+    print(f"{'changes':>8} {'pos-info':>9} {'stored':>8} {'covered':>8} {'expected':>9} {'coverage':>9}")
+    print(f"{results['changes']:>8} {results['pos_info_served']:>9} {results['stored']:>8} {covered:>8} {expected:>9} {results['coverage']:>9.1%}")
+    return results
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-uri", required=True, help="a throwaway local MongoDB, its collections are dropped")
+    parser.add_argument("--allow-remote", action="store_true", help="allow a MongoDB which is not on this machine")
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--tile-size", type=int, default=100)
+    parser.add_argument("--lease-seconds", type=float, default=15)
+    parser.add_argument("--heartbeat-interval", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=90, help="seconds the replicas run for")
+    parser.add_argument("--kill-after", type=float, default=None, help="seconds after which the first replica is killed")
+    parser.add_argument("--settle", type=float, default=15, help="seconds the replicas keep running to catch up before they are stopped")
+    parser.add_argument("--size", type=int, default=500)
+    parser.add_argument("--change-rate", type=float, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrent", type=int, default=64)
+    parser.add_argument("--min-coverage", type=float, default=0.99)
+    parser.add_argument("--log-folder", type=Path, default=None, help="folder to write the log of every replica to")
+    args = parser.parse_args()
+    if urlparse(args.mongodb_uri).hostname not in _LOCAL_HOSTS and not args.allow_remote:
+        parser.error("the script drops collections, so it only runs against a local MongoDB unless --allow-remote is given")
+    if args.log_folder is not None:
+        args.log_folder.mkdir(parents=True, exist_ok=True)
+    results = asyncio.run(run(args))
+    if results["coverage"] < args.min_coverage:
+        print(f"COVERAGE {results['coverage']:.1%} below {args.min_coverage:.1%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
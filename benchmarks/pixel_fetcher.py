@@ -0,0 +1,67 @@
+"""
+Benchmark of the asynchronous pos-info fetcher of the pixels parser against the local fake upstream.
+Reports pixels per second for several in-flight window sizes.
+
+Usage: python3 benchmarks/pixel_fetcher.py [--windows 1 2 4 8 16 32] [--pixels 500] [--latency 0.05] [--max-concurrent 64]
+"""
+from aiohttp import web
+from pathlib import Path
+import argparse
+import asyncio
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "parsePixels"))
+
+from fake_upstream import FakeUpstreamConfig, createApp
+from fetcher import AdaptiveWindow, PixelInfoFetcher
+
+async def runWindow(endpointURL: str, windowSize: int, pixels: int) -> tuple[float, int]:
+    """
+    Fetches `pixels` coordinates with a window capped at `windowSize` and returns the throughput and the amount of failures.
+    """
+    failures = 0
+
+    async def onResult(x: int, y: int, response) -> None:
+        nonlocal failures
+        failures += response is None
+
+    window = AdaptiveWindow(minimum=1, maximum=windowSize, initial=windowSize)
+    async with PixelInfoFetcher(endpointURL, {}, window) as fetcher:
+        start = time.perf_counter()
+        await fetcher.fetchMany(((i % 1000, i // 1000) for i in range(pixels)), onResult)
+        return pixels / (time.perf_counter() - start), failures
+
+async def benchmark(args: argparse.Namespace) -> None:
+    """
+    Starts the fake upstream on a random local port and runs every window size against it.
+    """
+    app = createApp(FakeUpstreamConfig(latency=args.latency, throttleRate=args.throttle_rate, maxConcurrent=args.max_concurrent))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    endpointURL = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    print(f"{'window':>8} {'pixels/s':>10} {'failures':>9} {'throttled':>10}")
+    try:
+        for windowSize in args.windows:
+            throttledBefore = app["statistics"].throttled
+            pixelsPerSecond, failures = await runWindow(endpointURL, windowSize, args.pixels)
+            print(f"{windowSize:>8} {pixelsPerSecond:>10.1f} {failures:>9} {app['statistics'].throttled - throttledBefore:>10}")
+    finally:
+        await runner.cleanup()
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--pixels", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrent", type=int, default=64)
+    asyncio.run(benchmark(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark of the read path of the API: CPU time to turn pixels-info documents into a response body.
+Compares building the pydantic models and encoding them the way FastAPI does for a `response_model`
+with encoding the projected documents straight away with orjson, as the API does now.
+
+Usage: python3 benchmarks/read_serialization.py [--pixels 10000] [--repeat 5]
+"""
+from fastapi.encoders import jsonable_encoder
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "shared"))
+os.environ.setdefault("MONGODB_URI", "mongodb://127.0.0.1:27017")
+
+from app import ActionTypes, BaseResponseModel, PixelInformationModel, encode_response
+from dataset import generatePixels
+
+def modelsPath(documents: list[dict]) -> bytes:
+    """
+    The read path before the fast encoder: models for every document, the response model, then FastAPI's encoder and `json.dumps`.
+    """
+    pixels = [PixelInformationModel(**document) for document in documents]
+    response = BaseResponseModel(action=ActionTypes.GET_CERTAIN_PIXEL, result={"pixels": pixels}, error=None)
+    return json.dumps(jsonable_encoder(response)).encode()
+
+def fastPath(documents: list[dict]) -> bytes:
+    """
+    The current read path: the projected documents encoded with orjson.
+    """
+    return encode_response(ActionTypes.GET_CERTAIN_PIXEL, {"pixels": documents})
+
+def measure(function, documents: list[dict], repeat: int) -> float:
+    """
+    Returns the best CPU time of `repeat` runs of the function, in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        function(documents)
+        best = min(best, time.process_time() - start)
+    return best
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pixels", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    documents = list(generatePixels(args.pixels))
+    assert json.loads(modelsPath(documents[:100])) == json.loads(fastPath(documents[:100])), "the two paths must produce the same response"
+    modelsTime, fastTime = measure(modelsPath, documents, args.repeat), measure(fastPath, documents, args.repeat)
+    scale = 10000 / args.pixels
+    print(f"{args.pixels} pixels, best of {args.repeat} runs")
+    print(f"{'path':<10} {'CPU ms / 10k pixels':>20} {'body (MiB)':>11}")
+    print(f"{'models':<10} {modelsTime * scale * 1000:>20.1f} {len(modelsPath(documents)) / 2 ** 20:>11.2f}")
+    print(f"{'orjson':<10} {fastTime * scale * 1000:>20.1f} {len(fastPath(documents)) / 2 ** 20:>11.2f}")
+    print(f"saved {(modelsTime - fastTime) * scale * 1000:.1f} CPU ms per 10k pixels ({modelsTime / fastTime:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Delta-encoded canvas archive.
+
+An archive is a folder with two append-only files:
+- `frames.dat` holds one zlib-compressed record per frame, either a keyframe (the raw frame array)
+  or a sparse diff against the previous frame (uint32 flat pixel indices followed by the new pixel values);
+- `frames.idx` holds one fixed-size entry per frame (timestamp, record offset and length, frame shape and record kind),
+  so any frame can be located without reading the data file;
+- `palette.json` holds the colours of the `Palette` the single-channel frames index into, written before any frame using a new colour.
+Every `keyframeInterval` frames (and whenever the board is resized) a keyframe is written, which bounds the amount of diffs to replay.
+"""
+from palette import Palette
+from pathlib import Path
+from PIL import Image
+from typing import Optional
+import bisect
+import json
+import mmap
+import numpy
+import os
+import zlib
+
+KIND_KEYFRAME = 0
+KIND_DIFF = 1
+
+_DATA_FILE_NAME = "frames.dat"
+_INDEX_FILE_NAME = "frames.idx"
+_PALETTE_FILE_NAME = "palette.json"
+_INDEX_DTYPE = numpy.dtype([
+    ("timestamp", "<i8"),
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("width", "<u2"),
+    ("height", "<u2"),
+    ("channels", "u1"),
+    ("kind", "u1"),
+    ("reserved", "V2"),
+])
+
+def encodeDiff(previous: numpy.ndarray, current: numpy.ndarray) -> bytes:
+    """
+    Encodes the pixels of `current` which differ from `previous` as flat indices followed by their new values.
+    """
+    channels = current.shape[2] if current.ndim == 3 else 1
+    previousPixels, currentPixels = previous.reshape(-1, channels), current.reshape(-1, channels)
+    changed = numpy.flatnonzero(numpy.any(previousPixels != currentPixels, axis=1))
+    return changed.astype("<u4").tobytes() + currentPixels[changed].tobytes()
+
+def applyDiff(frame: numpy.ndarray, payload: bytes) -> None:
+    """
+    Applies an encoded diff to the frame in place.
+    """
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    count = len(payload) // (4 + channels)
+    indices = numpy.frombuffer(payload, dtype="<u4", count=count)
+    values = numpy.frombuffer(payload, dtype=numpy.uint8, offset=count * 4).reshape(count, channels)
+    frame.reshape(-1, channels)[indices] = values
+
+class CanvasArchiveReader:
+    """
+    Indexed reader of a canvas archive, rebuilding any frame from the nearest preceding keyframe.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._dataFile = open(self.path / _DATA_FILE_NAME, "rb")
+        dataSize = os.fstat(self._dataFile.fileno()).st_size
+        self._data = mmap.mmap(self._dataFile.fileno(), 0, access=mmap.ACCESS_READ) if dataSize > 0 else b""
+        indexBytes = (self.path / _INDEX_FILE_NAME).read_bytes()
+        index = numpy.frombuffer(indexBytes, dtype=_INDEX_DTYPE, count=len(indexBytes) // _INDEX_DTYPE.itemsize)
+        self.index = index[index["offset"] + index["length"] <= dataSize]
+        positions = numpy.arange(len(self.index))
+        self._keyframeOf = numpy.maximum.accumulate(numpy.where(self.index["kind"] == KIND_KEYFRAME, positions, 0)) if len(self.index) else positions
+        self.timestamps = self.index["timestamp"].tolist()
+        palettePath = self.path / _PALETTE_FILE_NAME
+        self.palette = Palette.fromList(json.loads(palettePath.read_text())) if palettePath.exists() else None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        """
+        Closes the data file.
+        """
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._dataFile.close()
+
+    def __enter__(self) -> "CanvasArchiveReader":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _payload(self, position: int) -> bytes:
+        entry = self.index[position]
+        return zlib.decompress(self._data[int(entry["offset"]):int(entry["offset"]) + int(entry["length"])])
+
+    def frame(self, position: int) -> numpy.ndarray:
+        """
+        Rebuilds the frame at the given position of the archive.
+        """
+        if position < 0:
+            position += len(self.index)
+        keyframePosition = int(self._keyframeOf[position])
+        entry = self.index[keyframePosition]
+        shape = (int(entry["height"]), int(entry["width"]), int(entry["channels"]))
+        frame = numpy.frombuffer(self._payload(keyframePosition), dtype=numpy.uint8).reshape(shape).copy()
+        for diffPosition in range(keyframePosition + 1, position + 1):
+            applyDiff(frame, self._payload(diffPosition))
+        return frame
+
+    def frameAt(self, timestamp: int) -> Optional[numpy.ndarray]:
+        """
+        Rebuilds the latest frame captured at or before the timestamp, or returns None if the archive starts later.
+        """
+        position = bisect.bisect_right(self.timestamps, timestamp) - 1
+        if position < 0:
+            return None
+        return self.frame(position)
+
+    def frameRGBA(self, position: int) -> numpy.ndarray:
+        """
+        Rebuilds the frame at the given position of the archive as a (height, width, 4) RGBA array, expanding palette indices.
+        """
+        frame = self.frame(position)
+        if frame.shape[2] == 1 and self.palette is not None:
+            return self.palette.toRGBA(frame[:, :, 0])
+        return frame
+
+class CanvasArchiveWriter:
+    """
+    Appends frames to a canvas archive, writing a keyframe every `keyframeInterval` frames and sparse diffs in between.
+    Images are stored as indices into the palette of the archive, which is restored when an existing archive is reopened.
+    """
+    def __init__(self, path: Path, keyframeInterval: int = 240, compressionLevel: int = 6) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.keyframeInterval = keyframeInterval
+        self.compressionLevel = compressionLevel
+        self._previous: Optional[numpy.ndarray] = None
+        self._framesSinceKeyframe = 0
+        palettePath = self.path / _PALETTE_FILE_NAME
+        self.palette = Palette.fromList(json.loads(palettePath.read_text())) if palettePath.exists() else Palette()
+        self._savedColours = len(self.palette)
+        if (self.path / _INDEX_FILE_NAME).exists() and (self.path / _DATA_FILE_NAME).exists():
+            with CanvasArchiveReader(self.path) as reader:
+                if len(reader):
+                    self._previous = reader.frame(-1)
+                    self._framesSinceKeyframe = len(reader) - 1 - int(reader._keyframeOf[-1])
+                self._truncateTo(reader)
+        self._dataFile = open(self.path / _DATA_FILE_NAME, "ab")
+        self._indexFile = open(self.path / _INDEX_FILE_NAME, "ab")
+
+    def _truncateTo(self, reader: CanvasArchiveReader) -> None:
+        """
+        Drops whatever a crash left behind after the last complete frame.
+        """
+        dataSize = int(reader.index[-1]["offset"] + reader.index[-1]["length"]) if len(reader) else 0
+        os.truncate(self.path / _DATA_FILE_NAME, dataSize)
+        os.truncate(self.path / _INDEX_FILE_NAME, len(reader) * _INDEX_DTYPE.itemsize)
+
+    def append(self, timestamp: int, frame: numpy.ndarray) -> int:
+        """
+        Appends the frame captured at the timestamp and returns the size of the written record in bytes.
+        """
+        frame = numpy.ascontiguousarray(frame, dtype=numpy.uint8)
+        if frame.ndim == 2:
+            frame = frame[:, :, None]
+        isKeyframe = self._previous is None or self._previous.shape != frame.shape or self._framesSinceKeyframe + 1 >= self.keyframeInterval
+        payload = frame.tobytes() if isKeyframe else encodeDiff(self._previous, frame)
+        record = zlib.compress(payload, self.compressionLevel)
+        entry = numpy.zeros(1, dtype=_INDEX_DTYPE)
+        entry["timestamp"] = timestamp
+        entry["offset"] = self._dataFile.tell()
+        entry["length"] = len(record)
+        entry["height"], entry["width"], entry["channels"] = frame.shape
+        entry["kind"] = KIND_KEYFRAME if isKeyframe else KIND_DIFF
+        self._dataFile.write(record)
+        self._dataFile.flush()
+        self._indexFile.write(entry.tobytes())
+        self._indexFile.flush()
+        self._previous = frame
+        self._framesSinceKeyframe = 0 if isKeyframe else self._framesSinceKeyframe + 1
+        return len(record)
+
+    def appendImage(self, timestamp: int, image: Image.Image) -> int:
+        """
+        Appends the image captured at the timestamp as a frame of palette indices and returns the size of the written record in bytes.
+        """
+        frame = self.palette.indexImage(image)
+        if len(self.palette) != self._savedColours:
+            self._savePalette()
+        return self.append(timestamp, frame)
+
+    def _savePalette(self) -> None:
+        """
+        Atomically replaces the palette file; the palette only grows, so frames written before stay valid.
+        """
+        palettePath = self.path / _PALETTE_FILE_NAME
+        temporaryPath = palettePath.with_name(f".{palettePath.name}.{os.getpid()}.tmp")
+        with open(temporaryPath, "w") as file:
+            json.dump(self.palette.toList(), file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporaryPath, palettePath)
+        self._savedColours = len(self.palette)
+
+    def close(self) -> None:
+        """
+        Closes the archive files.
+        """
+        self._dataFile.close()
+        self._indexFile.close()
@@ -1,89 +1,184 @@
 from io import BytesIO
 from typing import Optional
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 import requests
 import time
-import threading
 from PIL import Image
 from pathlib import Path
+from math import floor, gcd
+from functools import reduce
 import logging
+import os
+from archive import CanvasArchiveWriter
+from boardfetch import BoardFetcher, BoardFrame
 
-_ENDPOINT_URL = "https://place.geoxor.moe/api/board-image"
+_ENDPOINT_URL = os.environ.get("PLACE_BOARD_IMAGE_URL", "https://place.geoxor.moe/api/board-image")
 _BASE_PATH_OUTPUT_FOLDER_1M = "board-images-60s/"
 _BASE_PATH_OUTPUT_FOLDER_15S = "board-images-15s/"
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
+def parseCaptureIntervals(value: str) -> dict[int, Path]:
+    """
+    Parses the `CAPTURE_INTERVALS` setting, a comma-separated list of `seconds:folder` pairs, into a mapping of interval to output folder.
+    """
+    intervals = {}
+    for pair in value.split(","):
+        seconds, folder = pair.strip().split(":", 1)
+        intervals[int(seconds)] = Path(folder)
+    return intervals
+
+_CAPTURE_INTERVALS = parseCaptureIntervals(os.environ.get("CAPTURE_INTERVALS", f"15:{_BASE_PATH_OUTPUT_FOLDER_15S},60:{_BASE_PATH_OUTPUT_FOLDER_1M}"))
+
+_OPTIMIZE_SNAPSHOTS = os.environ.get("OPTIMIZE_SNAPSHOTS", "0") == "1"
+_WRITER_THREADS = int(os.environ.get("WRITER_THREADS", 4))
+_OPTIMIZER_PROCESSES = int(os.environ.get("OPTIMIZER_PROCESSES", 1))
+_ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH", "")
+_ARCHIVE_KEYFRAME_INTERVAL = int(os.environ.get("ARCHIVE_KEYFRAME_INTERVAL", 240))
+_SAVE_UNCHANGED_SNAPSHOTS = os.environ.get("SAVE_UNCHANGED_SNAPSHOTS", "0") == "1"
+
+# A single scheduler fetches the board for every interval, so a stalled connection gives up within a tick instead of stopping all of them.
+_DOWNLOAD_TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", reduce(gcd, _CAPTURE_INTERVALS)))
+
+_SESSION = requests.Session()
+_BOARD_FETCHER = BoardFetcher(_ENDPOINT_URL, session=_SESSION, timeout=_DOWNLOAD_TIMEOUT)
+_WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=_WRITER_THREADS, thread_name_prefix="snapshot-writer")
+_OPTIMIZE_EXECUTOR = ProcessPoolExecutor(max_workers=_OPTIMIZER_PROCESSES) if _OPTIMIZE_SNAPSHOTS else None
+_ARCHIVE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-writer")
+_ARCHIVE_WRITER: Optional[CanvasArchiveWriter] = None
+
 def createFolders() -> None:
     """
     Creates the folders for the images.
     """
     logging.info("Creating folders...")
-    Path(_BASE_PATH_OUTPUT_FOLDER_15S).mkdir(parents=True, exist_ok=True)
-    Path(_BASE_PATH_OUTPUT_FOLDER_1M).mkdir(parents=True, exist_ok=True)
+    for folder in _CAPTURE_INTERVALS.values():
+        folder.mkdir(parents=True, exist_ok=True)
+
+def downloadImage() -> Optional[BoardFrame]:
+    """
+    Downloads the image from the API endpoint with a conditional request; the returned frame tells whether the board changed since the previous download.
+    """
+    return _BOARD_FETCHER.fetch()
 
-def downloadImage() -> Optional[BytesIO]:
+def writeFileAtomically(data: bytes, path: Path) -> None:
     """
-    Downloads the image from the API endpoint and returns it as a BytesIO object.
+    Writes the data to a temporary file next to the path and renames it into place, so readers never see a partial file.
     """
-    response = requests.get(_ENDPOINT_URL)
-    logging.debug(f"Got repspone from the API with status code {response.status_code} in {round(response.elapsed.total_seconds(), 4)} seconds.")
-    if response.status_code != 200:
-        return None
-    return BytesIO(response.content)
+    temporaryPath = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temporaryPath, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporaryPath, path)
+    except BaseException:
+        temporaryPath.unlink(missing_ok=True)
+        raise
 
-def saveImage(image: BytesIO, path: Path) -> None:
+def optimizeImage(path: Path) -> None:
     """
-    Saves the image to the given path.
+    Recompresses the saved image with the optimizing PNG encoder and atomically replaces it; runs in the optimizer process pool.
+    """
+    startImageOptimize = time.time()
+    output = BytesIO()
+    with Image.open(path) as image:
+        image.save(output, format="PNG", optimize=True)
+    if output.tell() < path.stat().st_size:
+        writeFileAtomically(output.getvalue(), path)
+    logging.debug(f"Image {path} optimized in {round(time.time() - startImageOptimize, 4)} seconds.")
+
+def saveImage(image: bytes, path: Path) -> None:
+    """
+    Saves the original bytes of the image to the given path and queues the optional recompression.
     """
     logging.debug(f"Saving image to {path}...")
     startImageSave = time.time()
-    image.seek(0)
-    image = Image.open(image)
-    image.save(path, format="PNG", quality=100, optimize=True)
+    writeFileAtomically(image, path)
     logging.debug(f"Image saved to {path} in {round(time.time() - startImageSave, 4)} seconds.")
+    if _OPTIMIZE_EXECUTOR is not None:
+        _OPTIMIZE_EXECUTOR.submit(optimizeImage, path).add_done_callback(lambda future: logBackgroundFailure(future, f"optimizing {path}"))
+
+def logBackgroundFailure(future: Future, action: str) -> None:
+    """
+    Logs the exception of a finished background task, if any.
+    """
+    if future.exception() is not None:
+        logging.error(f"An error occured while {action}: {future.exception()!r}")
+
+def archiveImage(image: bytes, timestamp: int) -> None:
+    """
+    Decodes the image and appends it to the delta-encoded archive as palette indices; runs on the single archive writer thread, so frames stay in order.
+    """
+    startImageArchive = time.time()
+    with Image.open(BytesIO(image)) as decodedImage:
+        recordSize = _ARCHIVE_WRITER.appendImage(timestamp, decodedImage)
+    logging.debug(f"Image archived as a {recordSize} bytes record in {round(time.time() - startImageArchive, 4)} seconds.")
 
-def getNewImagePath(basePath: Path) -> Path:
+def getNewImagePath(basePath: Path, timestamp: Optional[int] = None) -> Path:
     """
     Returns a new path for the image.
     """
-    return Path(basePath) / f"place_geoxor_moe-{int(time.time())}.png"
+    return Path(basePath) / f"place_geoxor_moe-{int(time.time()) if timestamp is None else timestamp}.png"
 
-def executeDownloader(path: Path) -> None:
+def executeDownloader(paths: list[Path], timestamp: Optional[int] = None) -> None:
     """
-    Downloads the image and saves it to the given path.
+    Downloads the image once and queues saving it to every given path, so the capture thread never waits for the disk.
+    A board identical to the previous one is not saved (unless `SAVE_UNCHANGED_SNAPSHOTS` is set) nor archived;
+    the timelapse builder fills the gaps this leaves in the snapshot folders.
     """
     logging.debug("Executing downloader...")
-    image = downloadImage()
-    if image is None:
+    board = downloadImage()
+    if board is None:
         logging.error("Could not download image.")
         return
-    saveImage(image, path)
-    logging.info(f"Image saved to {path}.")
+    if not board.changed:
+        logging.info(f"The board has not changed ({board.skipped}), skipped the tick; {_BOARD_FETCHER.skippedTotal} of {_BOARD_FETCHER.fetched} ticks skipped so far.")
+        if not _SAVE_UNCHANGED_SNAPSHOTS:
+            return
+    for path in paths:
+        _WRITE_EXECUTOR.submit(saveImage, board.content, path).add_done_callback(lambda future, path=path: logBackgroundFailure(future, f"saving {path}"))
+        logging.info(f"Image queued for saving to {path}.")
+    if _ARCHIVE_WRITER is not None and board.changed:
+        _ARCHIVE_EXECUTOR.submit(archiveImage, board.content, int(time.time()) if timestamp is None else timestamp).add_done_callback(lambda future: logBackgroundFailure(future, "archiving the image"))
 
-def scheduleDownloader(basePath: Path, timeInterval: float = 60) -> None:
+def scheduleDownloader(captureIntervals: dict[int, Path]) -> None:
     """
-    Schedules the downloader to run every minute.
+    Schedules a single downloader ticking at the greatest common divisor of the intervals.
+    Every tick fetches the board once and fans it out to the folders whose interval is due, so the longer intervals reuse the frames of the shorter ones.
     """
+    tickInterval = reduce(gcd, captureIntervals)
+    logging.info(f"Capturing every {tickInterval} seconds for intervals {sorted(captureIntervals)}.")
     startTime = time.time()
+    tickNumber = 0
+    skippedTicks = 0
     while True:
-        executeDownloader(getNewImagePath(basePath))
-        logging.debug(f"Waiting {round(timeInterval - ((time.time() - startTime) % timeInterval), 4)} seconds before next download...")
-        time.sleep(timeInterval - ((time.time() - startTime) % timeInterval))
+        timestamp = int(time.time())
+        dueFolders = [folder for interval, folder in captureIntervals.items() if tickNumber % (interval // tickInterval) == 0]
+        executeDownloader([getNewImagePath(folder, timestamp) for folder in dueFolders], timestamp)
+        # A download which overran its slot skips the ticks it overlapped, leaving a gap in the series of every interval due then.
+        nextTickNumber = floor((time.time() - startTime) / tickInterval) + 1
+        if nextTickNumber > tickNumber + 1:
+            missedTicks = range(tickNumber + 1, nextTickNumber)
+            skippedTicks += len(missedTicks)
+            missedIntervals = sorted(interval for interval in captureIntervals if any(missedTick % (interval // tickInterval) == 0 for missedTick in missedTicks))
+            logging.warning(f"The download overran its slot, skipped {len(missedTicks)} ticks ({skippedTicks} so far), missing a frame of the intervals {missedIntervals}.")
+        tickNumber = nextTickNumber
+        waitTime = max(0, startTime + tickNumber * tickInterval - time.time())
+        logging.debug(f"Waiting {round(waitTime, 4)} seconds before next download...")
+        time.sleep(waitTime)
 
 def main():
     """
     Main function.
     """
+    global _ARCHIVE_WRITER
     createFolders()
+    if _ARCHIVE_PATH:
+        _ARCHIVE_WRITER = CanvasArchiveWriter(Path(_ARCHIVE_PATH), keyframeInterval=_ARCHIVE_KEYFRAME_INTERVAL)
+        logging.info(f"Archiving every frame to {_ARCHIVE_PATH}.")
     logging.info("Starting downloader...")
-    t1 = threading.Thread(
-        target=scheduleDownloader,
-        args=(_BASE_PATH_OUTPUT_FOLDER_15S, 15,))
-    t1.start()
-    t2 = threading.Thread(
-        target=scheduleDownloader,
-        args=(_BASE_PATH_OUTPUT_FOLDER_1M, 60,))
-    t2.start()
+    scheduleDownloader(_CAPTURE_INTERVALS)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,179 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, Optional
+from PIL import Image
+import argparse
+import logging
+import os
+import re
+import requests
+import shutil
+import subprocess
+import time
+import zipfile
+
+_FRAME_NAME_PATTERN = re.compile(r"^place_geoxor_moe-(\d+)\.png$")
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+
+def listFrames(folder: Path) -> list[tuple[int, Path]]:
+    """
+    Returns the (timestamp, path) of every snapshot in the folder, in timestamp order.
+    Temporary files of in-progress writes are skipped.
+    """
+    frames = []
+    for entry in os.scandir(folder):
+        match = _FRAME_NAME_PATTERN.match(entry.name)
+        if match is not None and entry.is_file():
+            frames.append((int(match.group(1)), Path(entry.path)))
+    frames.sort()
+    return frames
+
+def chunked(iterable, size: int) -> Iterator[list]:
+    """
+    Yields consecutive lists of at most `size` items.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def frameRepeats(timestamps: list[int], interval: int, maxFill: int) -> list[int]:
+    """
+    Returns how many video frames every snapshot stands for, so the video keeps one frame per `interval` seconds
+    across the ticks the downloader skipped because the board had not changed.
+    Gaps longer than `maxFill` seconds are taken for downtime of the downloader and are not filled.
+    """
+    repeats = []
+    for current, following in zip(timestamps, timestamps[1:]):
+        gap = following - current
+        repeats.append(max(1, round(gap / interval)) if gap <= maxFill else 1)
+    return repeats + [1] if timestamps else []
+
+def repeatFrame(source: Path, destination: Path) -> None:
+    """
+    Makes the destination a copy of an already rendered frame, as a hard link where the filesystem allows it.
+    """
+    destination.unlink(missing_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def renderFrame(source: Path, destination: Path, scale: int) -> int:
+    """
+    Decodes the snapshot, upscales it with nearest-neighbour sampling and writes it as a video frame; runs in the process pool.
+    Returns the size of the written frame in bytes.
+    """
+    with Image.open(source) as image:
+        frame = image.convert("RGB")
+    if scale > 1:
+        frame = frame.resize((frame.width * scale, frame.height * scale), Image.NEAREST)
+    frame.save(destination, format="PNG", compress_level=1)
+    return destination.stat().st_size
+
+def buildTimelapse(source: Path, output: Path, name: str, scale: int = 1, chunkSize: int = 64, processes: Optional[int] = None, interval: Optional[int] = None, maxFill: int = 3600) -> tuple[Path, Path, int, int]:
+    """
+    Streams the snapshots of the source folder in timestamp order into a zip archive and a numbered frame sequence.
+    Only one chunk of frames is in flight at a time, so memory stays bounded however many snapshots there are.
+    With an `interval`, skipped ticks are filled by repeating the previous frame (see `frameRepeats`).
+    Returns the zip path, the frame sequence folder, the amount of frames and the timestamp of the last one.
+    """
+    frames = listFrames(source)
+    if not frames:
+        raise ValueError(f"No snapshots found in {source}.")
+    output.mkdir(parents=True, exist_ok=True)
+    zipPath = output / f"{name}-frames.zip"
+    sequenceFolder = output / f"{name}-frames"
+    sequenceFolder.mkdir(exist_ok=True)
+    repeats = frameRepeats([timestamp for timestamp, _ in frames], interval, maxFill) if interval else [1] * len(frames)
+    startTimeBuild = time.time()
+    with zipfile.ZipFile(zipPath, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive, ProcessPoolExecutor(max_workers=processes) as executor:
+        frameNumber = snapshotNumber = 0
+        for chunk in chunked(zip(frames, repeats), chunkSize):
+            firstNumbers = []
+            for _, count in chunk:
+                firstNumbers.append(frameNumber)
+                frameNumber += count
+            destinations = [sequenceFolder / f"frame-{number:06d}.png" for number in firstNumbers]
+            rendering = executor.map(renderFrame, [path for (_, path), _ in chunk], destinations, [scale] * len(chunk))
+            for (_, path), _ in chunk:
+                archive.write(path, arcname=path.name)
+            list(rendering)
+            for destination, number, (_, count) in zip(destinations, firstNumbers, chunk):
+                for repeat in range(1, count):
+                    repeatFrame(destination, sequenceFolder / f"frame-{number + repeat:06d}.png")
+            snapshotNumber += len(chunk)
+            logging.debug(f"Processed {snapshotNumber}/{len(frames)} snapshots into {frameNumber} frames in {round(time.time() - startTimeBuild, 4)} seconds.")
+    logging.info(f"Built {zipPath} and {sequenceFolder} from {len(frames)} snapshots ({frameNumber} frames) in {round(time.time() - startTimeBuild, 4)} seconds.")
+    return zipPath, sequenceFolder, frameNumber, frames[-1][0]
+
+def encodeVideos(sequenceFolder: Path, output: Path, name: str, framerate: int) -> dict[str, Path]:
+    """
+    Encodes the frame sequence into H.264 and H.265 videos with ffmpeg.
+    """
+    videos = {}
+    for codecName, codec in [("h264", "libx264"), ("h265", "libx265")]:
+        videoPath = output / f"{name}-{codecName}.mp4"
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-framerate", str(framerate),
+            "-i", str(sequenceFolder / "frame-%06d.png"),
+            "-c:v", codec, "-pix_fmt", "yuv420p",
+            str(videoPath),
+        ], check=True)
+        videos[codecName] = videoPath
+    return videos
+
+def registerTimelapse(apiURL: str, apiKey: str, timelapse: dict) -> None:
+    """
+    Registers the timelapse with the API, which validates it against `CanvasTimelapseObjectModel`.
+    """
+    response = requests.post(f"{apiURL}/timelapses", json=timelapse, headers={"Authorization": apiKey})
+    if response.status_code != 201:
+        raise RuntimeError(f"The API refused the timelapse with status code {response.status_code}: {response.text}")
+    logging.info(f"Registered timelapse {timelapse['name']} with the API.")
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description="Builds a timelapse from a folder of canvas snapshots and registers it with the API.")
+    parser.add_argument("--source", type=Path, required=True, help="folder of snapshots, e.g. board-images-15s/")
+    parser.add_argument("--interval", type=int, required=True, choices=[15, 60])
+    parser.add_argument("--output", type=Path, default=Path("timelapses/"))
+    parser.add_argument("--name", default=None)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--max-fill", type=int, default=3600, help="longest gap in seconds filled with the previous frame; longer ones are taken for downtime")
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--public-url", default="https://fs.geoxorplace.vapronva.pw/timelapses", help="public URL the output folder is served from")
+    parser.add_argument("--api-url", default=os.environ.get("API_URL", "http://api:8000"))
+    parser.add_argument("--no-register", action="store_true")
+    args = parser.parse_args()
+    name = args.name or f"place_geoxor_moe-{args.interval}s-{int(time.time())}"
+    zipPath, sequenceFolder, _, lastTimestamp = buildTimelapse(args.source, args.output, name, args.scale, args.chunk_size, args.processes, args.interval, args.max_fill)
+    if shutil.which("ffmpeg") is None:
+        # The API would advertise links to videos which do not exist, so the timelapse is only registered once they are encoded.
+        logging.warning(f"ffmpeg is not available, so the videos have to be encoded from {sequenceFolder} separately; the timelapse was not registered.")
+        return
+    encodeVideos(sequenceFolder, args.output, name, args.framerate)
+    if args.no_register:
+        return
+    registerTimelapse(args.api_url, os.environ["MASTER_KEY"], {
+        "name": name,
+        "date": datetime.fromtimestamp(lastTimestamp, tz=timezone.utc).replace(tzinfo=None).isoformat(),
+        "interval_time": args.interval,
+        "downloadURLs": {
+            "h264": f"{args.public_url}/{name}-h264.mp4",
+            "h265": f"{args.public_url}/{name}-h265.mp4",
+        },
+        "snapshotURL": {
+            "zip_png": f"{args.public_url}/{zipPath.name}",
+        },
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo.collection import Collection
+from pymongo import UpdateOne
+from typing import Optional
+import logging
+import pymongo
+import threading
+import time
+
+_DUPLICATE_KEY_ERROR_CODE = 11000
+
+def pixelKey(x: int, y: int) -> str:
+    """
+    Returns the `_id` of a pixel in the collections keyed by coordinate.
+    """
+    return f"{x}:{y}"
+
+def hourOf(moment: datetime) -> datetime:
+    """
+    Returns the start of the hour of the moment, the `_id` of its bucket in `stats-hourly`.
+    """
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def groupByKey(documents: list[dict], key) -> dict[object, list[dict]]:
+    """
+    Returns the documents grouped by `key(document)`.
+    """
+    groups = defaultdict(list)
+    for document in documents:
+        groups[key(document)].append(document)
+    return groups
+
+def newestByKey(documents: list[dict], key) -> dict:
+    """
+    Returns the newest (by `modified`) document for every value of `key(document)`.
+    """
+    newest = {}
+    for document in documents:
+        documentKey = key(document)
+        if documentKey not in newest or document["modified"] > newest[documentKey]["modified"]:
+            newest[documentKey] = document
+    return newest
+
+def bulkUpsertNewer(collection: Collection, operations: list[UpdateOne]) -> None:
+    """
+    Runs conditional upserts which only replace older documents.
+    When the stored document is newer the filter does not match and the upsert collides on `_id`; those collisions are expected and ignored.
+    """
+    if not operations:
+        return
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        unexpectedErrors = [writeError for writeError in e.details.get("writeErrors", []) if writeError["code"] != _DUPLICATE_KEY_ERROR_CODE]
+        if unexpectedErrors:
+            logging.error(f"{len(unexpectedErrors)} errors occured while updating {collection.name}: {unexpectedErrors[0]['errmsg']}")
+
+class RollupWatermarks:
+    """
+    Watermarks of the rollup rebuilds, from the `backfills` collection the API keeps (see `api/rollups.py`).
+    A rebuild counts the pixels with an `_id` below the watermark of its rollup, so the counters only count the ones above it;
+    a rollup without a watermark counts every pixel. The watermarks are read again at most every `refreshInterval` seconds.
+    """
+    def __init__(self, collection: Collection, refreshInterval: float = 1) -> None:
+        self.collection = collection
+        self.refreshInterval = refreshInterval
+        self._watermarks: dict[str, object] = {}
+        self._refreshedAt: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def counted(self, name: str, documents: list[dict]) -> list[dict]:
+        """
+        Returns the inserted documents the rollup `name` counts.
+        """
+        watermark = self._refresh().get(name)
+        if watermark is None:
+            return documents
+        return [document for document in documents if document["_id"] >= watermark]
+
+    def _refresh(self) -> dict[str, object]:
+        with self._lock:
+            if self._refreshedAt is None or time.monotonic() - self._refreshedAt >= self.refreshInterval:
+                try:
+                    self._watermarks = {rebuild["_id"]: rebuild["watermark"] for rebuild in self.collection.find({"watermark": {"$exists": True}}, {"watermark": 1})}
+                    self._refreshedAt = time.monotonic()
+                except pymongo.errors.PyMongoError as e:
+                    # The watermarks only change a minute before they are reached, so the previous ones are still right for a while.
+                    logging.error(f"An error occured while reading the rollup watermarks: {e}")
+            return self._watermarks
+
+class LatestPixelsUpdater:
+    """
+    Keeps the `pixels-latest` collection (one document per coordinate, keyed by `pixelKey`) in sync with the inserted pixels.
+    """
+    def __init__(self, collection: Collection) -> None:
+        self.collection = collection
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Upserts the latest state of every coordinate present in `documents`.
+        """
+        newest = newestByKey(documents, lambda document: pixelKey(document["point"]["x"], document["point"]["y"]))
+        bulkUpsertNewer(self.collection, [
+            UpdateOne(
+                {"_id": key, "modified": {"$lt": document["modified"]}},
+                {"$set": {field: value for field, value in document.items() if field != "_id"}},
+                upsert=True,
+            ) for key, document in newest.items()
+        ])
+
+class UsersUpdater:
+    """
+    Keeps the `users` collection (one document per user, keyed by the user's id) at the snapshot of each user's latest pixel.
+    """
+    def __init__(self, collection: Collection) -> None:
+        self.collection = collection
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Upserts the snapshot of every user present in `documents`.
+        """
+        newest = newestByKey([document for document in documents if document.get("user") is not None], lambda document: document["user"]["id"])
+        bulkUpsertNewer(self.collection, [
+            UpdateOne(
+                {"_id": userID, "modified": {"$lt": document["modified"]}},
+                {"$set": {"modified": document["modified"], "user": document["user"]}},
+                upsert=True,
+            ) for userID, document in newest.items()
+        ])
+
+class VersionBumper:
+    """
+    Bumps a counter of the `versions` collection after every flush, so the API can invalidate the responses built from the pixels.
+    With `olderThan`, only the flushes with a pixel placed longer ago than that bump it, so the responses about the settled history
+    are only invalidated by the pixels fetched late.
+    """
+    def __init__(self, collection: Collection, name: str, olderThan: Optional[timedelta] = None) -> None:
+        self.collection = collection
+        self.name = name
+        self.olderThan = olderThan
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Increments the counter once for the whole batch.
+        """
+        if self.olderThan is not None and min(document["modified"] for document in documents) > datetime.utcnow() - self.olderThan:
+            return
+        self.collection.update_one({"_id": self.name}, {"$inc": {"version": 1}}, upsert=True)
+
+class CanvasCheckpointInvalidator:
+    """
+    Marks stale the `canvas-checkpoints` the API keeps which were taken at or after the moment an inserted pixel was placed:
+    a pixel fetched late (from the backlog, or caught up on a tile taken over) is missing from them, so the API stops reading them and rebuilds them.
+    It must only receive pixels inserted for the first time, as the checkpoints already have the duplicates.
+    """
+    def __init__(self, collection: Collection) -> None:
+        self.collection = collection
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Marks the checkpoints from the oldest pixel of the batch on; usually none is that recent.
+        """
+        self.collection.update_many({"_id": {"$gte": min(document["modified"] for document in documents)}, "stale": {"$ne": True}}, {"$set": {"stale": True}})
+
+class UserStatsUpdater:
+    """
+    Keeps the `stats-users` rollup (placements, first and last placement and latest username per editor) counting the inserted pixels.
+    It must only receive pixels inserted for the first time, as a pixel counted twice stays counted twice.
+    """
+    def __init__(self, collection: Collection) -> None:
+        self.collection = collection
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Adds the pixels to the counters of their editors.
+        """
+        operations = []
+        for editorID, placed in groupByKey(documents, lambda document: document["editorID"]).items():
+            newest = max(placed, key=lambda document: document["modified"])
+            update = {
+                "$inc": {"placements": len(placed)},
+                "$min": {"firstPlaced": min(document["modified"] for document in placed)},
+                "$max": {"lastPlaced": newest["modified"]},
+            }
+            if newest.get("user") is not None:
+                update["$set"] = {"username": newest["user"]["username"]}
+            operations.append(UpdateOne({"_id": editorID}, update, upsert=True))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+class HourlyStatsUpdater:
+    """
+    Keeps the `stats-hourly` rollup (placements and distinct editors per hour of `modified`) counting the inserted pixels.
+    It must only receive pixels inserted for the first time, as a pixel counted twice stays counted twice.
+    """
+    def __init__(self, collection: Collection) -> None:
+        self.collection = collection
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Adds the pixels to the buckets of their hours.
+        """
+        operations = [
+            UpdateOne(
+                {"_id": hour},
+                {"$inc": {"placements": len(placed)}, "$addToSet": {"editors": {"$each": sorted({document["editorID"] for document in placed})}}},
+                upsert=True,
+            ) for hour, placed in groupByKey(documents, lambda document: hourOf(document["modified"])).items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+class PixelStatsUpdater:
+    """
+    Keeps the `stats-pixels` rollup (edits and last edit per coordinate, keyed by `pixelKey`) counting the inserted pixels.
+    It must only receive pixels inserted for the first time, as a pixel counted twice stays counted twice.
+    """
+    def __init__(self, collection: Collection) -> None:
+        self.collection = collection
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Adds the pixels to the counters of their coordinates.
+        """
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$inc": {"edits": len(placed)},
+                    "$max": {"lastModified": max(document["modified"] for document in placed)},
+                    "$setOnInsert": {"point": placed[0]["point"]},
+                },
+                upsert=True,
+            ) for key, placed in groupByKey(documents, lambda document: pixelKey(document["point"]["x"], document["point"]["y"])).items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+class HeatmapUpdater:
+    """
+    Keeps the `heatmap-hourly` rollup (one document per hour of `modified`, with the edits of every pixel edited in it under `counts.<pixelKey>`)
+    counting the inserted pixels; the API sums these into the heatmap of any window.
+    It must only receive pixels inserted for the first time, as a pixel counted twice stays counted twice.
+    The cumulative `heatmap-checkpoints` the API keeps of the rollup are marked stale when a pixel lands in an hour they already count,
+    so the API stops reading them and rebuilds them; every update also increments the `version` of the hour, for the checkpoints being written meanwhile.
+    """
+    def __init__(self, collection: Collection, checkpoints: Optional[Collection] = None) -> None:
+        self.collection = collection
+        self.checkpoints = checkpoints
+
+    def update(self, documents: list[dict]) -> None:
+        """
+        Adds the pixels to the counts of their hours.
+        """
+        operations = []
+        hours = groupByKey(documents, lambda document: hourOf(document["modified"]))
+        for hour, placed in hours.items():
+            counts = defaultdict(int)
+            for document in placed:
+                counts[pixelKey(document["point"]["x"], document["point"]["y"])] += 1
+            operations.append(UpdateOne({"_id": hour}, {"$inc": {**{f"counts.{key}": count for key, count in counts.items()}, "version": 1}}, upsert=True))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            if self.checkpoints is not None:
+                # A checkpoint counts the hours before its `_id`; usually none is newer than the hours of the batch.
+                self.checkpoints.update_many({"_id": {"$gt": min(hours)}, "stale": {"$ne": True}}, {"$set": {"stale": True}})
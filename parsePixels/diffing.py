@@ -0,0 +1,22 @@
+from PIL import Image
+from typing import List
+import numpy
+
+def imageToArray(image: Image.Image) -> numpy.ndarray:
+    """
+    Converts the board image into a (height, width, 4) uint8 array, so every frame is compared in the same mode.
+    """
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return numpy.asarray(image, dtype=numpy.uint8)
+
+def findChangedPixels(previous: numpy.ndarray, current: numpy.ndarray) -> List[tuple[int, int]]:
+    """
+    Returns the (x, y) coordinates of every pixel that differs between the two frames, ordered by x and then y.
+    If the board was resized, every pixel of the current frame is reported as changed.
+    """
+    if previous.shape != current.shape:
+        changedMask = numpy.ones(current.shape[:2], dtype=bool)
+    else:
+        changedMask = numpy.any(previous != current, axis=-1) if current.ndim == 3 else previous != current
+    return [tuple(coordinates) for coordinates in numpy.argwhere(changedMask.T).tolist()]
@@ -0,0 +1,176 @@
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterable, Optional
+import aiohttp
+import asyncio
+import logging
+import random
+import time
+import metrics
+
+if TYPE_CHECKING:
+    from workqueue import PixelWorkQueue
+
+_THROTTLE_DELAYS = {
+    503: 0.5,
+    400: 1,
+}
+_NETWORK_ERROR_DELAY = 5
+_MAX_BACKOFF_DELAY = 30
+
+class AdaptiveWindow:
+    """
+    Additive-increase/multiplicative-decrease window of in-flight requests.
+    Grows by one slot per window of successful responses and is halved every time the upstream throttles us.
+    """
+    def __init__(self, minimum: int = 1, maximum: int = 32, initial: int = 4) -> None:
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = float(min(max(initial, minimum), maximum))
+        self.inFlight = 0
+        self._pausedUntil = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        """
+        Current amount of requests allowed to be in flight.
+        """
+        return int(self.size)
+
+    async def acquire(self) -> None:
+        """
+        Waits for a free slot in the window and for any throttle pause to end.
+        """
+        while (pause := self._pausedUntil - time.monotonic()) > 0:
+            await asyncio.sleep(pause)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.inFlight < self.limit)
+            self.inFlight += 1
+            metrics.FETCH_IN_FLIGHT.set(self.inFlight)
+
+    async def release(self) -> None:
+        """
+        Frees a slot in the window.
+        """
+        async with self._condition:
+            self.inFlight -= 1
+            metrics.FETCH_IN_FLIGHT.set(self.inFlight)
+            self._condition.notify_all()
+
+    async def onSuccess(self) -> None:
+        """
+        Grows the window after a successful response.
+        """
+        async with self._condition:
+            self.size = min(self.maximum, self.size + 1 / self.size)
+            metrics.FETCH_WINDOW.set(self.limit)
+            self._condition.notify_all()
+
+    async def onThrottled(self, delay: float) -> None:
+        """
+        Halves the window and pauses every new request for `delay` seconds.
+        """
+        async with self._condition:
+            self.size = max(self.minimum, self.size / 2)
+            metrics.FETCH_WINDOW.set(self.limit)
+            self._pausedUntil = max(self._pausedUntil, time.monotonic() + delay)
+
+class PixelInfoFetcher:
+    """
+    Fetches `/api/pos-info` for many coordinates over a single pooled keep-alive session.
+    The amount of in-flight requests is bounded by an `AdaptiveWindow`; retries are iterative and capped by `maxRetries`.
+    """
+    def __init__(self, endpointURL: str, headers: dict, window: AdaptiveWindow, maxRetries: int = 5, timeout: float = 15) -> None:
+        self.endpointURL = endpointURL
+        self.headers = headers
+        self.window = window
+        self.maxRetries = maxRetries
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        """
+        Opens the pooled session; must be called from the event loop the fetcher will run on.
+        """
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.window.maximum, keepalive_timeout=60, ttl_dns_cache=300),
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self) -> None:
+        """
+        Closes the pooled session.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "PixelInfoFetcher":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def fetchPixel(self, x: int, y: int) -> Optional[dict]:
+        """
+        Returns the decoded JSON response for the pixel at (x, y), or None if the upstream failed or kept throttling us.
+        """
+        with metrics.POSINFO_PIXEL_SECONDS.time():
+            for attempt in range(self.maxRetries + 1):
+                await self.window.acquire()
+                startTimeRequest = time.perf_counter()
+                try:
+                    async with self._session.get(f"{self.endpointURL}/api/pos-info", params={"x": str(x), "y": str(y)}) as response:
+                        status = response.status
+                        body = await response.json(content_type=None) if status == 200 else await response.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    metrics.POSINFO_REQUEST_SECONDS.labels("error").observe(time.perf_counter() - startTimeRequest)
+                    metrics.POSINFO_RETRIES.labels("error").inc()
+                    logging.error(f"An error occured while getting info about pixel at ({x}, {y}): {e!r}")
+                    await self.window.onThrottled(self._backoffDelay(_NETWORK_ERROR_DELAY, attempt))
+                    continue
+                finally:
+                    await self.window.release()
+                metrics.POSINFO_REQUEST_SECONDS.labels(str(status)).observe(time.perf_counter() - startTimeRequest)
+                if status == 200:
+                    await self.window.onSuccess()
+                    return body
+                if status not in _THROTTLE_DELAYS:
+                    metrics.POSINFO_FAILURES.labels(str(status)).inc()
+                    logging.error(f"The API returned an error while getting info about pixel at ({x}, {y}): {body}.")
+                    return None
+                metrics.POSINFO_RETRIES.labels(str(status)).inc()
+                await self.window.onThrottled(self._backoffDelay(_THROTTLE_DELAYS[status], attempt))
+            metrics.POSINFO_FAILURES.labels("retries_exhausted").inc()
+            logging.error(f"Giving up on pixel at ({x}, {y}) after {self.maxRetries + 1} attempts.")
+            return None
+
+    async def fetchMany(self, coordinates: Iterable[tuple[int, int]], onResult: Callable[[int, int, Optional[dict]], Awaitable[None]]) -> None:
+        """
+        Fetches every coordinate and awaits `onResult(x, y, response)` for each of them as soon as it arrives.
+        """
+        pending = iter(coordinates)
+
+        async def worker() -> None:
+            for x, y in pending:
+                await onResult(x, y, await self.fetchPixel(x, y))
+
+        await asyncio.gather(*(worker() for _ in range(self.window.maximum)))
+
+    async def fetchForever(self, queue: "PixelWorkQueue", onResult: Callable[[int, int, Optional[dict]], Awaitable[None]]) -> None:
+        """
+        Runs one persistent worker per slot of the window maximum, taking pixels from the queue oldest-pending first
+        and awaiting `onResult(x, y, response)` for each of them. Never returns.
+        """
+        async def worker() -> None:
+            while True:
+                (x, y), detectedAt = await queue.get()
+                metrics.QUEUE_WAIT_SECONDS.observe(time.monotonic() - detectedAt)
+                await onResult(x, y, await self.fetchPixel(x, y))
+
+        await asyncio.gather(*(worker() for _ in range(self.window.maximum)))
+
+    @staticmethod
+    def _backoffDelay(baseDelay: float, attempt: int) -> float:
+        return min(_MAX_BACKOFF_DELAY, baseDelay * 2 ** attempt) * random.uniform(0.8, 1.2)
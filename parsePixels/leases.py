@@ -0,0 +1,228 @@
+"""
+Tile leases, so several parser replicas can share the canvas.
+
+The canvas is split into `tileSize`x`tileSize` tiles, and a replica only fetches the pos-info of the changed pixels of the tiles it holds
+a lease on. Leases are documents of a MongoDB collection:
+- `{"_id": "tile:<tx>:<ty>", "kind": "tile", "owner", "expiresAt", "heartbeatAt", "pendingSince"}`, one per tile;
+- `{"_id": "replica:<id>", "kind": "replica", "expiresAt", "heartbeatAt"}`, one per live replica, to know how many share the tiles.
+Every heartbeat a replica extends its leases, releases the tiles above its fair share (`ceil(tiles / live replicas)`) and claims
+free or expired tiles up to it, so the tiles of a replica which stopped heartbeating are picked up once its leases expire.
+Every heartbeat also records in `pendingSince` when the oldest pixel of the tile the replica has not stored yet was found changed (None when
+there is none). A tile changes hands with the earlier of the `heartbeatAt` and `pendingSince` of its previous owner: the new owner fetches
+every pixel of the tile which changed since then, so neither the changes the previous owner had not seen yet nor the ones still in its backlog
+are lost (pixels fetched twice are dropped as duplicates by the writer). The new owner diffs against the boards it kept since then, so changes
+older than its board history (e.g. a backlog older than it, or a tile nobody held for longer) are only caught up from its oldest board.
+Expiry is compared against the clock of each replica, so their clocks must agree to well within `leaseSeconds`.
+"""
+from collections import deque
+from datetime import datetime, timedelta
+from diffing import findChangedPixels
+from pymongo.collection import Collection
+from typing import Callable, List, Optional
+import logging
+import math
+import pymongo
+import random
+import threading
+import metrics
+
+def tileKey(tile: tuple[int, int]) -> str:
+    """
+    Returns the `_id` of the lease of a tile.
+    """
+    return f"tile:{tile[0]}:{tile[1]}"
+
+def tileOfKey(key: str) -> tuple[int, int]:
+    """
+    Returns the tile of a lease `_id`.
+    """
+    _, tx, ty = key.split(":")
+    return int(tx), int(ty)
+
+class BoardHistory:
+    """
+    The boards of the last `horizon`, with the moment each was first seen, to diff a tile against the board of an earlier moment.
+    """
+    def __init__(self, horizon: timedelta) -> None:
+        self.horizon = horizon
+        self._boards: deque[tuple[datetime, object]] = deque()
+
+    def add(self, seenAt: datetime, board) -> None:
+        """
+        Records the board seen at the moment, forgetting the boards no longer needed to answer `at` within the horizon.
+        """
+        self._boards.append((seenAt, board))
+        while len(self._boards) > 1 and self._boards[1][0] <= seenAt - self.horizon:
+            self._boards.popleft()
+
+    def covers(self, moment: datetime) -> bool:
+        """
+        Returns whether a board seen at or before the moment is known.
+        """
+        return bool(self._boards) and self._boards[0][0] <= moment
+
+    def at(self, moment: datetime):
+        """
+        Returns the board as it was at the moment, or the oldest board known if the moment is older than the history.
+        """
+        board = self._boards[0][1] if self._boards else None
+        for seenAt, candidate in self._boards:
+            if seenAt > moment:
+                break
+            board = candidate
+        return board
+
+class TileLeaseManager:
+    """
+    Holds the tile leases of one replica, see the module documentation.
+    `renew` is meant to run every `heartbeatInterval` seconds on its own thread; `owns` and `takeAcquired` may be called from any thread.
+    `pendingSince()` returns, per tile, when the oldest pixel of the tile still pending on this replica was found changed.
+    """
+    def __init__(self, collection: Collection, replicaID: str, tileSize: int, leaseSeconds: float = 30, heartbeatInterval: float = 10, pendingSince: Optional[Callable[[], dict[tuple[int, int], datetime]]] = None) -> None:
+        if heartbeatInterval * 2 > leaseSeconds:
+            raise ValueError("The lease must last at least two heartbeats.")
+        self.collection = collection
+        self.replicaID = replicaID
+        self.tileSize = tileSize
+        self.leaseDuration = timedelta(seconds=leaseSeconds)
+        self.heartbeatInterval = heartbeatInterval
+        self.pendingSince = pendingSince
+        self.tiles: List[tuple[int, int]] = []
+        self._owned: frozenset = frozenset()
+        self._acquired: dict[tuple[int, int], Optional[datetime]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def setBoardSize(self, width: int, height: int) -> None:
+        """
+        Sets the tiles to share from the size of the board.
+        """
+        tiles = [(tx, ty) for tx in range(math.ceil(width / self.tileSize)) for ty in range(math.ceil(height / self.tileSize))]
+        if tiles != self.tiles:
+            self.tiles = tiles
+            logging.info(f"Sharing a {width}x{height} board as {len(tiles)} tiles of {self.tileSize}x{self.tileSize}.")
+
+    def tileOf(self, x: int, y: int) -> tuple[int, int]:
+        return x // self.tileSize, y // self.tileSize
+
+    def owns(self, x: int, y: int) -> bool:
+        """
+        Returns whether this replica holds the lease of the tile of the pixel.
+        """
+        return self.tileOf(x, y) in self._owned
+
+    def takeAcquired(self) -> dict[tuple[int, int], Optional[datetime]]:
+        """
+        Returns the tiles acquired since the last call, with the moment since which their previous owner may have left changes unhandled
+        (None for a tile nobody held).
+        """
+        with self._lock:
+            acquired, self._acquired = self._acquired, {}
+        return acquired
+
+    def renew(self) -> frozenset:
+        """
+        Heartbeats the replica, extends its leases, then releases or claims tiles to get to its fair share.
+        Returns the tiles held.
+        """
+        now = datetime.utcnow()
+        expiresAt = now + self.leaseDuration
+        self.collection.replace_one({"_id": f"replica:{self.replicaID}"}, {"kind": "replica", "expiresAt": expiresAt, "heartbeatAt": now}, upsert=True)
+        tiles = set(self.tiles)
+        owned = {tile for tile in self._owned if tile in tiles}
+        if owned:
+            keys = [tileKey(tile) for tile in owned]
+            pending = self.pendingSince() if self.pendingSince is not None else {}
+            with self._lock:
+                # The tiles not caught up on yet are pending since their previous owner left changes unhandled.
+                for tile, unhandledSince in self._acquired.items():
+                    if unhandledSince is not None and tile in owned:
+                        pending[tile] = min(pending.get(tile, unhandledSince), unhandledSince)
+            self.collection.bulk_write([
+                pymongo.UpdateMany({"_id": {"$in": [tileKey(tile) for tile in owned if tile not in pending]}, "owner": self.replicaID}, {"$set": {"expiresAt": expiresAt, "heartbeatAt": now, "pendingSince": None}}),
+            ] + [
+                pymongo.UpdateOne({"_id": tileKey(tile), "owner": self.replicaID}, {"$set": {"expiresAt": expiresAt, "heartbeatAt": now, "pendingSince": pending[tile]}})
+                for tile in owned if tile in pending
+            ], ordered=False)
+            # A lease which expired before this heartbeat may already belong to another replica.
+            owned = {tileOfKey(lease["_id"]) for lease in self.collection.find({"_id": {"$in": keys}, "owner": self.replicaID}, {"_id": 1})}
+        replicas = max(1, self.collection.count_documents({"kind": "replica", "expiresAt": {"$gt": now}}))
+        share = math.ceil(len(self.tiles) / replicas)
+        if len(owned) > share:
+            released = sorted(owned)[share:]
+            self.collection.update_many({"_id": {"$in": [tileKey(tile) for tile in released]}, "owner": self.replicaID}, {"$set": {"owner": None, "expiresAt": now}})
+            owned -= set(released)
+            logging.info(f"Released {len(released)} tiles to get to the fair share of {share} tiles among {replicas} replicas.")
+        elif len(owned) < share:
+            candidates = [tile for tile in self.tiles if tile not in owned]
+            random.shuffle(candidates)
+            for tile in candidates:
+                if len(owned) >= share:
+                    break
+                claimed, unhandledSince = self._claim(tile, now, expiresAt)
+                if claimed:
+                    owned.add(tile)
+                    with self._lock:
+                        self._acquired[tile] = unhandledSince
+                    metrics.TILE_HANDOVERS.inc()
+        if owned != self._owned:
+            logging.info(f"Holding {len(owned)} of {len(self.tiles)} tiles (fair share of {share} among {replicas} replicas).")
+        self._owned = frozenset(owned)
+        metrics.TILES_OWNED.set(len(owned))
+        return self._owned
+
+    def _claim(self, tile: tuple[int, int], now: datetime, expiresAt: datetime) -> tuple[bool, Optional[datetime]]:
+        """
+        Takes the lease of the tile if it is free or expired, and returns since when its previous owner may have left changes unhandled.
+        When another replica holds it the filter does not match and the upsert collides on `_id`; the collision means the tile is taken.
+        """
+        try:
+            previous = self.collection.find_one_and_update(
+                {"_id": tileKey(tile), "$or": [{"owner": None}, {"expiresAt": {"$lte": now}}]},
+                {"$set": {"kind": "tile", "owner": self.replicaID, "expiresAt": expiresAt, "heartbeatAt": now, "pendingSince": None}},
+                upsert=True,
+                return_document=pymongo.ReturnDocument.BEFORE,
+            )
+        except pymongo.errors.DuplicateKeyError:
+            return False, None
+        if previous is None:
+            return True, None
+        unhandledSince = min(moment for moment in [previous["heartbeatAt"], previous.get("pendingSince")] if moment is not None)
+        self.collection.update_one({"_id": tileKey(tile), "owner": self.replicaID}, {"$set": {"pendingSince": unhandledSince}})
+        return True, unhandledSince
+
+    def release(self) -> None:
+        """
+        Releases every lease of the replica and its heartbeat, so the other replicas take its tiles over right away.
+        The leases keep their last `heartbeatAt` and `pendingSince`, so the new owners also catch up on the pixels still pending here.
+        """
+        self.collection.update_many({"kind": "tile", "owner": self.replicaID}, {"$set": {"owner": None, "expiresAt": datetime.utcnow()}})
+        self.collection.delete_one({"_id": f"replica:{self.replicaID}"})
+        self._owned = frozenset()
+
+    def heartbeatForever(self) -> None:
+        """
+        Renews the leases every `heartbeatInterval` seconds until `stop` is called.
+        """
+        while not self._stopped.is_set():
+            try:
+                self.renew()
+            except pymongo.errors.PyMongoError as e:
+                # Without a heartbeat the leases run out on their own, and the other replicas take the tiles over.
+                logging.error(f"An error occured while renewing the tile leases: {e}")
+            self._stopped.wait(self.heartbeatInterval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+def changedPixelsInTile(previous, current, tile: tuple[int, int], tileSize: int) -> List[tuple[int, int]]:
+    """
+    Returns the (x, y) coordinates of the pixels of the tile which differ between the two boards; all of them if the board was resized.
+    """
+    left, top = tile[0] * tileSize, tile[1] * tileSize
+    window = (slice(top, top + tileSize), slice(left, left + tileSize))
+    currentTile = current[window]
+    previousTile = previous[window] if previous is not None and previous.shape == current.shape else None
+    if previousTile is None:
+        return [(left + x, top + y) for x in range(currentTile.shape[1]) for y in range(currentTile.shape[0])]
+    return [(left + x, top + y) for x, y in findChangedPixels(previousTile, currentTile)]
@@ -0,0 +1,40 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+import logging
+
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+_SLOW_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+BOARD_DOWNLOAD_SECONDS = Histogram("parser_board_download_seconds", "Time to download the board image.", buckets=_SLOW_BUCKETS)
+BOARD_DECODE_SECONDS = Histogram("parser_board_decode_seconds", "Time to decode the board image into an array.", buckets=_FAST_BUCKETS)
+BOARD_DIFF_SECONDS = Histogram("parser_board_diff_seconds", "Time to diff the board against the previous one.", buckets=_FAST_BUCKETS)
+BOARD_SKIPPED_TICKS = Counter("parser_board_skipped_ticks_total", "Ticks whose board was unchanged, so it was neither decoded nor diffed, by how it was detected.", ["reason"])
+BOARD_DOWNLOAD_FAILURES = Counter("parser_board_download_failures_total", "Board image downloads which did not return 200.")
+CHANGED_PIXELS = Counter("parser_changed_pixels_total", "Pixels found changed between two boards.")
+
+POSINFO_REQUEST_SECONDS = Histogram("parser_posinfo_request_seconds", "Time of a single pos-info request.", ["status"], buckets=_SLOW_BUCKETS)
+POSINFO_PIXEL_SECONDS = Histogram("parser_posinfo_pixel_seconds", "Time to get the info of a pixel, retries and throttle pauses included.", buckets=_SLOW_BUCKETS)
+POSINFO_RETRIES = Counter("parser_posinfo_retries_total", "Pos-info requests retried after a throttle or a network error.", ["reason"])
+POSINFO_FAILURES = Counter("parser_posinfo_failures_total", "Pixels given up on.", ["reason"])
+FETCH_WINDOW = Gauge("parser_fetch_window", "Current amount of pos-info requests allowed in flight.")
+FETCH_IN_FLIGHT = Gauge("parser_fetch_in_flight", "Pos-info requests currently in flight.")
+
+PENDING_PIXELS = Gauge("parser_pending_pixels", "Changed pixels waiting for their pos-info.")
+QUEUE_WAIT_SECONDS = Histogram("parser_queue_wait_seconds", "Time from a pixel being found changed to its pos-info fetch starting.", buckets=_SLOW_BUCKETS)
+QUEUE_COALESCED = Counter("parser_queue_coalesced_total", "Changes of a pixel which was already pending.")
+QUEUE_DROPPED = Counter("parser_queue_dropped_total", "Pixels dropped because the backlog was full.")
+
+DB_FLUSH_SECONDS = Histogram("parser_db_flush_seconds", "Time of one bulk insert into pixels-info.", buckets=_SLOW_BUCKETS)
+DB_UPDATER_SECONDS = Histogram("parser_db_updater_seconds", "Time of one derived collection update.", ["updater"], buckets=_SLOW_BUCKETS)
+DB_PIXELS = Counter("parser_db_pixels_total", "Pixels handed to the database, by result.", ["result"])
+WRITE_BUFFER = Gauge("parser_write_buffer_pixels", "Pixels waiting in the write-behind buffer.")
+
+TILES_OWNED = Gauge("parser_tiles_owned", "Tiles of the canvas this replica holds the lease of.")
+TILE_HANDOVERS = Counter("parser_tile_handovers_total", "Tile leases claimed by this replica.")
+TILE_CATCHUP_PIXELS = Counter("parser_tile_catchup_pixels_total", "Pixels queued because they changed in a tile before this replica claimed it.")
+
+def startMetricsServer(port: int) -> None:
+    """
+    Exposes every metric of the process in the Prometheus text format on `http://0.0.0.0:<port>/metrics`.
+    """
+    start_http_server(port)
+    logging.info(f"Serving metrics on port {port}.")
@@ -1,16 +1,28 @@
 from PIL import Image
 from typing import List, Optional
 import pydantic
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
 import pymongo
 import time
 import logging
 import threading
 import random
-import urllib3
 import os
+import asyncio
+import signal
+import socket
+import sys
 from io import BytesIO
+from diffing import findChangedPixels
+from palette import Palette
+from boardfetch import BoardFetcher, BoardFrame
+from fetcher import AdaptiveWindow, PixelInfoFetcher
+from derived import RollupWatermarks, LatestPixelsUpdater, UsersUpdater, VersionBumper, CanvasCheckpointInvalidator, UserStatsUpdater, HourlyStatsUpdater, PixelStatsUpdater, HeatmapUpdater
+from workqueue import PixelWorkQueue
+from leases import BoardHistory, TileLeaseManager, changedPixelsInTile
+from writer import BulkPixelWriter, RESULT_INSERTED, RESULT_ERROR, RESULT_DUPLICATE, RESULT_EMPTY
+import metrics
 
 class PositionPixelModel(pydantic.BaseModel):
     x: int
@@ -77,80 +89,120 @@ logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %
 
 __DB = pymongo.MongoClient(os.environ["MONGODB_URI"])
 __DB_PIXINFO = __DB["plcgxrm"]["pixels-info"]
+__DB_PIXLATEST = __DB["plcgxrm"]["pixels-latest"]
+__DB_USERS = __DB["plcgxrm"]["users"]
+__DB_VERSIONS = __DB["plcgxrm"]["versions"]
+__DB_STATS_USERS = __DB["plcgxrm"]["stats-users"]
+__DB_STATS_HOURLY = __DB["plcgxrm"]["stats-hourly"]
+__DB_STATS_PIXELS = __DB["plcgxrm"]["stats-pixels"]
+__DB_HEATMAP_HOURLY = __DB["plcgxrm"]["heatmap-hourly"]
+__DB_HEATMAP_CHECKPOINTS = __DB["plcgxrm"]["heatmap-checkpoints"]
+__DB_LEASES = __DB["plcgxrm"]["parser-leases"]
+__DB_BACKFILLS = __DB["plcgxrm"]["backfills"]
+__DB_CHECKPOINTS = __DB["plcgxrm"]["canvas-checkpoints"]
+__DB_BOARD = __DB["plcgxrm"]["board"]
 
-_ENDPOINT_URL = "https://place.geoxor.moe"
-_WORKERS_COUNT = 2
+_ENDPOINT_URL = os.environ.get("PLACE_ENDPOINT_URL", "https://place.geoxor.moe")
+_FETCH_WINDOW_MIN = int(os.environ.get("FETCH_WINDOW_MIN", 1))
+_FETCH_WINDOW_MAX = int(os.environ.get("FETCH_WINDOW_MAX", 16))
+_FETCH_MAX_RETRIES = int(os.environ.get("FETCH_MAX_RETRIES", 5))
+_WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 500))
+_WRITE_FLUSH_INTERVAL = float(os.environ.get("WRITE_FLUSH_INTERVAL", 2))
+_WORK_QUEUE_MAX_BACKLOG = int(os.environ.get("WORK_QUEUE_MAX_BACKLOG", 50000))
+_WORK_QUEUE_OVERFLOW = os.environ.get("WORK_QUEUE_OVERFLOW", "drop-oldest")
+_BOARD_RETRY_DELAY = float(os.environ.get("BOARD_RETRY_DELAY", 0.5))
+_BOARD_RETRY_DELAY_MAX = float(os.environ.get("BOARD_RETRY_DELAY_MAX", 60))
+# Pixels placed longer ago than this invalidate the canvas and heatmap responses the API keeps for the settled history;
+# it must stay below `CANVAS_CHECKPOINT_DELAY` and `HEATMAP_CHECKPOINT_DELAY` of the API.
+_LATE_PIXEL_AGE = timedelta(seconds=int(os.environ.get("LATE_PIXEL_AGE", 120)))
+_METRICS_PORT = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None
+_TILE_SIZE = int(os.environ.get("TILE_SIZE", 0))
+_REPLICA_ID = os.environ.get("REPLICA_ID", f"{socket.gethostname()}-{os.getpid()}")
+_LEASE_SECONDS = float(os.environ.get("LEASE_SECONDS", 30))
+_LEASE_HEARTBEAT_INTERVAL = float(os.environ.get("LEASE_HEARTBEAT_INTERVAL", 10))
+_BOARD_HISTORY_SECONDS = float(os.environ.get("BOARD_HISTORY_SECONDS", 300))
 
-def addPixelToDatabase(pixel: PixelInformationResponseModel) -> int:
-    try:
-        if pixel.pixel is None:
-            return 3
-        _dbr = __DB_PIXINFO.insert_one(pixel.dict()["pixel"])
-        return 0 if _dbr.inserted_id else 1
-    except pymongo.errors.DuplicateKeyError:
-        return 2
-
-def getPixelInformation(x: int, y: int) -> Optional[PixelInformationResponseModel]:
+_FETCHER_LOOP = asyncio.new_event_loop()
+_FETCHER = PixelInfoFetcher(
+    endpointURL=_ENDPOINT_URL,
+    headers={
+        "X-Requested-With": "XMLHttpRequest",
+        "User-Agent": "PlaceGeoxorMoeParser/0.6.2 (Macintosh; OS X/12.3.0) URLSession/1858.112",
+        "x-vprw-intfs-ver": "1.2",
+    },
+    window=AdaptiveWindow(minimum=_FETCH_WINDOW_MIN, maximum=_FETCH_WINDOW_MAX, initial=_FETCH_WINDOW_MIN),
+    maxRetries=_FETCH_MAX_RETRIES,
+)
+_WORK_QUEUE = PixelWorkQueue(_FETCHER_LOOP, maxBacklog=_WORK_QUEUE_MAX_BACKLOG, overflowPolicy=_WORK_QUEUE_OVERFLOW)
+
+def logPixelDatabaseResult(coordinates: tuple[int, int], dbabq: int) -> None:
+    if dbabq == RESULT_INSERTED:
+        logging.debug(f"Added info about pixel at ({coordinates[0]}, {coordinates[1]}) successfully.")
+    elif dbabq == RESULT_ERROR:
+        logging.error(f"An error occured while adding info about pixel at ({coordinates[0]}, {coordinates[1]}).")
+    elif dbabq == RESULT_DUPLICATE:
+        logging.debug(f"Pixel at ({coordinates[0]}, {coordinates[1]}) did not change as it already exists in database.")
+    elif dbabq == RESULT_EMPTY:
+        logging.debug(f"Pixel at ({coordinates[0]}, {coordinates[1]}) was not found or is empty.")
+
+def handlePixelResult(coordinates: tuple[int, int], result: int) -> None:
+    """
+    Logs the outcome of a pixel and marks it handled in the work queue, so it no longer counts as pending in the lease heartbeats.
+    """
+    logPixelDatabaseResult(coordinates, result)
+    _WORK_QUEUE.done(coordinates)
+
+_WRITER = BulkPixelWriter(
+    __DB_PIXINFO,
+    batchSize=_WRITE_BATCH_SIZE,
+    flushInterval=_WRITE_FLUSH_INTERVAL,
+    onResult=handlePixelResult,
+    updaters=[
+        LatestPixelsUpdater(__DB_PIXLATEST),
+        UsersUpdater(__DB_USERS),
+        VersionBumper(__DB_VERSIONS, "pixels"),
+        VersionBumper(__DB_VERSIONS, "pixels-history", olderThan=_LATE_PIXEL_AGE),
+    ],
+    counters=[
+        UserStatsUpdater(__DB_STATS_USERS),
+        HourlyStatsUpdater(__DB_STATS_HOURLY),
+        PixelStatsUpdater(__DB_STATS_PIXELS),
+        HeatmapUpdater(__DB_HEATMAP_HOURLY, __DB_HEATMAP_CHECKPOINTS),
+        CanvasCheckpointInvalidator(__DB_CHECKPOINTS),
+    ],
+    watermarks=RollupWatermarks(__DB_BACKFILLS),
+)
+
+def addPixelToDatabase(coordinates: tuple[int, int], pixel: PixelInformationResponseModel) -> None:
+    if pixel.pixel is None:
+        metrics.DB_PIXELS.labels("empty").inc()
+        handlePixelResult(coordinates, RESULT_EMPTY)
+        return
+    _WRITER.add(coordinates, pixel.dict()["pixel"])
+
+def parsePixelInformation(response: Optional[dict]) -> Optional[PixelInformationResponseModel]:
+    if response is None:
+        return None
     try:
-        response = requests.get(
-            url=f"{_ENDPOINT_URL}/api/pos-info",
-            headers={
-                "X-Requested-With": "XMLHttpRequest",
-                "User-Agent": "PlaceGeoxorMoeParser/0.6.2 (Macintosh; OS X/12.3.0) URLSession/1858.112",
-                "x-vprw-intfs-ver": "1.2",
-            },
-            params={
-                "x": str(x),
-                "y": str(y),
-            },
-        )
-    except requests.exceptions.RequestException as e:
-        logging.error(f"An error occured while getting info about pixel at ({x}, {y}): {e}")
-        time.sleep(5)
-        return getPixelInformation(x, y)
-    except urllib3.exceptions.ProtocolError as e:
-        logging.error(f"An error occured while getting info about pixel at ({x}, {y}): {e}")
-        time.sleep(5)
-        return getPixelInformation(x, y)
-    except requests.exceptions.ConnectionError as e:
-        logging.error(f"An error occured while getting info about pixel at ({x}, {y}): {e}")
-        time.sleep(5)
-        return getPixelInformation(x, y)
-    if response.status_code == 200:
-        try:
-            return PixelInformationResponseModel(**response.json())
-        except pydantic.error_wrappers.ValidationError as e:
-            logging.error(f"A validation error occured while parsing response from API: {response.text} ;; {e}.")
-            return None
-    elif response.status_code == 503:
-        time.sleep(0.5)
-        return getPixelInformation(x, y)
-    elif response.status_code == 400:
-        time.sleep(1)
-        return getPixelInformation(x, y)
-    logging.error(f"The API returned an error while getting info about pixel at ({x}, {y}): {response.text}.")
-    return None
-
-def splitInChunks(input_list: list, nums: int) -> list[list]:
-    for i in range(0, nums):
-        yield input_list[i::nums]
-
-def processBatchGetInfo(batch: list[tuple[int, int]], threadNumber: int) -> None:
-    for coordinates in batch:
-        rspap = getPixelInformation(coordinates[0], coordinates[1])
-        if rspap is not None:
-            dbabq = addPixelToDatabase(rspap)
-            if dbabq == 0:
-                logging.debug(f"Added info about pixel at ({coordinates[0]}, {coordinates[1]}) successfully.")
-            elif dbabq == 1:
-                logging.error(f"An error occured while adding info about pixel at ({coordinates[0]}, {coordinates[1]}).")
-            elif dbabq == 2:
-                logging.debug(f"Pixel at ({coordinates[0]}, {coordinates[1]}) did not change as it already exists in database.")
-            elif dbabq == 3:
-                logging.debug(f"Pixel at ({coordinates[0]}, {coordinates[1]}) was not found or is empty.")
-        else:
-            logging.error(f"An error occured while getting info about pixel at ({coordinates[0]}, {coordinates[1]}).")
-        time.sleep(0.1 + random.randint(0, 2) / 10)
+        return PixelInformationResponseModel(**response)
+    except pydantic.error_wrappers.ValidationError as e:
+        logging.error(f"A validation error occured while parsing response from API: {response} ;; {e}.")
+        return None
+
+async def processPixelInformation(x: int, y: int, response: Optional[dict]) -> None:
+    rspap = parsePixelInformation(response)
+    if rspap is not None:
+        addPixelToDatabase((x, y), rspap)
+    else:
+        logging.error(f"An error occured while getting info about pixel at ({x}, {y}).")
+        _WORK_QUEUE.done((x, y))
+
+_PIXEL_WORKERS: Optional[asyncio.Future] = None
+
+async def startPixelWorkers() -> None:
+    global _PIXEL_WORKERS
+    await _FETCHER.start()
+    _PIXEL_WORKERS = asyncio.ensure_future(_FETCHER.fetchForever(_WORK_QUEUE, processPixelInformation))
 
 # def getUsersToCheckFromLeaderboard() -> Optional[List[str]]:
 #     response = requests.get(
@@ -213,58 +265,150 @@ def processBatchGetInfo(batch: list[tuple[int, int]], threadNumber: int) -> None
 #             logging.warning(f"No users to check from the leaderboard.")
 #         time.sleep(0.2 + random.randint(0, 2) / 10)
 
+_BOARD_FETCHER = BoardFetcher(
+    f"{_ENDPOINT_URL}/api/board-image",
+    headers={
+        "X-Requested-With": "XMLHttpRequest",
+        "User-Agent": "PlaceGeoxorMoeParser/0.6.5",
+        "x-vprw-intfs-ver": "1.2",
+        "x-vprw-parslinkplgemopar-ver": "0.4",
+    },
+)
+
+def downloadBoard() -> BoardFrame:
+    attempt = 0
+    while True:
+        with metrics.BOARD_DOWNLOAD_SECONDS.time():
+            board = _BOARD_FETCHER.fetch()
+        if board is not None:
+            return board
+        metrics.BOARD_DOWNLOAD_FAILURES.inc()
+        # Backs off while the upstream is down instead of hammering it, up to `BOARD_RETRY_DELAY_MAX` seconds between attempts.
+        retryDelay = min(_BOARD_RETRY_DELAY_MAX, _BOARD_RETRY_DELAY * 2 ** min(attempt, 16)) * random.uniform(0.8, 1.2)
+        logging.warning(f"Could not download the board (attempt {attempt + 1}), retrying in {round(retryDelay, 2)} seconds.")
+        time.sleep(retryDelay)
+        attempt += 1
+
 def downloadImage() -> Optional[Image.Image]:
-    response = requests.get(
-        f"{_ENDPOINT_URL}/api/board-image",
-        headers={
-            "X-Requested-With": "XMLHttpRequest",
-            "User-Agent": "PlaceGeoxorMoeParser/0.6.5",
-            "x-vprw-intfs-ver": "1.2",
-            "x-vprw-parslinkplgemopar-ver": "0.4",
-        },
-    )
-    logging.debug(f"Got repspone from the API with status code {response.status_code} in {round(response.elapsed.total_seconds(), 4)} seconds.")
-    if response.status_code != 200:
-        return downloadImage()
-    image = BytesIO(response.content)
+    image = BytesIO(downloadBoard().content)
     image.seek(0)
     image = Image.open(image)
     return image
 
-_PREVIOUS_IMAGE = downloadImage()
+_BOARD_SIZE: Optional[tuple[int, int]] = None
+
+def recordBoardSize(board) -> None:
+    """
+    Stores the size of the board in the `board` collection when it changes, so the API renders the canvas at the size of the board
+    rather than of the pixels placed so far, and bumps the `board` version to invalidate the responses rendered at the previous size.
+    """
+    global _BOARD_SIZE
+    size = (board.shape[1], board.shape[0])
+    if size == _BOARD_SIZE:
+        return
+    try:
+        __DB_BOARD.replace_one({"_id": "size"}, {"width": size[0], "height": size[1], "updatedAt": datetime.utcnow()}, upsert=True)
+        __DB_VERSIONS.update_one({"_id": "board"}, {"$inc": {"version": 1}}, upsert=True)
+    except pymongo.errors.PyMongoError as e:
+        logging.error(f"An error occured while storing the board size: {e}")
+        return
+    _BOARD_SIZE = size
+    logging.info(f"The board is {size[0]}x{size[1]}.")
+
+_PALETTE = Palette()
+_PREVIOUS_BOARD = _PALETTE.indexImage(downloadImage())
+recordBoardSize(_PREVIOUS_BOARD)
+
+def pendingSinceByTile() -> dict[tuple[int, int], datetime]:
+    """
+    Returns, per tile, when the oldest pixel of the tile still queued or being fetched was found changed.
+    """
+    now, nowMonotonic = datetime.utcnow(), time.monotonic()
+    return {tile: now - timedelta(seconds=nowMonotonic - detectedAt) for tile, detectedAt in _WORK_QUEUE.oldestPendingBy(lambda pixel: _LEASES.tileOf(*pixel)).items()}
+
+# With a tile size, the replica only handles the tiles it holds the lease of, and keeps the boards a tile it claims may have to be diffed against:
+# at least back to the last heartbeat of a replica whose leases just expired, and `BOARD_HISTORY_SECONDS` for the backlogs it may have left.
+_LEASES = TileLeaseManager(__DB_LEASES, _REPLICA_ID, _TILE_SIZE, leaseSeconds=_LEASE_SECONDS, heartbeatInterval=_LEASE_HEARTBEAT_INTERVAL, pendingSince=pendingSinceByTile) if _TILE_SIZE > 0 else None
+_BOARD_HISTORY = BoardHistory(timedelta(seconds=max(_LEASE_SECONDS + 2 * _LEASE_HEARTBEAT_INTERVAL, _BOARD_HISTORY_SECONDS))) if _LEASES is not None else None
+if _LEASES is not None:
+    _LEASES.setBoardSize(_PREVIOUS_BOARD.shape[1], _PREVIOUS_BOARD.shape[0])
+    _BOARD_HISTORY.add(datetime.utcnow(), _PREVIOUS_BOARD)
 
 def compareTwoImagesAndDeterminesIfPixelHasChanged(image: Image.Image) -> List[tuple[int, int]]:
-    global _PREVIOUS_IMAGE
-    if _PREVIOUS_IMAGE is None:
-        _PREVIOUS_IMAGE = image
+    global _PREVIOUS_BOARD
+    startTimeCompare = time.time()
+    with metrics.BOARD_DECODE_SECONDS.time():
+        board = _PALETTE.indexImage(image)
+    if _PREVIOUS_BOARD is None:
+        _PREVIOUS_BOARD = board
         logging.warning(f"The previous image was not set, so it was set to the current image.")
         return []
-    changedPixels = []
-    startTimeCompare = time.time()
-    for x in range(0, image.width):
-        for y in range(0, image.height):
-            if image.getpixel((x, y)) != _PREVIOUS_IMAGE.getpixel((x, y)):
-                changedPixels.append((x, y))
+    with metrics.BOARD_DIFF_SECONDS.time():
+        changedPixels = findChangedPixels(_PREVIOUS_BOARD, board)
+    metrics.CHANGED_PIXELS.inc(len(changedPixels))
     logging.debug(f"Compared {image.width * image.height} pixels in {round(time.time() - startTimeCompare, 4)} seconds.")
-    _PREVIOUS_IMAGE = image
+    _PREVIOUS_BOARD = board
+    recordBoardSize(board)
+    if _LEASES is not None:
+        _LEASES.setBoardSize(board.shape[1], board.shape[0])
+        _BOARD_HISTORY.add(datetime.utcnow(), board)
     return changedPixels
 
+def selectOwnedPixels(changedPixels: List[tuple[int, int]]) -> List[tuple[int, int]]:
+    """
+    Keeps the changed pixels of the tiles this replica holds, and queues the pixels of the tiles it just claimed which changed
+    since their previous owner may have left changes unhandled, as found changed at that moment so they keep counting as pending since then.
+    """
+    ownedPixels = [coordinates for coordinates in changedPixels if _LEASES.owns(*coordinates)]
+    for tile, unhandledSince in _LEASES.takeAcquired().items():
+        if unhandledSince is None:
+            continue
+        # The previous owner heartbeats on its own thread, so the boards it handled may lag its heartbeat by one interval.
+        since = unhandledSince - timedelta(seconds=_LEASE_HEARTBEAT_INTERVAL)
+        if not _BOARD_HISTORY.covers(since):
+            logging.warning(f"Tile {tile} has changes unhandled since {since}, before the oldest board kept; the changes before it are not caught up.")
+        catchUpPixels = changedPixelsInTile(_BOARD_HISTORY.at(since), _PREVIOUS_BOARD, tile, _TILE_SIZE)
+        _WORK_QUEUE.put(catchUpPixels, detectedAt=time.monotonic() - (datetime.utcnow() - since).total_seconds())
+        metrics.TILE_CATCHUP_PIXELS.inc(len(catchUpPixels))
+        logging.info(f"Claimed tile {tile} with changes unhandled since {unhandledSince}, queued the {len(catchUpPixels)} pixels changed in it since then.")
+    return ownedPixels
+
+def stopOnSignal(signum, frame) -> None:
+    sys.exit(0)
+
 def main():
-    while True:
-        allPixelsCoordinates = compareTwoImagesAndDeterminesIfPixelHasChanged(downloadImage())
-        logging.info(f"Found {len(allPixelsCoordinates)} pixels to check.")
-        random.shuffle(allPixelsCoordinates)
-        splittedCoordinates = list(splitInChunks(allPixelsCoordinates, _WORKERS_COUNT))
-        for value, numThread in zip(splittedCoordinates, range(len(splittedCoordinates))):
-            t = threading.Thread(
-                target=processBatchGetInfo,
-                args=(
-                    value,
-                    numThread,
-                ),
-            )
-            t.start()
-        time.sleep(4 + random.randint(0, 2))
+    if _METRICS_PORT is not None:
+        metrics.startMetricsServer(_METRICS_PORT)
+    _WRITER.start()
+    threading.Thread(target=_FETCHER_LOOP.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(startPixelWorkers(), _FETCHER_LOOP).result()
+    if _LEASES is not None:
+        # Released on exit, so the other replicas take the tiles over without waiting for the leases to expire.
+        signal.signal(signal.SIGTERM, stopOnSignal)
+        _LEASES.renew()
+        threading.Thread(target=_LEASES.heartbeatForever, daemon=True).start()
+        logging.info(f"Running as replica {_REPLICA_ID} with tiles of {_TILE_SIZE}x{_TILE_SIZE}.")
+    try:
+        while True:
+            board = downloadBoard()
+            if board.changed:
+                allPixelsCoordinates = compareTwoImagesAndDeterminesIfPixelHasChanged(Image.open(BytesIO(board.content)))
+            else:
+                # Nothing to decode nor diff: the board is the one of the previous tick.
+                allPixelsCoordinates = []
+                metrics.BOARD_SKIPPED_TICKS.labels(board.skipped).inc()
+            if _LEASES is not None:
+                allPixelsCoordinates = selectOwnedPixels(allPixelsCoordinates)
+            if board.changed or allPixelsCoordinates:
+                queued, coalesced, dropped = _WORK_QUEUE.put(allPixelsCoordinates)
+                logging.info(f"Found {len(allPixelsCoordinates)} pixels to check: {queued} queued, {coalesced} already pending, {dropped} dropped; {len(_WORK_QUEUE)} pending (window of {_FETCHER.window.limit} requests).")
+            else:
+                logging.info(f"The board has not changed ({board.skipped}), skipped the tick; {_BOARD_FETCHER.skippedTotal} of {_BOARD_FETCHER.fetched} ticks skipped so far, {len(_WORK_QUEUE)} pending.")
+            time.sleep(4 + random.randint(0, 2))
+    finally:
+        if _LEASES is not None:
+            _LEASES.stop()
+            _LEASES.release()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,117 @@
+from typing import Callable, Hashable, Optional
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import metrics
+
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+
+class PixelWorkQueue:
+    """
+    Deduplicating priority queue of pixels waiting for their pos-info.
+    A pixel already pending is not queued again: repeated changes are coalesced into the pending entry, which keeps the time of the first one.
+    Pixels are handed out oldest-pending first. At most `maxBacklog` pixels are pending; on overflow either the oldest pending pixel
+    or the new one is dropped, depending on `overflowPolicy`.
+    A pixel handed out stays in flight, with the time it was first found changed, until `done` is called once its pos-info is handled.
+    `put`, `done` and `oldestPendingBy` may be called from any thread, `get` must be awaited on the event loop the queue is bound to.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxBacklog: int = 50000, overflowPolicy: str = OVERFLOW_DROP_OLDEST) -> None:
+        if overflowPolicy not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError(f"Unknown overflow policy: {overflowPolicy}")
+        self.loop = loop
+        self.maxBacklog = maxBacklog
+        self.overflowPolicy = overflowPolicy
+        self._pending: dict[tuple[int, int], float] = {}
+        self._heap: list[tuple[float, int, tuple[int, int]]] = []
+        self._inFlight: dict[tuple[int, int], list[float]] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._available: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, coordinates: list[tuple[int, int]], detectedAt: Optional[float] = None) -> tuple[int, int, int]:
+        """
+        Queues the pixels found changed at `detectedAt` (`time.monotonic()` by default).
+        Returns how many were queued, coalesced into a pending entry and dropped.
+        """
+        detectedAt = time.monotonic() if detectedAt is None else detectedAt
+        queued = coalesced = dropped = 0
+        with self._lock:
+            for pixel in coordinates:
+                if pixel in self._pending:
+                    coalesced += 1
+                    continue
+                if len(self._pending) >= self.maxBacklog:
+                    dropped += 1
+                    if self.overflowPolicy == OVERFLOW_DROP_NEWEST:
+                        continue
+                    self._popOldest()
+                self._pending[pixel] = detectedAt
+                heapq.heappush(self._heap, (detectedAt, next(self._sequence), pixel))
+                queued += 1
+            metrics.PENDING_PIXELS.set(len(self._pending))
+        metrics.QUEUE_COALESCED.inc(coalesced)
+        metrics.QUEUE_DROPPED.inc(dropped)
+        if queued:
+            self.loop.call_soon_threadsafe(self._notify)
+        return queued, coalesced, dropped
+
+    async def get(self) -> tuple[tuple[int, int], float]:
+        """
+        Waits for the oldest pending pixel and returns its coordinates and the time it was first found changed.
+        Once handed out, the pixel can be queued again: a change during the fetch is fetched once more.
+        """
+        if self._available is None:
+            self._available = asyncio.Event()
+        while True:
+            with self._lock:
+                entry = self._popOldest()
+                metrics.PENDING_PIXELS.set(len(self._pending))
+                if entry is not None:
+                    self._inFlight.setdefault(entry[0], []).append(entry[1])
+            if entry is not None:
+                return entry
+            self._available.clear()
+            if len(self._pending) == 0:
+                await self._available.wait()
+
+    def done(self, pixel: tuple[int, int]) -> None:
+        """
+        Marks the pixel handed out the longest ago with these coordinates as handled.
+        """
+        with self._lock:
+            inFlight = self._inFlight.get(pixel)
+            if not inFlight:
+                return
+            inFlight.pop(0)
+            if not inFlight:
+                del self._inFlight[pixel]
+
+    def oldestPendingBy(self, key: Callable[[tuple[int, int]], Hashable]) -> dict[Hashable, float]:
+        """
+        Returns, for every value of `key(pixel)`, the time the oldest pixel still queued or in flight was first found changed.
+        """
+        oldest = {}
+        with self._lock:
+            entries = list(self._pending.items()) + [(pixel, min(inFlight)) for pixel, inFlight in self._inFlight.items()]
+        for pixel, detectedAt in entries:
+            group = key(pixel)
+            if group not in oldest or detectedAt < oldest[group]:
+                oldest[group] = detectedAt
+        return oldest
+
+    def _popOldest(self) -> Optional[tuple[tuple[int, int], float]]:
+        if not self._heap:
+            return None
+        detectedAt, _, pixel = heapq.heappop(self._heap)
+        del self._pending[pixel]
+        return pixel, detectedAt
+
+    def _notify(self) -> None:
+        if self._available is not None:
+            self._available.set()
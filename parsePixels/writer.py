@@ -0,0 +1,116 @@
+from derived import RollupWatermarks
+from pymongo.collection import Collection
+from typing import Callable, Optional, Protocol
+import logging
+import pymongo
+import threading
+import time
+import metrics
+
+RESULT_INSERTED = 0
+RESULT_ERROR = 1
+RESULT_DUPLICATE = 2
+RESULT_EMPTY = 3
+
+_DUPLICATE_KEY_ERROR_CODE = 11000
+
+class DerivedCollectionUpdater(Protocol):
+    """
+    Collection maintained from the pixels written by `BulkPixelWriter`.
+    """
+    collection: Collection
+
+    def update(self, documents: list[dict]) -> None:
+        ...
+
+class BulkPixelWriter:
+    """
+    Write-behind buffer for the pixels-info collection.
+    Documents are flushed with one unordered `insert_many` as soon as `batchSize` of them are pending or `flushInterval` seconds have passed,
+    and `onResult(coordinates, result)` is called for every document with one of the `RESULT_*` codes.
+    Every updater in `updaters` then receives the documents which are stored in the collection, so derived collections can follow the inserts;
+    the ones in `counters` only receive the documents this flush inserted, never a duplicate, so rollups incrementing counters count every pixel once.
+    With `watermarks`, a counter only receives the documents above the watermark of its collection, the ones below it being counted by a rebuild.
+    """
+    def __init__(self, collection: Collection, batchSize: int = 500, flushInterval: float = 2, onResult: Optional[Callable[[tuple[int, int], int], None]] = None, updaters: Optional[list[DerivedCollectionUpdater]] = None, counters: Optional[list[DerivedCollectionUpdater]] = None, watermarks: Optional[RollupWatermarks] = None) -> None:
+        self.collection = collection
+        self.updaters = updaters or []
+        self.counters = counters or []
+        self.watermarks = watermarks
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.onResult = onResult
+        self._pending: list[tuple[tuple[int, int], dict]] = []
+        self._condition = threading.Condition()
+        self._flushLock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Starts the background thread flushing the buffer.
+        """
+        self._thread = threading.Thread(target=self._flushLoop, name="bulk-pixel-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, coordinates: tuple[int, int], document: dict) -> None:
+        """
+        Queues the pixel document for the next flush; never waits for the database.
+        """
+        with self._condition:
+            self._pending.append((coordinates, document))
+            metrics.WRITE_BUFFER.set(len(self._pending))
+            if len(self._pending) >= self.batchSize:
+                self._condition.notify()
+
+    def flush(self) -> None:
+        """
+        Writes every pending document to the database with a single unordered bulk insert.
+        """
+        with self._flushLock:
+            with self._condition:
+                batch, self._pending = self._pending, []
+                metrics.WRITE_BUFFER.set(0)
+            if not batch:
+                return
+            startTimeFlush = time.time()
+            with metrics.DB_FLUSH_SECONDS.time():
+                results = self._insertBatch([document for _, document in batch])
+            # Counters go first, so the version bump among the updaters comes after every derived collection of the batch is written.
+            inserted = [document for (_, document), result in zip(batch, results) if result == RESULT_INSERTED]
+            for counter in self.counters:
+                self._updateDerivedCollections([counter], inserted if self.watermarks is None else self.watermarks.counted(counter.collection.name, inserted))
+            self._updateDerivedCollections(self.updaters, [document for (_, document), result in zip(batch, results) if result != RESULT_ERROR])
+            for result, name in [(RESULT_INSERTED, "inserted"), (RESULT_DUPLICATE, "duplicate"), (RESULT_ERROR, "error")]:
+                metrics.DB_PIXELS.labels(name).inc(results.count(result))
+            logging.info(f"Flushed {len(batch)} pixels to the database in {round(time.time() - startTimeFlush, 4)} seconds: {results.count(RESULT_INSERTED)} inserted, {results.count(RESULT_DUPLICATE)} duplicates, {results.count(RESULT_ERROR)} errors.")
+            if self.onResult is not None:
+                for (coordinates, _), result in zip(batch, results):
+                    self.onResult(coordinates, result)
+
+    def _insertBatch(self, documents: list[dict]) -> list[int]:
+        results = [RESULT_INSERTED] * len(documents)
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            for writeError in e.details.get("writeErrors", []):
+                results[writeError["index"]] = RESULT_DUPLICATE if writeError["code"] == _DUPLICATE_KEY_ERROR_CODE else RESULT_ERROR
+        except pymongo.errors.PyMongoError as e:
+            logging.error(f"An error occured while inserting a batch of {len(documents)} pixels: {e}")
+            results = [RESULT_ERROR] * len(documents)
+        return results
+
+    def _updateDerivedCollections(self, updaters: list[DerivedCollectionUpdater], documents: list[dict]) -> None:
+        if not documents:
+            return
+        for updater in updaters:
+            try:
+                with metrics.DB_UPDATER_SECONDS.labels(type(updater).__name__).time():
+                    updater.update(documents)
+            except pymongo.errors.PyMongoError as e:
+                logging.error(f"An error occured while running {type(updater).__name__} on a batch of {len(documents)} pixels: {e}")
+
+    def _flushLoop(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) >= self.batchSize, timeout=self.flushInterval)
+            self.flush()
@@ -0,0 +1,87 @@
+"""
+Conditional download of the board image, shared by the services polling `/api/board-image`.
+
+Every request carries the validators of the last board (`If-None-Match` / `If-Modified-Since`) when the upstream sent them,
+and the body of every 200 is hashed against the last one, so a tick whose board did not change is recognised before anything
+decodes it. The counters of the fetcher tell how many ticks could be skipped and why.
+"""
+from typing import Optional
+import hashlib
+import logging
+import requests
+
+SKIPPED_NOT_MODIFIED = "not-modified"
+SKIPPED_IDENTICAL = "identical"
+
+class BoardFrame:
+    """
+    Result of one board download.
+    `skipped` is None if the board changed since the previous download, otherwise why it is known not to have.
+    """
+    def __init__(self, content: bytes, skipped: Optional[str] = None) -> None:
+        self.content = content
+        self.skipped = skipped
+
+    @property
+    def changed(self) -> bool:
+        return self.skipped is None
+
+class BoardFetcher:
+    """
+    Downloads the board image, remembering its validators and the hash of its bytes between calls.
+    """
+    def __init__(self, url: str, headers: Optional[dict] = None, session: Optional[requests.Session] = None, timeout: Optional[float] = 30) -> None:
+        self.url = url
+        self.headers = dict(headers or {})
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.fetched = 0
+        self.skipped = {SKIPPED_NOT_MODIFIED: 0, SKIPPED_IDENTICAL: 0}
+        self._etag: Optional[str] = None
+        self._lastModified: Optional[str] = None
+        self._digest: Optional[bytes] = None
+        self._content: Optional[bytes] = None
+
+    def reset(self) -> None:
+        """
+        Forgets the last board, so the next download is reported as changed.
+        """
+        self._etag = self._lastModified = self._digest = self._content = None
+
+    def fetch(self) -> Optional[BoardFrame]:
+        """
+        Downloads the board and returns it, or None if the request failed or did not return the board.
+        """
+        headers = dict(self.headers)
+        if self._content is not None:
+            if self._etag is not None:
+                headers["If-None-Match"] = self._etag
+            if self._lastModified is not None:
+                headers["If-Modified-Since"] = self._lastModified
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"An error occured while downloading the board: {e}")
+            return None
+        logging.debug(f"Got repspone from the API with status code {response.status_code} in {round(response.elapsed.total_seconds(), 4)} seconds.")
+        if response.status_code == 304 and self._content is not None:
+            return self._skip(SKIPPED_NOT_MODIFIED)
+        if response.status_code != 200:
+            return None
+        self._etag = response.headers.get("ETag")
+        self._lastModified = response.headers.get("Last-Modified")
+        digest = hashlib.blake2b(response.content, digest_size=16).digest()
+        if digest == self._digest:
+            return self._skip(SKIPPED_IDENTICAL)
+        self.fetched += 1
+        self._digest, self._content = digest, response.content
+        return BoardFrame(response.content)
+
+    def _skip(self, reason: str) -> BoardFrame:
+        self.fetched += 1
+        self.skipped[reason] += 1
+        return BoardFrame(self._content, reason)
+
+    @property
+    def skippedTotal(self) -> int:
+        return sum(self.skipped.values())
@@ -0,0 +1,174 @@
+"""
+Palette-indexed representation of the canvas, shared by the services.
+
+The board only ever uses a small palette, so a frame is kept as a (height, width) uint8 array of indices into a `Palette`
+instead of a truecolour image: a quarter of the memory of an RGBA frame, and diffs, checkpoints and archives compare
+or store one byte per pixel. Indices are assigned in the order colours are first seen and never change afterwards,
+so arrays indexed with the same palette stay comparable; PNGs are encoded in palette mode, which round-trips exactly.
+"""
+from io import BytesIO
+from PIL import Image
+from typing import Iterable, Optional
+import numpy
+
+TRANSPARENT = (0, 0, 0, 0)
+MAX_COLOURS = 256
+
+def parseColour(colour: str) -> tuple[int, int, int, int]:
+    """
+    Converts a `#RRGGBB` or `#RRGGBBAA` colour into an RGBA tuple.
+    """
+    value = colour.lstrip("#")
+    if len(value) == 6:
+        value += "FF"
+    return tuple(int(value[i:i + 2], 16) for i in range(0, 8, 2))
+
+def formatColour(colour: tuple[int, int, int, int]) -> str:
+    """
+    Converts an RGBA tuple into a `#RRGGBB` colour, or `#RRGGBBAA` if it is not opaque.
+    """
+    return "#" + "".join(f"{channel:02X}" for channel in (colour if colour[3] != 0xFF else colour[:3]))
+
+def indexedImage(indices: numpy.ndarray, colours: list[tuple[int, int, int, int]]) -> Image.Image:
+    """
+    Returns an array of indices into at most 256 RGBA colours as a palette-mode image.
+    """
+    table = numpy.zeros((MAX_COLOURS, 4), dtype=numpy.uint8)
+    if colours:
+        table[:len(colours)] = colours
+    image = Image.fromarray(numpy.ascontiguousarray(indices, dtype=numpy.uint8), "P")
+    image.putpalette(table[:, :3].tobytes())
+    if (table[:len(colours), 3] != 0xFF).any():
+        image.info["transparency"] = table[:len(colours), 3].tobytes()
+    return image
+
+def encodeIndexedPNG(indices: numpy.ndarray, colours: list[tuple[int, int, int, int]], compressLevel: int = 6) -> bytes:
+    """
+    Encodes an array of indices into at most 256 RGBA colours as a palette-mode PNG, which decodes back to the same colours.
+    """
+    image = indexedImage(indices, colours)
+    output = BytesIO()
+    image.save(output, format="PNG", compress_level=compressLevel, **({"transparency": image.info["transparency"]} if "transparency" in image.info else {}))
+    return output.getvalue()
+
+class Palette:
+    """
+    Append-only mapping between RGBA colours and uint8 indices, holding at most 256 colours.
+    """
+    def __init__(self, colours: Optional[Iterable[tuple[int, int, int, int]]] = None) -> None:
+        """
+        Initialize the palette.
+        colours are assigned the first indices in order, e.g. `[TRANSPARENT]` to reserve index 0 for pixels nobody has placed.
+        """
+        self.colours: list[tuple[int, int, int, int]] = []
+        self._indices: dict[int, int] = {}
+        self._sortedCodes = numpy.zeros(0, dtype=numpy.uint32)
+        self._sortedIndices = numpy.zeros(0, dtype=numpy.uint8)
+        for colour in colours or []:
+            self.indexOf(colour)
+
+    def __len__(self) -> int:
+        return len(self.colours)
+
+    @staticmethod
+    def _code(colour: tuple[int, int, int, int]) -> int:
+        return colour[0] << 24 | colour[1] << 16 | colour[2] << 8 | colour[3]
+
+    def indexOf(self, colour: tuple[int, int, int, int]) -> int:
+        """
+        Returns the index of the colour, adding it to the palette the first time it is seen.
+        Raises ValueError if the palette is full.
+        """
+        colour = tuple(int(channel) for channel in colour)
+        code = self._code(colour)
+        index = self._indices.get(code)
+        if index is None:
+            if len(self.colours) >= MAX_COLOURS:
+                raise ValueError(f"The palette is full, {formatColour(colour)} cannot be added.")
+            index = self._indices[code] = len(self.colours)
+            self.colours.append(colour)
+            codes = numpy.fromiter(self._indices.keys(), dtype=numpy.uint32, count=len(self._indices))
+            order = numpy.argsort(codes)
+            self._sortedCodes = codes[order]
+            self._sortedIndices = numpy.fromiter(self._indices.values(), dtype=numpy.uint8, count=len(self._indices))[order]
+        return index
+
+    def indexOfHex(self, colour: str) -> int:
+        """
+        Returns the index of a `#RRGGBB` or `#RRGGBBAA` colour, adding it to the palette the first time it is seen.
+        """
+        return self.indexOf(parseColour(colour))
+
+    def indexImage(self, image: Image.Image) -> numpy.ndarray:
+        """
+        Converts the image into a (height, width) uint8 array of indices into this palette, adding the colours it has not seen yet.
+        Palette-mode images are mapped through their own palette without expanding them to truecolour.
+        """
+        if image.mode == "P":
+            local = numpy.asarray(image, dtype=numpy.uint8)
+            imagePalette = numpy.array(image.getpalette()[:768], dtype=numpy.uint8)
+            imagePalette = numpy.pad(imagePalette, (0, 768 - len(imagePalette))).reshape(256, 3)
+            alphas = numpy.full(256, 0xFF, dtype=numpy.uint8)
+            transparency = image.info.get("transparency")
+            if isinstance(transparency, bytes):
+                alphas[:len(transparency)] = numpy.frombuffer(transparency, dtype=numpy.uint8)
+            elif isinstance(transparency, int):
+                alphas[transparency] = 0
+            lookup = numpy.zeros(256, dtype=numpy.uint8)
+            for used in numpy.flatnonzero(numpy.bincount(local.ravel(), minlength=256)):
+                lookup[used] = self.indexOf((*imagePalette[used], alphas[used]))
+            return lookup[local]
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        codes = numpy.ascontiguousarray(numpy.asarray(image, dtype=numpy.uint8)).view(">u4")[..., 0].astype(numpy.uint32)
+        # Every colour is looked up in the sorted codes of the palette; only colours missing from it go through the slow path.
+        if len(self.colours):
+            positions = numpy.searchsorted(self._sortedCodes, codes).clip(max=len(self.colours) - 1)
+            missing = self._sortedCodes[positions] != codes
+        else:
+            missing = numpy.ones(codes.shape, dtype=bool)
+        if missing.any():
+            for code in numpy.unique(codes[missing]).tolist():
+                self.indexOf((code >> 24 & 0xFF, code >> 16 & 0xFF, code >> 8 & 0xFF, code & 0xFF))
+            positions = numpy.searchsorted(self._sortedCodes, codes)
+        return self._sortedIndices[positions]
+
+    def lookupTable(self) -> numpy.ndarray:
+        """
+        Returns the (256, 4) uint8 RGBA colour of every index; unassigned indices are transparent.
+        """
+        table = numpy.zeros((MAX_COLOURS, 4), dtype=numpy.uint8)
+        if self.colours:
+            table[:len(self.colours)] = self.colours
+        return table
+
+    def toRGBA(self, indices: numpy.ndarray) -> numpy.ndarray:
+        """
+        Expands an array of indices into a (height, width, 4) RGBA array.
+        """
+        return self.lookupTable()[indices]
+
+    def toImage(self, indices: numpy.ndarray) -> Image.Image:
+        """
+        Returns the array of indices as a palette-mode image.
+        """
+        return indexedImage(indices, self.colours)
+
+    def toPNG(self, indices: numpy.ndarray, compressLevel: int = 6) -> bytes:
+        """
+        Encodes the array of indices as a palette-mode PNG, which decodes back to the same colours.
+        """
+        return encodeIndexedPNG(indices, self.colours, compressLevel)
+
+    def toList(self) -> list[str]:
+        """
+        Returns the colours of the palette in index order, as `#RRGGBB` / `#RRGGBBAA` strings.
+        """
+        return [formatColour(colour) for colour in self.colours]
+
+    @classmethod
+    def fromList(cls, colours: Iterable[str]) -> "Palette":
+        """
+        Restores a palette saved with `toList`.
+        """
+        return cls(parseColour(colour) for colour in colours)
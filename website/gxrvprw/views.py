@@ -1,29 +1,67 @@
 from datetime import tzinfo
+from typing import Optional
 from flask import render_template
 from gxrvprw import app
 import requests
+import threading
+import time
+import os
 from datetime import datetime
 from dateutil import parser as dateparser
 
+_API_URL = os.environ.get("API_URL", "http://api:8000")
+_TIMELAPSES_CACHE_TTL = float(os.environ.get("TIMELAPSES_CACHE_TTL", 30))
+
+_SESSION = requests.Session()
+_TIMELAPSES_CACHE = {"expiresAt": 0.0, "timelapses": None}
+_TIMELAPSES_CACHE_LOCK = threading.Lock()
+
+
+def getLatestTimelapses() -> dict:
+    """
+    Returns the latest timelapse of both intervals, keyed by interval time as a string (None for an interval without any timelapse yet).
+    The response of the API is kept for a short time, and a stale one is served if the API is unavailable;
+    a response missing an interval is not kept, so its timelapse shows up as soon as it is registered.
+    """
+    with _TIMELAPSES_CACHE_LOCK:
+        if _TIMELAPSES_CACHE["timelapses"] is not None and _TIMELAPSES_CACHE["expiresAt"] > time.monotonic():
+            return _TIMELAPSES_CACHE["timelapses"]
+        try:
+            response = _SESSION.get(
+                url=f"{_API_URL}/timelapses/latest/batch",
+                params={
+                    "interval_time": ["60", "15"],
+                },
+                timeout=10,
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            if _TIMELAPSES_CACHE["timelapses"] is None:
+                raise
+            app.logger.exception("Could not refresh the latest timelapses, serving the cached ones.")
+            return _TIMELAPSES_CACHE["timelapses"]
+        timelapses = response.json()["result"]["timelapses"]
+        if any(timelapse is None for timelapse in timelapses.values()):
+            return timelapses
+        _TIMELAPSES_CACHE["timelapses"] = timelapses
+        _TIMELAPSES_CACHE["expiresAt"] = time.monotonic() + _TIMELAPSES_CACHE_TTL
+        return timelapses
+
+
+def describeTimelapse(timelapse: Optional[dict]) -> tuple[Optional[str], Optional[str]]:
+    """
+    Returns the video URL and the formatted date of a timelapse, or None for both when there is no timelapse (the template leaves its video out).
+    """
+    if timelapse is None:
+        return None, None
+    return timelapse["downloadURLs"]["h264"], dateparser.parse(timelapse["date"]).strftime("%Y/%m/%d %H:%M:%S")
+
 
 @app.route("/")
 @app.route("/index.html")
 def main_root():
-    response = requests.get(
-        url="http://api:8000/timelapses/latest",
-        params={
-            "interval_time": "60",
-        },
-    ).json()
-    tl_url_1 = response["result"]["timelapse"]["downloadURLs"]["h264"]
-    tl_time_1 = dateparser.parse(response["result"]["timelapse"]["date"]).strftime("%Y/%m/%d %H:%M:%S")
-    response = requests.get(
-        url="http://api:8000/timelapses/latest",
-        params={
-            "interval_time": "15",
-        },
-    ).json()
-    tl_url_2 = response["result"]["timelapse"]["downloadURLs"]["h264"]
-    tl_time_2 = dateparser.parse(response["result"]["timelapse"]["date"]).strftime("%Y/%m/%d %H:%M:%S")
+    timelapses = getLatestTimelapses()
+    tl_url_1, tl_time_1 = describeTimelapse(timelapses.get("60"))
+    tl_url_2, tl_time_2 = describeTimelapse(timelapses.get("15"))
     currentTime = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
     return render_template("index.html", tl_url_1=tl_url_1, tl_time_1=tl_time_1, tl_url_2=tl_url_2, tl_time_2=tl_time_2, currentTime=currentTime)